@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Comment, Attachment
+from .models import Blob, Comment, Attachment
 
 
 @admin.register(Comment)
@@ -12,8 +12,11 @@ class CommentAdmin(admin.ModelAdmin):
 
 @admin.register(Attachment)
 class AttachmentAdmin(admin.ModelAdmin):
-    list_display = ("id", "comment", "file", "uploaded_at")
+    list_display = ("id", "comment", "name", "file", "uploaded_at")
     list_filter = ("uploaded_at",)
 
 
-
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("id", "sha256", "size", "refcount", "status", "created_at")
+    search_fields = ("sha256",)
@@ -6,4 +6,9 @@ class CommentsConfig(AppConfig):
     name = "comments"
 
     def ready(self):
-        import comments.documents  # noqa: F401
+        from django.conf import settings
+
+        # Registers the index with django_elasticsearch_dsl; skipped without ES
+        if settings.ELASTICSEARCH_ENABLED:
+            import comments.documents  # noqa: F401
+        import comments.signals  # noqa: F401
@@ -0,0 +1,246 @@
+"""
+Native async implementations of the public read endpoints.
+
+Under daphne every sync DRF view runs in asgiref's thread pool; a slow
+database or Elasticsearch call pins a worker thread for its whole
+duration. These views run on the event loop instead:
+
+  - the database through Django's async ORM (async for / acount / aget)
+  - search through the backend's asearch() (AsyncSearch + aiohttp
+    for Elasticsearch, see comments/search.py)
+  - the response cache through the async cache API
+
+They return exactly what the sync views return (same serializers,
+cache entries and validators). The sync view's DRF policies run first:
+authentication, permissions, throttles and content negotiation (in the
+thread pool, authentication may query the database), and errors go
+through its handle_exception(), so EXCEPTION_HANDLER shapes them the same
+way. Writes stay on the sync DRF views: POST on the list endpoint is
+delegated to CommentListCreateView, which applies its policies itself.
+
+Enabled by COMMENTS_ASYNC_VIEWS (see comments/urls.py).
+Compare both with: python manage.py benchmark_async_reads
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import filters
+from rest_framework.utils.encoders import JSONEncoder
+
+from .cache import (
+    Validators,
+    aget_cached,
+    alist_cache_key,
+    aset_cached,
+    athread_versions,
+    conditional_response,
+    detail_cache_key,
+    is_cacheable,
+    thread_root_id_of,
+)
+from .filters import CommentFilterBackend
+from .models import Comment
+from .pagination import CommentListPagination
+from .search import (
+    acached_search,
+    acached_suggest,
+    get_search_backend,
+    parse_search_params,
+    parse_suggest_params,
+    search_payload,
+    suggest_payload,
+)
+from .serializers import CommentSerializer
+from .tree import aload_threads
+from .views import (
+    CommentDetailView,
+    CommentListCreateView,
+    CommentSearchAPIView,
+    CommentSuggestAPIView,
+)
+
+
+class AsyncReadView(View):
+    """
+    Base class: async GET behind the DRF policies of ``schema_view``.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    # Sync DRF view with the same contract, documented in the OpenAPI schema;
+    # its policies (authentication, permissions, throttles) apply here too
+    schema_view = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Same as APIView: token-authenticated API, no CSRF
+        view = csrf_exempt(super().as_view(**initkwargs))
+        if cls.schema_view is not None:
+            # drf-spectacular only enumerates callbacks with an APIView "cls"
+            view.cls = cls.schema_view
+            view.initkwargs = {}
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method == "POST":
+            return await super().dispatch(request, *args, **kwargs)
+
+        # What APIView.dispatch() does around the handler
+        policy = self.schema_view()
+        policy.args, policy.kwargs = args, kwargs
+        policy.request = self.drf_request = policy.initialize_request(request, *args, **kwargs)
+        policy.headers = policy.default_response_headers
+        try:
+            await sync_to_async(policy.initial)(self.drf_request, *args, **kwargs)
+            return await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            response = policy.handle_exception(exc)
+            return policy.finalize_response(self.drf_request, response, *args, **kwargs)
+
+    def render(self, data, status=200):
+        return JsonResponse(
+            data,
+            status=status,
+            safe=False,
+            encoder=JSONEncoder,
+            json_dumps_params={"ensure_ascii": False, "separators": (",", ":")},
+        )
+
+    def get_serializer_context(self):
+        return {"request": self.drf_request, "view": self}
+
+
+class AsyncCommentListView(AsyncReadView):
+    """
+    GET  /api/comments/  async version of CommentListCreateView.list()
+    POST /api/comments/  delegated to CommentListCreateView
+    """
+
+    http_method_names = ["get", "head", "options", "post"]
+    schema_view = CommentListCreateView
+
+    # Read by OrderingFilter / pagination, same as the sync view
+    ordering_fields = CommentListCreateView.ordering_fields
+    ordering = CommentListCreateView.ordering
+
+    create_view = staticmethod(CommentListCreateView.as_view())
+
+    async def post(self, request, *args, **kwargs):
+        # The handler renders the DRF Response (deferred rendering)
+        return await sync_to_async(self.create_view)(request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        for backend in (CommentFilterBackend, filters.OrderingFilter):
+            queryset = backend().filter_queryset(self.drf_request, queryset, self)
+        return queryset
+
+    async def get(self, request, *args, **kwargs):
+        drf_request = self.drf_request
+
+        cache_key = await alist_cache_key(drf_request)
+        entry = await aget_cached(cache_key)
+        if entry is not None:
+            validators = await Validators.acreate(cache_key, entry["threads"])
+            not_modified = conditional_response(request, validators)
+            return not_modified or validators.apply(self.render(entry["data"]))
+
+        queryset = self.filter_queryset(Comment.objects.filter(parent__isnull=True))
+
+        paginator = CommentListPagination()
+        page = await paginator.apaginate_queryset(queryset, drf_request, self)
+        roots = list(page) if page is not None else [c async for c in queryset]
+
+        # Versions are read before the replies are loaded (see comments/cache.py)
+        threads = await athread_versions(thread_root_id_of(r) for r in roots)
+
+        validators = await Validators.acreate(cache_key, threads)
+        not_modified = conditional_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        await aload_threads(roots)
+
+        data = CommentSerializer(roots, many=True, context=self.get_serializer_context()).data
+        if page is not None:
+            data = paginator.get_paginated_response(data).data
+
+        if is_cacheable(roots):
+            await aset_cached(cache_key, threads, data)
+        return validators.apply(self.render(data))
+
+
+class AsyncCommentDetailView(AsyncReadView):
+    """
+    GET /api/comments/<pk>/  async version of CommentDetailView.retrieve()
+    """
+
+    schema_view = CommentDetailView
+    lookup_field = CommentDetailView.lookup_field
+
+    async def get(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+
+        cache_key = detail_cache_key(request, pk)
+        entry = await aget_cached(cache_key)
+        if entry is not None:
+            validators = await Validators.acreate(cache_key, entry["threads"])
+            not_modified = conditional_response(request, validators)
+            return not_modified or validators.apply(self.render(entry["data"]))
+
+        try:
+            comment = await Comment.objects.aget(**{self.lookup_field: pk})
+        except Comment.DoesNotExist:
+            raise Http404("No Comment matches the given query.")
+
+        context = self.get_serializer_context()
+
+        # Comments that were not backfilled have no reliable thread version
+        if not is_cacheable([comment]):
+            await aload_threads([comment])
+            return self.render(CommentSerializer(comment, context=context).data)
+
+        threads = await athread_versions([thread_root_id_of(comment)])
+
+        validators = await Validators.acreate(cache_key, threads)
+        not_modified = conditional_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        await aload_threads([comment])
+
+        data = CommentSerializer(comment, context=context).data
+        await aset_cached(cache_key, threads, data)
+        return validators.apply(self.render(data))
+
+
+class AsyncCommentSearchView(AsyncReadView):
+    """
+    GET /api/comments/search/?q=...  async version of CommentSearchAPIView
+    """
+
+    schema_view = CommentSearchAPIView
+
+    async def get(self, request, *args, **kwargs):
+        backend = get_search_backend()
+        params = parse_search_params(backend, self.drf_request.query_params)
+
+        data = await acached_search(backend, params)
+        return self.render(search_payload(self.drf_request, backend, params, data))
+
+
+class AsyncCommentSuggestView(AsyncReadView):
+    """
+    GET /api/comments/search/suggest/?q=...  async version of CommentSuggestAPIView
+    """
+
+    schema_view = CommentSuggestAPIView
+
+    async def get(self, request, *args, **kwargs):
+        backend = get_search_backend()
+        params = parse_suggest_params(self.drf_request.query_params)
+
+        data = await acached_suggest(backend, params)
+        return self.render(suggest_payload(params, data))
@@ -0,0 +1,130 @@
+"""
+Content-addressed storage of attachment files.
+
+Every distinct upload is stored once, as a Blob keyed by the SHA-256 of
+its bytes (computed while the upload streams in, comments/uploads.py):
+
+    blobs/<h[:2]>/<h[2:4]>/<h>.<ext>
+
+Files already in the storage (direct uploads, comments/direct.py) are
+moved to their blob name instead of being saved again.
+
+Each attachment holds one reference to its blob (Blob.refcount) and
+copies its status and derivatives, so uploading a file that is already
+stored costs one UPDATE: no second copy, no second resize.
+
+When the last attachment of a blob is deleted (comments.signals), the
+blob row goes in the same transaction and its file and derivatives
+(attachments/v/<sha256>/, comments/images.py) are deleted after commit.
+A new blob row always comes with bytes written for it: should the same
+content be uploaded again before the old file is gone, it is stored
+under another name (storage.get_available_name) and the deletion cannot
+take it. Its derivatives are rendered anew the same way.
+"""
+
+import hashlib
+import logging
+import os
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .images import delete_variants
+from .metadata import probe_upload
+from .models import Attachment, Blob
+from .storage import move_file
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = "blobs"
+
+
+def blob_name(digest: str, ext: str) -> str:
+    return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def digest_of(uploaded_file) -> str:
+    """
+    SHA-256 of an upload: the one computed while streaming, or read now
+    (files not parsed by AttachmentMultiPartParser).
+    """
+    digest = getattr(uploaded_file, "sha256", None)
+    if digest:
+        return digest
+
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+def acquire_blob(uploaded_file) -> Blob:
+    """
+    The blob holding the uploaded bytes, with one more reference; stored
+    first if these bytes are new.
+    """
+    digest = digest_of(uploaded_file)
+    storage = Blob._meta.get_field("file").storage
+
+    while True:
+        # Row lock: a concurrent release sees the new reference
+        if Blob.objects.filter(sha256=digest).update(refcount=F("refcount") + 1):
+            return Blob.objects.get(sha256=digest)
+
+        ext = os.path.splitext(uploaded_file.name)[1].lower()
+        metadata = probe_upload(uploaded_file, digest)
+        # Never reuse a file found under the blob's name: it may belong to a
+        # blob released a moment ago, deleted once that release commits
+        stored_name = getattr(uploaded_file, "stored_name", None)
+        if stored_name:
+            name = move_file(storage, stored_name, blob_name(digest, ext))
+        else:
+            name = storage.save(blob_name(digest, ext), uploaded_file)
+
+        # Images are rendered once, by the first attachment's resize task
+        is_image = ext in Attachment.IMAGE_EXTENSIONS
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(
+                    file=name,
+                    refcount=1,
+                    status=Blob.Status.PENDING if is_image else Blob.Status.READY,
+                    **metadata,
+                )
+        except IntegrityError:
+            # Stored concurrently by another upload: take a reference to that one
+            if stored_name:
+                # Back where the caller expects it (and deletes it)
+                move_file(storage, name, stored_name)
+            else:
+                storage.delete(name)
+
+
+def release_blob(blob_id: int) -> int:
+    """
+    Drop one reference; at zero delete the blob (files after commit).
+    Returns the bytes freed.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(id=blob_id).first()
+        if blob is None:
+            return 0
+        if blob.refcount > 1:
+            Blob.objects.filter(id=blob_id).update(refcount=F("refcount") - 1)
+            return 0
+
+        blob.delete()
+        storage, name, variants = blob.file.storage, blob.file.name, blob.variants
+        transaction.on_commit(lambda: _delete_files(storage, name, variants))
+        return blob.size
+
+
+def _delete_files(storage, name: str, variants) -> None:
+    # Both are the released blob's own: a newer blob of the same bytes
+    # has its own file and derivatives
+    try:
+        storage.delete(name)
+    except OSError:
+        logger.exception("Cannot delete %s", name)
+    delete_variants(storage, variants)
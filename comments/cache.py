@@ -0,0 +1,302 @@
+"""
+Versioned response cache for the public comment endpoints.
+
+Every thread (root comment + its replies) has a version counter, and the
+set of root comments has one more. Writes only bump counters (O(1)), they
+never search for cache entries to delete. A cached response stores the
+versions it was built from and is served only while they are unchanged,
+so a stale page is never returned.
+
+The same versions give HTTP validators (ETag / Last-Modified) without
+building the response, see conditional_response().
+
+Functions prefixed with "a" are the async variants used by
+comments.async_views.
+"""
+
+import hashlib
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+ROOTS_VERSION_KEY = "comments:v:roots"
+ROOTS_TOUCHED_KEY = "comments:t:roots"
+# Search results are not per thread: one generation for all of them
+SEARCH_VERSION_KEY = "comments:v:search"
+
+# Versions and touched times expire after this many response lifetimes, so
+# the keys of threads nobody reads any more leave the cache. Losing one is
+# safe: it restarts above every version an old entry was built with.
+VERSION_TIMEOUT_FACTOR = 10
+
+
+def _thread_version_key(root_id: int) -> str:
+    return f"comments:v:thread:{root_id}"
+
+
+def _thread_touched_key(root_id: int) -> str:
+    return f"comments:t:thread:{root_id}"
+
+
+def _initial_version() -> int:
+    # Microsecond clock instead of 0: a counter evicted from the cache
+    # never restarts at a number an old cache entry was built with.
+    return time.time_ns() // 1000
+
+
+def _version_timeout() -> int:
+    lifetime = max(settings.COMMENTS_CACHE_TIMEOUT, settings.COMMENTS_SEARCH_CACHE_TIMEOUT, 60)
+    return VERSION_TIMEOUT_FACTOR * lifetime
+
+
+def _get_or_init(keys: Iterable[str], initial) -> Dict[str, int]:
+    keys = list(keys)
+    values = cache.get_many(keys)
+
+    for key in keys:
+        if key not in values:
+            cache.add(key, initial(), timeout=_version_timeout())
+            values[key] = cache.get(key)
+
+    return values
+
+
+async def _aget_or_init(keys: Iterable[str], initial) -> Dict[str, int]:
+    keys = list(keys)
+    values = await cache.aget_many(keys)
+
+    for key in keys:
+        if key not in values:
+            await cache.aadd(key, initial(), timeout=_version_timeout())
+            values[key] = await cache.aget(key)
+
+    return values
+
+
+def _get_versions(keys: Iterable[str]) -> Dict[str, int]:
+    return _get_or_init(keys, _initial_version)
+
+
+def _bump(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=_version_timeout())
+    else:
+        # incr keeps the old expiry: threads that are still written stay
+        cache.touch(key, _version_timeout())
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+def thread_root_id_of(comment) -> Optional[int]:
+    """
+    Root id of the comment's thread (roots are their own thread root).
+    None for replies created before thread_root was backfilled.
+    """
+    if comment.parent_id is None:
+        return comment.id
+    return comment.thread_root_id
+
+
+def is_cacheable(comments: Iterable[Any]) -> bool:
+    """
+    Only comments with a backfilled path have reliable thread versions.
+    """
+    return all(c.path for c in comments)
+
+
+def thread_versions(root_ids: Iterable[int]) -> Dict[int, int]:
+    root_ids = list(root_ids)
+    versions = _get_versions(_thread_version_key(i) for i in root_ids)
+    return {i: versions[_thread_version_key(i)] for i in root_ids}
+
+
+async def athread_versions(root_ids: Iterable[int]) -> Dict[int, int]:
+    root_ids = list(root_ids)
+    versions = await _aget_or_init((_thread_version_key(i) for i in root_ids), _initial_version)
+    return {i: versions[_thread_version_key(i)] for i in root_ids}
+
+
+def bump_thread(root_id: Optional[int], roots_changed: bool = False) -> None:
+    """
+    Invalidate every cached response that contains the given thread.
+    ``roots_changed`` also invalidates list pages (a root was added/removed
+    or its own attachments changed, which affects list filters).
+    An unknown thread (not backfilled) invalidates all list pages.
+    """
+    touched = {}
+
+    if root_id is not None:
+        _bump(_thread_version_key(root_id))
+        touched[_thread_touched_key(root_id)] = _now()
+    if roots_changed or root_id is None:
+        _bump(ROOTS_VERSION_KEY)
+        touched[ROOTS_TOUCHED_KEY] = _now()
+
+    cache.set_many(touched, timeout=_version_timeout())
+
+
+def bump_search_generation() -> None:
+    """
+    Invalidate every cached search page (a comment was added, removed or
+    reached the search index).
+    """
+    _bump(SEARCH_VERSION_KEY)
+
+
+# -----------------------------------------------------------------------------
+# Cache keys
+# -----------------------------------------------------------------------------
+def list_cache_key(request) -> str:
+    """
+    Key for a list response: scheme + host + normalized query string + roots
+    version. Must be computed BEFORE the list is queried.
+    """
+    roots_version = _get_versions([ROOTS_VERSION_KEY])[ROOTS_VERSION_KEY]
+    return _list_key(request, roots_version)
+
+
+async def alist_cache_key(request) -> str:
+    roots_version = (await _aget_or_init([ROOTS_VERSION_KEY], _initial_version))[ROOTS_VERSION_KEY]
+    return _list_key(request, roots_version)
+
+
+def _list_key(request, roots_version: int) -> str:
+    params = sorted(request.query_params.lists())
+    raw = f"{_origin(request)}|{request.path}|{params}"
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f"comments:list:{roots_version}:{digest}"
+
+
+def detail_cache_key(request, pk: Any) -> str:
+    """
+    Key for a detail response; per origin, like list pages, because the
+    payload holds absolute URLs built from the request.
+    """
+    digest = hashlib.sha1(_origin(request).encode()).hexdigest()
+    return f"comments:detail:{pk}:{digest}"
+
+
+def _origin(request) -> str:
+    return f"{request.scheme}://{request.get_host()}"
+
+
+def search_cache_key(params: Dict[str, Any]) -> str:
+    generation = _get_versions([SEARCH_VERSION_KEY])[SEARCH_VERSION_KEY]
+    return _search_key(params, generation)
+
+
+async def asearch_cache_key(params: Dict[str, Any]) -> str:
+    generation = (await _aget_or_init([SEARCH_VERSION_KEY], _initial_version))[SEARCH_VERSION_KEY]
+    return _search_key(params, generation)
+
+
+def _search_key(params: Dict[str, Any], generation: int) -> str:
+    raw = repr(sorted(params.items()))
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f"comments:search:{generation}:{digest}"
+
+
+# -----------------------------------------------------------------------------
+# Entries
+# -----------------------------------------------------------------------------
+def get_cached(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the cached entry ({"threads": ..., "data": ...}), or None if
+    missing or built from thread versions that have changed since.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+
+    if thread_versions(entry["threads"].keys()) != entry["threads"]:
+        return None
+
+    return entry
+
+
+async def aget_cached(key: str) -> Optional[Dict[str, Any]]:
+    entry = await cache.aget(key)
+    if entry is None:
+        return None
+
+    if await athread_versions(entry["threads"].keys()) != entry["threads"]:
+        return None
+
+    return entry
+
+
+def set_cached(key: str, threads: Dict[int, int], data: Any) -> None:
+    """
+    Store response data together with the thread versions it was built from.
+    ``threads`` must be read before the replies were loaded.
+    """
+    cache.set(
+        key,
+        {"threads": threads, "data": data},
+        timeout=settings.COMMENTS_CACHE_TIMEOUT,
+    )
+
+
+async def aset_cached(key: str, threads: Dict[int, int], data: Any) -> None:
+    await cache.aset(
+        key,
+        {"threads": threads, "data": data},
+        timeout=settings.COMMENTS_CACHE_TIMEOUT,
+    )
+
+
+# -----------------------------------------------------------------------------
+# Conditional GET
+# -----------------------------------------------------------------------------
+class Validators:
+    """
+    ETag / Last-Modified of a response, computed from the cache key and
+    the thread versions only (no tree build, no serialization).
+    """
+
+    def __init__(self, key: str, threads: Dict[int, int], last_modified: Optional[int] = None):
+        raw = f"{key}|{sorted(threads.items())}"
+        self.etag = '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+        if last_modified is None:
+            # Unknown timestamps start at "now": never earlier than the real change
+            last_modified = max(_get_or_init(self.touched_keys(threads), _now).values())
+        self.last_modified = last_modified
+
+    @staticmethod
+    def touched_keys(threads: Dict[int, int]):
+        return [_thread_touched_key(i) for i in threads] + [ROOTS_TOUCHED_KEY]
+
+    @classmethod
+    async def acreate(cls, key: str, threads: Dict[int, int]) -> "Validators":
+        touched = await _aget_or_init(cls.touched_keys(threads), _now)
+        return cls(key, threads, last_modified=max(touched.values()))
+
+    def apply(self, response):
+        response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+def conditional_response(request, validators: Validators):
+    """
+    Return a 304 response if the client's If-None-Match / If-Modified-Since
+    still match, otherwise None.
+    """
+    response = get_conditional_response(
+        request,
+        etag=validators.etag,
+        last_modified=validators.last_modified,
+    )
+    if response is None:
+        return None
+    return validators.apply(response)
@@ -0,0 +1,225 @@
+"""
+Resumable chunked uploads.
+
+Large files on unreliable connections can be sent in pieces instead of
+one multipart request, so a dropped connection costs one chunk, not the
+whole file:
+
+  POST   upload/sessions/                {"file_name", "size", "upload_key"?}
+         -> 201 {"id", "upload_key", "file_name", "size", "offset": 0, "chunk_size"}
+  PUT    upload/sessions/<id>/           raw bytes,
+         Content-Range: bytes <first>-<last>/<size>
+         -> {"offset"}  (409 {"offset"} if <first> is not the current offset)
+  GET    upload/sessions/<id>/           current offset, to resume
+  POST   upload/sessions/<id>/complete/  -> 201 attachment, as POST upload/
+  DELETE upload/sessions/<id>/           abort
+
+Chunks are written at their offset into a spool file under
+COMMENTS_UPLOAD_SESSION_DIR, copied from the request stream in
+COPY_BLOCK_BYTES blocks (a chunk is never held in memory). The offset
+only moves forward with a conditional UPDATE, so a retried chunk racing
+the original is answered with 409 and the current offset.
+
+Completion streams the assembled file through AttachmentUploadHandler
+(same checks and SHA-256 as a multipart upload) and stores it as a
+temporary Attachment with the session's upload_key: bound to a comment
+like any two-step upload. Passing the upload_key of an earlier upload
+groups the files for one comment.
+
+Direct uploads (comments/direct.py) use the same sessions and completion;
+their bytes are posted to object storage instead of PUT here.
+
+A session belongs to the user who started it: for anyone else every
+session URL answers 404.
+
+Sessions idle for COMMENTS_UPLOAD_SESSION_TTL are deleted by the cleanup
+task (comments/cleanup.py).
+"""
+
+import logging
+import os
+import re
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, ValidationError
+
+from .direct import open_staged, remove_staged, staging_name
+from .models import Attachment, UploadSession
+from .uploads import KINDS, SNIFF_BYTES, AttachmentUploadHandler, signature_matches
+
+logger = logging.getLogger(__name__)
+
+COPY_BLOCK_BYTES = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class OffsetMismatch(Exception):
+    """
+    The chunk does not continue the upload (or the upload is not complete
+    yet); ``offset`` is where the client has to resume.
+    """
+
+    def __init__(self, offset: int):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def spool_path(session: UploadSession) -> str:
+    return os.path.join(settings.COMMENTS_UPLOAD_SESSION_DIR, f"{session.id}.part")
+
+
+def create_session(user, file_name: str, size: int, upload_key=None, direct: bool = False) -> UploadSession:
+    """
+    Checks the extension and the per-type size limit before any data is
+    sent.
+    """
+    file_name = os.path.basename(file_name)
+    handler = AttachmentUploadHandler()
+    handler.new_file("file_name", file_name, None, size)
+    if size > handler.limit:
+        raise ValidationError({"size": [f"File size must be <= {filesizeformat(handler.limit)}."]})
+
+    fields = {"upload_key": upload_key} if upload_key else {}
+    session = UploadSession.objects.create(user=user, file_name=file_name, size=size, direct=direct, **fields)
+    if direct:
+        return session
+
+    os.makedirs(settings.COMMENTS_UPLOAD_SESSION_DIR, exist_ok=True)
+    open(spool_path(session), "wb").close()
+    return session
+
+
+def parse_content_range(header: Optional[str], session: UploadSession) -> Tuple[int, int]:
+    """
+    (start, end) of the chunk, end exclusive.
+    """
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise ParseError("Content-Range must be 'bytes <first>-<last>/<size>'.")
+
+    first, last, total = (int(group) for group in match.groups())
+    if total != session.size or last < first or last >= total:
+        raise ParseError("Content-Range does not match the upload.")
+    if last - first + 1 > settings.COMMENTS_UPLOAD_CHUNK_BYTES:
+        raise ParseError(f"Chunks must be <= {filesizeformat(settings.COMMENTS_UPLOAD_CHUNK_BYTES)}.")
+    return first, last + 1
+
+
+def write_chunk(session: UploadSession, start: int, end: int, stream) -> int:
+    """
+    Copy bytes [start, end) from ``stream`` into the spool file; returns
+    the new offset.
+    """
+    if session.direct:
+        raise ParseError("This upload is sent to object storage.")
+    if session.attachment_id or start != session.offset:
+        raise OffsetMismatch(session.offset)
+
+    path = spool_path(session)
+    written = 0
+    with open(path, "r+b") as fh:
+        fh.seek(start)
+        while written < end - start:
+            block = stream.read(min(COPY_BLOCK_BYTES, end - start - written))
+            if not block:
+                break
+            fh.write(block)
+            written += len(block)
+
+    if start == 0:
+        # Refuse a disguised file now, not after the whole upload
+        with open(path, "rb") as fh:
+            head = fh.read(SNIFF_BYTES)
+        kind = KINDS[os.path.splitext(session.file_name)[1].lower()]
+        if len(head) >= min(SNIFF_BYTES, session.size) and not signature_matches(kind, head):
+            abort_session(session)
+            raise ValidationError({"file": ["File content does not match its extension."]})
+
+    offset = start + written
+    advanced = UploadSession.objects.filter(
+        id=session.id, offset=start, attachment__isnull=True
+    ).update(offset=offset, updated_at=timezone.now())
+    if not advanced:
+        session.refresh_from_db(fields=["offset"])
+        raise OffsetMismatch(session.offset)
+
+    if offset < end:
+        raise ParseError(f"Chunk ended early; resume from offset {offset}.")
+    return offset
+
+
+def complete_session(session_id, user) -> Tuple[Attachment, bool]:
+    """
+    Turn a fully received session of ``user`` into a temporary Attachment;
+    returns (attachment, created). Completing a completed session returns
+    its attachment again.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session_id, user=user)
+        if session.attachment_id:
+            return session.attachment, False
+
+        if session.direct:
+            fh = open_staged(session)
+            if fh is None:
+                raise OffsetMismatch(0)
+        else:
+            if session.offset != session.size:
+                raise OffsetMismatch(session.offset)
+            fh = open(spool_path(session), "rb")
+
+        handler = AttachmentUploadHandler()
+        handler.new_file("file", session.file_name, None, session.size)
+
+        with fh:
+            for block in iter(lambda: fh.read(COPY_BLOCK_BYTES), b""):
+                handler.receive_data_chunk(block, None)
+            handler.file_complete(session.size)
+
+            fh.seek(0)
+            upload = File(fh, name=session.file_name)
+            upload.sha256 = handler.digests["file"][0]
+            if session.direct:
+                # Already in the storage: moved, not uploaded again (comments/blobs.py)
+                upload.stored_name = staging_name(session)
+            attachment = Attachment(file=upload, upload_key=session.upload_key)
+            attachment.full_clean()
+            attachment.save()
+
+        session.attachment = attachment
+        session.offset = session.size
+        session.save(update_fields=["attachment", "offset", "updated_at"])
+        transaction.on_commit(lambda: discard_upload(session))
+
+    return attachment, True
+
+
+def abort_session(session: UploadSession) -> None:
+    discard_upload(session)
+    session.delete()
+
+
+def discard_upload(session: UploadSession) -> None:
+    """
+    Delete the received bytes: spool file, or staged object of a direct
+    upload.
+    """
+    if session.direct:
+        remove_staged(session)
+    else:
+        remove_spool(spool_path(session))
+
+
+def remove_spool(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.exception("Cannot delete %s", path)
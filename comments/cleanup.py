@@ -0,0 +1,199 @@
+"""
+Garbage collection of abandoned temporary attachments.
+
+Two-step uploads (POST /api/comments/upload/) are stored under
+attachments/tmp/<upload_key>/ with comment=NULL until a comment binds
+them. Uploads never bound within COMMENTS_TMP_ATTACHMENT_TTL are deleted,
+row and file, by the cleanup_orphaned_attachments beat task or the
+cleanup_attachments command.
+
+Each batch locks its rows (skip_locked): an upload being bound right now
+is skipped, and a row deleted here can no longer be bound.
+
+Blob-backed uploads (comments/blobs.py) only drop their reference: the
+file goes with the blob's last attachment.
+
+Resumable upload sessions (comments/chunked.py) idle for
+COMMENTS_UPLOAD_SESSION_TTL are deleted with their spool files (staged
+objects for direct uploads).
+
+Image derivatives (comments/images.py) go with their blob or attachment;
+files under attachments/v/ that their source no longer lists (re-rendered,
+or the source's deletion crashed) are deleted once older than the
+attachment TTL, so a resize task still running keeps its output.
+"""
+
+import logging
+import os
+import re
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .chunked import discard_upload, spool_path
+from .direct import staged_size
+from .images import VARIANT_DIR, variant_names
+from .models import Attachment, Blob, UploadSession
+from .storage import remove_empty_dir
+
+logger = logging.getLogger(__name__)
+
+
+def orphaned_attachments(ttl_seconds: Optional[int] = None):
+    ttl_seconds = settings.COMMENTS_TMP_ATTACHMENT_TTL if ttl_seconds is None else ttl_seconds
+    cutoff = timezone.now() - timedelta(seconds=ttl_seconds)
+    # Served by the partial index attachment_unbound_idx
+    return Attachment.objects.filter(comment__isnull=True, uploaded_at__lt=cutoff)
+
+
+def collect_orphaned_attachments(
+    ttl_seconds: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Delete unbound attachments older than the TTL, oldest first, in
+    batches of ``batch_size``. Returns {"attachments": <deleted>, "bytes":
+    <reclaimed>, "batches": <run>}; with ``dry_run`` nothing is deleted
+    and the numbers are what would be.
+    """
+    batch_size = batch_size or settings.COMMENTS_TMP_GC_BATCH_SIZE
+    queryset = orphaned_attachments(ttl_seconds).order_by("uploaded_at", "id")
+    totals = {"attachments": 0, "bytes": 0, "batches": 0}
+
+    if dry_run:
+        for attachment in queryset.select_related("blob").iterator(chunk_size=batch_size):
+            totals["attachments"] += 1
+            totals["bytes"] += _file_size(attachment)
+        totals["batches"] = -(-totals["attachments"] // batch_size)
+        return totals
+
+    while max_batches is None or totals["batches"] < max_batches:
+        deleted, reclaimed = _collect_batch(queryset, batch_size)
+        if not deleted:
+            break
+        totals["attachments"] += deleted
+        totals["bytes"] += reclaimed
+        totals["batches"] += 1
+
+    return totals
+
+
+@transaction.atomic
+def _collect_batch(queryset, batch_size: int):
+    batch = list(queryset.select_for_update(skip_locked=True)[:batch_size])
+    if not batch:
+        return 0, 0
+
+    reclaimed = 0
+    blob_ids = {attachment.blob_id for attachment in batch if attachment.blob_id}
+    blob_sizes = dict(Blob.objects.filter(id__in=blob_ids).values_list("id", "size"))
+
+    files = []
+    for attachment in batch:
+        if attachment.blob_id or not attachment.file:
+            continue
+        reclaimed += _file_size(attachment)
+        files.append((attachment.file.storage, attachment.file.name))
+
+    # Releases the blobs (comments.signals.attachment_deleted)
+    Attachment.objects.filter(id__in=[a.id for a in batch]).delete()
+    # Only once the rows are gone: a rollback keeps rows and files
+    transaction.on_commit(lambda: _delete_files(files))
+
+    freed = blob_ids - set(Blob.objects.filter(id__in=blob_ids).values_list("id", flat=True))
+    reclaimed += sum(blob_sizes[blob_id] for blob_id in freed)
+    return len(batch), reclaimed
+
+
+def _delete_files(files) -> None:
+    for storage, name in files:
+        try:
+            storage.delete(name)
+        except OSError:
+            # The row is gone; a leftover file is only wasted space
+            logger.exception("Cannot delete %s", name)
+        else:
+            remove_empty_dir(storage, name)
+
+
+def collect_stale_upload_sessions(ttl_seconds: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Delete upload sessions not touched within the TTL. Returns
+    {"sessions": <deleted>, "bytes": <spool / staged bytes reclaimed>}.
+    """
+    ttl_seconds = settings.COMMENTS_UPLOAD_SESSION_TTL if ttl_seconds is None else ttl_seconds
+    cutoff = timezone.now() - timedelta(seconds=ttl_seconds)
+    totals = {"sessions": 0, "bytes": 0}
+
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+        if session.direct:
+            totals["bytes"] += staged_size(session)
+        else:
+            try:
+                totals["bytes"] += os.path.getsize(spool_path(session))
+            except OSError:
+                pass  # completed (spool removed) or already gone
+        totals["sessions"] += 1
+        if not dry_run:
+            # A completed session's attachment stays (collected as an upload)
+            UploadSession.objects.filter(id=session.id).delete()
+            discard_upload(session)
+
+    return totals
+
+
+def collect_stale_derivatives(ttl_seconds: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Delete derivative files not listed by their blob / attachment and older
+    than the TTL. Returns {"derivatives": <deleted>, "bytes": <reclaimed>}.
+    """
+    ttl_seconds = settings.COMMENTS_TMP_ATTACHMENT_TTL if ttl_seconds is None else ttl_seconds
+    cutoff = timezone.now() - timedelta(seconds=ttl_seconds)
+    storage = Attachment._meta.get_field("file").storage
+    totals = {"derivatives": 0, "bytes": 0}
+
+    try:
+        scopes, _ = storage.listdir(VARIANT_DIR)
+    except FileNotFoundError:
+        return totals  # nothing rendered yet
+
+    for scope in scopes:
+        if re.fullmatch(r"[0-9a-f]{64}", scope):
+            variants = Blob.objects.filter(sha256=scope).values_list("variants", flat=True).first()
+        elif re.fullmatch(r"a\d+", scope):
+            variants = Attachment.objects.filter(id=scope[1:]).values_list("variants", flat=True).first()
+        else:
+            continue
+        listed = set(variant_names(variants))
+
+        _, files = storage.listdir(f"{VARIANT_DIR}/{scope}")
+        for file_name in files:
+            name = f"{VARIANT_DIR}/{scope}/{file_name}"
+            if name in listed or storage.get_modified_time(name) >= cutoff:
+                continue
+            totals["derivatives"] += 1
+            totals["bytes"] += storage.size(name)
+            if not dry_run:
+                storage.delete(name)
+                remove_empty_dir(storage, name)
+
+    return totals
+
+
+def _file_size(attachment: Attachment) -> int:
+    if attachment.blob_id:
+        # Shared blobs stay
+        return attachment.blob.size if attachment.blob.refcount == 1 else 0
+    if not attachment.file:
+        return 0
+    if attachment.size is not None:
+        return attachment.size
+    try:
+        return attachment.file.storage.size(attachment.file.name)
+    except (OSError, NotImplementedError):
+        return 0  # already gone
@@ -1,47 +1,297 @@
-from asgiref.sync import sync_to_async
+import asyncio
+import json
+import time
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.db.models import Max, Min, Q
+
+from .events import ROOTS_GROUP, thread_group, with_seq
+from .models import CommentEvent
 
-from .models import Comment
-from .serializers import CommentSerializer
+# Close code for a client that fell too far behind; it should re-fetch
+# the list and reconnect without last_seq
+RESYNC_CLOSE_CODE = 4000
 
 
 class CommentsConsumer(AsyncJsonWebsocketConsumer):
-    group_name = "comments"
+    """
+    Sockets only receive events they subscribed to:
+
+      - new root comments ("roots", on by default)
+      - replies inside specific threads (by root comment id)
+
+    Client -> server:
+      {"action": "subscribe", "threads": [1, 2], "roots": true, "replace": true,
+       "last_seq": 123}
+      {"action": "unsubscribe", "threads": [1], "roots": false}
+      {"action": "ack", "seq": 123}
+
+    Server -> client ack:
+      {"type": "subscriptions", "threads": [...], "roots": true|false, "seq": <latest>}
+
+    Events: "comment_created", "attachment_ready" (an uploaded image was
+    resized; payload = the attachment; thread subscribers only, also on
+    roots), see comments.events.
+
+    Every event carries a "seq" (comments.models.CommentEvent id). A client
+    that reconnects sends the last seq it saw and gets only the missed
+    events of its subscriptions, replayed from the log. If the gap is older
+    than the log (COMMENTS_EVENT_LOG_SIZE) or longer than
+    COMMENTS_EVENT_REPLAY_LIMIT, it gets {"type": "resync"} instead.
+
+    Events arriving within COMMENTS_WS_COALESCE_MS are sent as ONE frame:
+      {"type": "comments_batch", "events": [<event>, ...]}
+    If more than COMMENTS_WS_MAX_PENDING events pile up before the next
+    frame goes out (a burst, or a long replay), they are dropped and the
+    client gets {"type": "resync"} instead (it should re-fetch the list).
+
+    Slow clients: the ASGI send() does not wait for the client to read
+    (daphne buffers the socket), so the client acknowledges the last seq it
+    has processed. Once it has acked, every frame with events stays
+    outstanding until acked; with COMMENTS_WS_MAX_UNACKED frames
+    outstanding, or the oldest one older than COMMENTS_WS_MAX_LAG_SECONDS,
+    the next frame closes the socket with RESYNC_CLOSE_CODE instead of
+    buffering more. Clients that never ack are not tracked.
+    """
 
     async def connect(self):
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        self.threads = set()
+        self.roots = False
+
+        self.pending = []
+        self.flush_task = None
+        self.needs_resync = False
+        # Slow-client tracking starts with the first ack; entries are
+        # (highest seq, sent at) of frames the client has not acked yet
+        self.acking = False
+        self.unacked = []
+        # Seqs sent by the last replay, so live duplicates are skipped
+        self.replayed = set()
+
         await self.accept()
+        await self._set_roots(True)
 
     async def disconnect(self, code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+
+        for root_id in list(self.threads):
+            await self.channel_layer.group_discard(thread_group(root_id), self.channel_name)
+        if self.roots:
+            await self.channel_layer.group_discard(ROOTS_GROUP, self.channel_name)
 
     async def receive_json(self, content, **kwargs):
-        # Client -> server messages are not required now
-        return
+        if not isinstance(content, dict):
+            return await self._error("Expected a JSON object.")
 
-    async def comment_created(self, event):
+        action = content.get("action")
+        if action == "ack":
+            return await self._ack(content.get("seq"))
+        if action not in {"subscribe", "unsubscribe"}:
+            return await self._error("Unknown action.")
+
+        threads = content.get("threads") or []
+        if not isinstance(threads, list) or not all(
+            isinstance(x, int) and not isinstance(x, bool) and x > 0 for x in threads
+        ):
+            return await self._error("'threads' must be a list of comment ids.")
+
+        last_seq = content.get("last_seq")
+        if last_seq is not None and (
+            not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0
+        ):
+            return await self._error("'last_seq' must be a non-negative integer.")
+
+        if action == "subscribe":
+            wanted = set(threads) if content.get("replace") else self.threads | set(threads)
+            if len(wanted) > settings.COMMENTS_WS_MAX_SUBSCRIPTIONS:
+                return await self._error(
+                    f"At most {settings.COMMENTS_WS_MAX_SUBSCRIPTIONS} threads per socket."
+                )
+            await self._set_threads(wanted)
+            if "roots" in content:
+                await self._set_roots(bool(content["roots"]))
+        else:
+            await self._set_threads(self.threads - set(threads))
+            if content.get("roots"):
+                await self._set_roots(False)
+
+        # Joined the groups first: nothing published from now on is lost,
+        # events that overlap with the replay are skipped via self.replayed
+        if action == "subscribe" and last_seq is not None:
+            latest = await self._replay(last_seq)
+        else:
+            latest = await self._latest_seq()
+
+        await self.send_json(
+            {
+                "type": "subscriptions",
+                "threads": sorted(self.threads),
+                "roots": self.roots,
+                "seq": latest,
+            }
+        )
+
+    async def _set_threads(self, wanted):
+        for root_id in self.threads - wanted:
+            await self.channel_layer.group_discard(thread_group(root_id), self.channel_name)
+        for root_id in wanted - self.threads:
+            await self.channel_layer.group_add(thread_group(root_id), self.channel_name)
+        self.threads = set(wanted)
+
+    async def _set_roots(self, enabled: bool):
+        if enabled and not self.roots:
+            await self.channel_layer.group_add(ROOTS_GROUP, self.channel_name)
+        elif not enabled and self.roots:
+            await self.channel_layer.group_discard(ROOTS_GROUP, self.channel_name)
+        self.roots = enabled
+
+    async def _error(self, detail: str):
+        await self.send_json({"type": "error", "detail": detail})
+
+    async def _ack(self, seq):
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+            return await self._error("'seq' must be a non-negative integer.")
+
+        self.acking = True
+        self.unacked = [frame for frame in self.unacked if frame[0] > seq]
+
+    # -------------------------------------------------------------------------
+    # Resume
+    # -------------------------------------------------------------------------
+    @database_sync_to_async
+    def _latest_seq(self) -> int:
+        return CommentEvent.objects.aggregate(latest=Max("id"))["latest"] or 0
+
+    @database_sync_to_async
+    def _missed_events(self, last_seq: int):
         """
-        event = {"type": "comment_created", "comment_id": <int>}
+        Events after last_seq for the current subscriptions, or None if
+        they cannot be replayed (pruned from the log or too many).
         """
-        comment_id = event.get("comment_id")
-        if not comment_id:
-            return
+        bounds = CommentEvent.objects.aggregate(oldest=Min("id"), latest=Max("id"))
+        latest = bounds["latest"] or 0
+        if latest <= last_seq:
+            return latest, []
+        if bounds["oldest"] > last_seq + 1:
+            # Part of the gap was already pruned
+            return latest, None
+
+        subscribed = Q(thread_root_id__in=self.threads)
+        if self.roots:
+            subscribed |= Q(thread_root_id__isnull=True)
+
+        limit = settings.COMMENTS_EVENT_REPLAY_LIMIT
+        rows = list(
+            CommentEvent.objects.filter(subscribed, id__gt=last_seq, id__lte=latest)
+            .order_by("id")
+            .values_list("id", "text")[: limit + 1]
+        )
+        if len(rows) > limit:
+            return latest, None
+        return latest, rows
+
+    async def _replay(self, last_seq: int) -> int:
+        latest, rows = await self._missed_events(last_seq)
 
-        data = await self._get_serialized_comment(comment_id)
-        if data is None:
+        if rows is None:
+            self.replayed = set()
+            self.pending = []
+            self.needs_resync = True
+            if self.flush_task is None:
+                self.flush_task = asyncio.ensure_future(self._flush_later())
+            return latest
+
+        self.replayed = {seq for seq, _ in rows}
+        for seq, text in rows:
+            await self._enqueue(seq, with_seq(seq, text))
+        return latest
+
+    # -------------------------------------------------------------------------
+    # Outbound events (coalescing, burst limit, slow clients)
+    # -------------------------------------------------------------------------
+    async def _enqueue(self, seq, text: str):
+        if self.needs_resync:
+            # Client will re-fetch everything anyway
             return
 
-        await self.send_json({"type": "comment_created", "payload": data})
+        self.pending.append((seq, text))
+        if len(self.pending) > settings.COMMENTS_WS_MAX_PENDING:
+            self.pending = []
+            self.needs_resync = True
+
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
 
-    @sync_to_async
-    def _get_serialized_comment(self, comment_id: int):
+    async def _flush_later(self):
         try:
-            comment = (
-                Comment.objects.select_related("parent")
-                .prefetch_related("attachments", "children")
-                .get(pk=comment_id)
-            )
-        except Comment.DoesNotExist:
-            return None
-
-        return CommentSerializer(comment).data
+            window = settings.COMMENTS_WS_COALESCE_MS / 1000
+            if window > 0:
+                await asyncio.sleep(window)
+
+            # Sending may be slow; new events keep accumulating meanwhile
+            while self.pending or self.needs_resync:
+                if self.needs_resync:
+                    self.needs_resync = False
+                    await self.send(text_data=json.dumps({"type": "resync"}))
+                    continue
+
+                if self._is_lagging():
+                    self.pending = []
+                    await self.close(code=RESYNC_CLOSE_CODE)
+                    return
+
+                batch, self.pending = self.pending, []
+                texts = [text for _, text in batch]
+                if len(texts) == 1:
+                    await self.send(text_data=texts[0])
+                else:
+                    # Events are already JSON: join them without re-encoding
+                    await self.send(
+                        text_data='{"type": "comments_batch", "events": [' + ",".join(texts) + "]}"
+                    )
+
+                seqs = [seq for seq, _ in batch if seq is not None]
+                if self.acking and seqs:
+                    self.unacked.append((max(seqs), time.monotonic()))
+        finally:
+            self.flush_task = None
+
+    def _is_lagging(self) -> bool:
+        if not self.unacked:
+            return False
+        if len(self.unacked) >= settings.COMMENTS_WS_MAX_UNACKED:
+            return True
+        return time.monotonic() - self.unacked[0][1] > settings.COMMENTS_WS_MAX_LAG_SECONDS
+
+    async def comment_created(self, event):
+        """
+        event = {"type": "comment_created", "comment_id": <int>, "seq": <int>,
+                 "text": <rendered frame>}
+
+        The frame is rendered once by comments.events.publish_comment_created,
+        so this only queues it.
+        """
+        if event.get("seq") in self.replayed:
+            return
+
+        text = event.get("text")
+        if text is None:
+            comment_id = event.get("comment_id")
+            if not comment_id:
+                return
+            text = json.dumps({"type": "comment_created", "comment_id": comment_id})
+
+        await self._enqueue(event.get("seq"), text)
+
+    async def attachment_ready(self, event):
+        """
+        event = {"type": "attachment_ready", "comment_id": <int>, "seq": <int>,
+                 "text": <rendered frame>}
+        """
+        if event.get("seq") in self.replayed or event.get("text") is None:
+            return
+
+        await self._enqueue(event.get("seq"), event["text"])
@@ -0,0 +1,108 @@
+"""
+Direct uploads to object storage.
+
+With attachments in an S3-compatible bucket (AWS_STORAGE_BUCKET_NAME),
+clients can send the bytes straight to the bucket instead of through
+Django:
+
+  POST upload/direct/                     {"file_name", "size", "upload_key"?}
+       -> 201 {"id", "upload_key", "file_name", "size", ...,
+               "post": {"url", "fields", "expires_in"}}
+  POST <post.url>                         multipart form: <post.fields> + "file"
+       (to the bucket, without credentials)
+  POST upload/sessions/<id>/complete/     -> 201 attachment, as POST upload/
+
+The presigned POST policy allows one key only (the session's staging
+object, incoming/<session id>/<file name>), exactly the declared size and
+the content type of the extension, for COMMENTS_DIRECT_UPLOAD_EXPIRES
+seconds.
+
+Completion reads the staged object once through AttachmentUploadHandler
+(same checks and SHA-256 as any upload) and registers it as a blob
+(comments/blobs.py): moved to blobs/... with a server-side copy, or just
+referenced when these bytes are stored already. The staged object is
+deleted either way; abandoned ones go with their session (cleanup task).
+
+Without object storage upload/direct/ answers 404 and clients fall back
+to multipart or chunked uploads.
+"""
+
+from typing import Any, Dict
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from .metadata import content_type_for
+from .models import Attachment, UploadSession
+from .storage import is_s3_storage
+
+STAGING_DIR = "incoming"
+
+
+def _storage():
+    return Attachment._meta.get_field("file").storage
+
+
+def direct_uploads_enabled() -> bool:
+    return is_s3_storage(_storage())
+
+
+def staging_name(session: UploadSession) -> str:
+    return f"{STAGING_DIR}/{session.id}/{_storage().get_valid_name(session.file_name)}"
+
+
+def presigned_post(session: UploadSession) -> Dict[str, Any]:
+    """
+    URL and form fields for POSTing the session's file to the bucket.
+    """
+    storage = _storage()
+    content_type = content_type_for(session.file_name)
+    expires_in = settings.COMMENTS_DIRECT_UPLOAD_EXPIRES
+
+    post = storage.bucket.meta.client.generate_presigned_post(
+        storage.bucket.name,
+        storage._normalize_name(staging_name(session)),
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", session.size, session.size],
+        ],
+        ExpiresIn=expires_in,
+    )
+    return {"url": _public_url(post["url"]), "fields": post["fields"], "expires_in": expires_in}
+
+
+def _public_url(url: str) -> str:
+    # The policy is signed, not the host: the browser may use another endpoint
+    public = settings.COMMENTS_S3_PUBLIC_ENDPOINT_URL
+    if not public:
+        return url
+    base, parts = urlsplit(public), urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, ""))
+
+
+def open_staged(session: UploadSession):
+    """
+    The uploaded object, opened for reading; None if the client has not
+    uploaded it (yet).
+    """
+    storage, name = _storage(), staging_name(session)
+    if not storage.exists(name):
+        return None
+    if storage.size(name) != session.size:
+        raise ValidationError({"file": ["Uploaded file does not match the declared size."]})
+    return storage.open(name, "rb")
+
+
+def staged_size(session: UploadSession) -> int:
+    storage, name = _storage(), staging_name(session)
+    try:
+        return storage.size(name) if storage.exists(name) else 0
+    except OSError:
+        return 0
+
+
+def remove_staged(session: UploadSession) -> None:
+    # Deleting a missing key is not an error on S3
+    _storage().delete(staging_name(session))
@@ -1,12 +1,23 @@
+from typing import Any, Dict, List, Optional, Union
+
+from django.conf import settings
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
+from elasticsearch_dsl import AsyncSearch, async_connections
 
 from .models import Comment
 
+# Alias of the AsyncElasticsearch client used by the async views
+ASYNC_ALIAS = "async"
+
 
 @registry.register_document
 class CommentDocument(Document):
     id = fields.IntegerField(attr="id")
+    # ".suggest": search_as_you_type (edge n-grams + shingles) for the
+    # suggest endpoint; existing indexes need reindex_comments
+    user_name = fields.TextField(attr="user_name", fields={"suggest": fields.SearchAsYouTypeField()})
+    text = fields.TextField(attr="text", fields={"suggest": fields.SearchAsYouTypeField()})
 
     class Index:
         name = "comments"
@@ -18,8 +29,104 @@ class CommentDocument(Document):
     class Django:
         model = Comment
         fields = [
-            "user_name",
             "email",
-            "text",
             "created_at",
         ]
+
+
+def comment_search_query(
+    search,
+    q: str,
+    size: int,
+    after: Optional[List[Any]] = None,
+    track_total_hits: Union[bool, int] = True,
+):
+    """
+    Full-text query of the search endpoint; works on Search and AsyncSearch.
+
+    Ordered by (_score, id) so ``after`` (the "sort" of the last hit of
+    the previous page) continues with search_after, without from/size.
+    ``track_total_hits`` may be a number: counting stops there.
+    """
+    search = (
+        search.query(
+            "multi_match",
+            query=q,
+            fields=["text", "user_name", "email"],
+            fuzziness="AUTO",
+        )
+        .sort({"_score": {"order": "desc"}}, {"id": {"order": "desc"}})
+        .extra(size=size, track_total_hits=track_total_hits)
+    )
+    if after:
+        search = search.extra(search_after=after)
+    return search
+
+
+SUGGEST_FIELDS = [
+    "user_name.suggest",
+    "user_name.suggest._2gram",
+    "user_name.suggest._3gram",
+    "text.suggest",
+    "text.suggest._2gram",
+    "text.suggest._3gram",
+]
+
+
+def comment_suggest_query(search, q: str, size: int):
+    """
+    Prefix query of the suggest endpoint (last word may be incomplete).
+    No scoring of totals, only the fields a suggestion shows.
+    """
+    return (
+        search.query("multi_match", query=q, type="bool_prefix", fields=SUGGEST_FIELDS)
+        .source(["user_name", "text"])
+        .extra(size=size, track_total_hits=False)
+    )
+
+
+def async_search() -> AsyncSearch:
+    """
+    AsyncSearch over the comments index.
+    The AsyncElasticsearch client (aiohttp) is created on first use.
+    """
+    try:
+        async_connections.get_connection(ASYNC_ALIAS)
+    except KeyError:
+        async_connections.create_connection(ASYNC_ALIAS, **settings.ELASTICSEARCH_DSL["default"])
+    return AsyncSearch(using=ASYNC_ALIAS, index=CommentDocument._index._name)
+
+
+def search_results(res) -> Dict[str, Any]:
+    """
+    {"total", "total_relation", "items", "after"} from an executed search response.
+    "after" is the sort key of the last hit (the search_after of the next page).
+    """
+    items = [
+        {
+            "id": int(hit.id),
+            "user_name": getattr(hit, "user_name", None),
+            "email": getattr(hit, "email", None),
+            "text": getattr(hit, "text", None),
+            "created_at": getattr(hit, "created_at", None),
+        }
+        for hit in res
+    ]
+
+    total = getattr(res.hits, "total", None)
+    total_value = getattr(total, "value", len(items)) if total else len(items)
+    relation = getattr(total, "relation", "eq") if total else "eq"
+    after = list(res.hits[-1].meta.sort) if len(res.hits) else None
+
+    return {"total": total_value, "total_relation": relation, "items": items, "after": after}
+
+
+def suggest_results(res) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": int(hit.meta.id),
+            "user_name": getattr(hit, "user_name", None),
+            "text": getattr(hit, "text", None),
+        }
+        for hit in res
+    ]
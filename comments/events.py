@@ -0,0 +1,176 @@
+import json
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from .cache import thread_root_id_of
+from .models import Attachment, Comment, CommentEvent
+from .serializers import AttachmentSerializer, CommentSerializer
+from .tree import load_threads
+
+# New root comments
+ROOTS_GROUP = "comments.roots"
+
+# pg_advisory_xact_lock key serializing appends to the replay log
+EVENT_LOG_LOCK = 0x636D7473
+
+
+def thread_group(root_id: int) -> str:
+    """
+    Channel group of one thread (root comment + all its replies).
+    """
+    return f"comments.thread.{root_id}"
+
+
+def _root_id_of(comment: Comment) -> int:
+    root_id = thread_root_id_of(comment)
+    if root_id is not None:
+        return root_id
+
+    # Reply created before thread_root was backfilled: walk up the parents
+    node = comment
+    while node.parent_id is not None:
+        node = node.parent
+    return node.id
+
+
+def _event_root_id(comment: Comment) -> Optional[int]:
+    # None: a new root, sent to ROOTS_GROUP
+    return None if comment.parent_id is None else _root_id_of(comment)
+
+
+def _group(thread_root_id: Optional[int]) -> str:
+    return ROOTS_GROUP if thread_root_id is None else thread_group(thread_root_id)
+
+
+def render_comment_created(comment: Comment) -> str:
+    """
+    Render the WebSocket frame for a new comment.
+
+    Frames above COMMENTS_WS_MAX_FRAME_BYTES (huge texts, many attachments)
+    are replaced by an id-only frame; clients then fetch
+    /api/comments/<id>/ themselves.
+    """
+    load_threads([comment])
+    payload = CommentSerializer(comment).data
+
+    text = json.dumps(
+        {"type": "comment_created", "payload": payload},
+        cls=JSONEncoder,
+        ensure_ascii=False,
+    )
+    if len(text.encode()) <= settings.COMMENTS_WS_MAX_FRAME_BYTES:
+        return text
+
+    return json.dumps(
+        {"type": "comment_created", "comment_id": comment.id, "parent": comment.parent_id}
+    )
+
+
+def with_seq(seq: int, text: str) -> str:
+    """
+    Prepend the sequence number to a rendered frame (no re-encoding).
+    """
+    return '{"seq": %d, ' % seq + text[1:]
+
+
+def log_event(kind: str, comment: Comment, text: str, thread_root_id: Optional[int]) -> CommentEvent:
+    """
+    Append an event to the replay log; its id is the sequence number.
+    ``thread_root_id`` is the thread whose subscribers get the event, None
+    for a new root.
+
+    Appends are serialized until commit (an advisory lock on PostgreSQL,
+    SQLite has one writer anyway), so ids are committed in order: once
+    seq N+1 is visible, every lower seq is too, and a client resuming from
+    N+1 cannot miss N. The lock is held for one INSERT.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [EVENT_LOG_LOCK])
+        return CommentEvent.objects.create(
+            kind=kind,
+            comment_id=comment.id,
+            thread_root_id=thread_root_id,
+            text=text,
+        )
+
+
+def prune_events() -> int:
+    """
+    Keep the newest COMMENTS_EVENT_LOG_SIZE events (prune_comment_events
+    beat task). Returns the number of rows deleted.
+    """
+    cutoff = (
+        CommentEvent.objects.order_by("-id")
+        .values_list("id", flat=True)[settings.COMMENTS_EVENT_LOG_SIZE:]
+        .first()
+    )
+    if cutoff is None:
+        return 0
+    deleted, _ = CommentEvent.objects.filter(id__lte=cutoff).delete()
+    return deleted
+
+
+def publish_comment_created(comment: Comment) -> None:
+    """
+    Serialize the comment ONCE and send the rendered frame to the sockets
+    subscribed to it: new roots go to ROOTS_GROUP, replies only to the
+    group of their thread. Consumers forward the text without touching
+    the database.
+
+    The frame is also stored in the replay log, so reconnecting sockets
+    get only the events they missed (see CommentsConsumer).
+    """
+    text = render_comment_created(comment)
+    root_id = _event_root_id(comment)
+    event = log_event("comment_created", comment, text, root_id)
+
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        _group(root_id),
+        {
+            "type": "comment_created",
+            "comment_id": comment.id,
+            "seq": event.id,
+            "text": with_seq(event.id, text),
+        },
+    )
+
+
+def publish_attachment_ready(attachment: Attachment) -> None:
+    """
+    An image attachment finished processing (or failed): send its new
+    state to the sockets subscribed to its thread. Also for attachments of
+    a root comment: this is not a new root, so ROOTS_GROUP does not get it.
+
+      {"type": "attachment_ready", "comment_id": <int>, "payload": <attachment>}
+    """
+    comment = attachment.comment
+    text = json.dumps(
+        {
+            "type": "attachment_ready",
+            "comment_id": comment.id,
+            "payload": AttachmentSerializer(attachment).data,
+        },
+        cls=JSONEncoder,
+        ensure_ascii=False,
+    )
+    root_id = _root_id_of(comment)
+    event = log_event("attachment_ready", comment, text, root_id)
+
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        thread_group(root_id),
+        {
+            "type": "attachment_ready",
+            "comment_id": comment.id,
+            "seq": event.id,
+            "text": with_seq(event.id, text),
+        },
+    )
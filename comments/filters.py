@@ -0,0 +1,102 @@
+from datetime import datetime, time
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Attachment
+
+
+class CommentFilterBackend(BaseFilterBackend):
+    """
+    Index-backed filters for the root comment list.
+
+    - ?email=<address>                 exact author email (comment_root_email_idx)
+    - ?created_after=<date|datetime>   inclusive lower bound (comment_root_created_idx)
+    - ?created_before=<date|datetime>  exclusive upper bound (comment_root_created_idx)
+    - ?has_attachments=1|0             EXISTS on the attachment.comment_id index
+    """
+
+    TRUE_VALUES = {"1", "true", "yes"}
+    FALSE_VALUES = {"0", "false", "no"}
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        email = (params.get("email") or "").strip()
+        if email:
+            queryset = queryset.filter(email=email)
+
+        created_after = self._parse_moment(params, "created_after")
+        if created_after is not None:
+            queryset = queryset.filter(created_at__gte=created_after)
+
+        created_before = self._parse_moment(params, "created_before")
+        if created_before is not None:
+            queryset = queryset.filter(created_at__lt=created_before)
+
+        has_attachments = (params.get("has_attachments") or "").strip().lower()
+        if has_attachments in self.TRUE_VALUES | self.FALSE_VALUES:
+            attached = Exists(Attachment.objects.filter(comment_id=OuterRef("pk")))
+            if has_attachments in self.TRUE_VALUES:
+                queryset = queryset.filter(attached)
+            else:
+                queryset = queryset.filter(~attached)
+
+        return queryset
+
+    @staticmethod
+    def _parse_moment(params, name):
+        raw = (params.get(name) or "").strip()
+        if not raw:
+            return None
+
+        try:
+            value = parse_datetime(raw)
+            if value is None:
+                day = parse_date(raw)
+                if day is not None:
+                    value = datetime.combine(day, time.min)
+        except ValueError:
+            value = None
+
+        if value is None:
+            raise serializers.ValidationError({name: ["Expected a date or ISO 8601 datetime."]})
+
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": "email",
+                "required": False,
+                "in": "query",
+                "description": "Exact author email.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "created_after",
+                "required": False,
+                "in": "query",
+                "description": "Created at or after (date or ISO 8601 datetime).",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "created_before",
+                "required": False,
+                "in": "query",
+                "description": "Created before (date or ISO 8601 datetime).",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "has_attachments",
+                "required": False,
+                "in": "query",
+                "description": "Only comments with (1) or without (0) attachments.",
+                "schema": {"type": "boolean"},
+            },
+        ]
@@ -0,0 +1,190 @@
+"""
+Image derivatives of attachments.
+
+The resize task (comments.tasks.resize_attachment_image) renders every
+uploaded image in VARIANT sizes, each in the original format and as WebP:
+
+  - "thumb"    Attachment.MAX_IMAGE_WIDTH x MAX_IMAGE_HEIGHT (320x240)
+  - "display"  COMMENTS_IMAGE_DISPLAY_WIDTH x HEIGHT, for the lightbox
+
+The original upload is kept as is. Derivatives are named by their
+content hash, under a directory of the source they were rendered from:
+
+    attachments/v/<scope>/<h>.<ext>     h = sha256 of the encoded bytes
+    scope = the blob's SHA-256, or a<attachment id> for files stored
+            before blobs existed
+
+so a URL always means the same bytes: nginx serves attachments/v/ as
+immutable for a year, and a new upload under an old file name gets new
+URLs. Every rendering writes its own files: if the name is taken (a
+re-render, or a new blob of the same bytes while the old one's files
+still wait for their on-commit deletion) the storage picks another one
+(get_available_name), so deleting one source's derivatives can never
+remove another's. They are deleted with their blob (comments/blobs.py)
+or attachment (comments.signals), and
+comments.cleanup.collect_stale_derivatives removes those left behind
+(re-rendered, or lost to a crash).
+
+Attachment.variants:
+    {"thumb": {"width": 320, "height": 240, "src": <name>, "webp": <name>},
+     "display": {...}}       (no "display" if it would equal "thumb")
+"""
+
+import hashlib
+import io
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, UnidentifiedImageError
+
+from .models import Attachment
+from .storage import remove_empty_dir
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = "attachments/v"
+
+# Pillow format -> file extension of the derivatives
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif"}
+
+
+def variant_sizes() -> Dict[str, tuple]:
+    """
+    Largest first: each variant is scaled down from the previous one.
+    """
+    return {
+        "display": (settings.COMMENTS_IMAGE_DISPLAY_WIDTH, settings.COMMENTS_IMAGE_DISPLAY_HEIGHT),
+        "thumb": (Attachment.MAX_IMAGE_WIDTH, Attachment.MAX_IMAGE_HEIGHT),
+    }
+
+
+def variant_scope(attachment: Attachment) -> str:
+    """
+    Directory of the attachment's derivatives, below VARIANT_DIR.
+    """
+    if attachment.blob_id:
+        return attachment.blob.sha256
+    return f"a{attachment.id}"
+
+
+def variant_names(variants) -> List[str]:
+    """
+    All derivative files of an Attachment.variants / Blob.variants value.
+    """
+    return [v[key] for v in (variants or {}).values() for key in ("src", "webp")]
+
+
+def delete_variants(storage, variants) -> None:
+    for name in variant_names(variants):
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.exception("Cannot delete %s", name)
+        else:
+            remove_empty_dir(storage, name)
+
+
+def build_variants(storage, file_name: str, scope: str) -> Optional[Dict[str, Any]]:
+    """
+    Render and store the derivatives of one image under VARIANT_DIR/<scope>/;
+    None if the file is not a supported image.
+
+    JPEGs are decoded at reduced scale (draft: DCT scaling by 1/2 .. 1/8,
+    down to COMMENTS_IMAGE_REDUCING_GAP x the largest variant), so a
+    24-megapixel photo is never decoded at full size.
+    """
+    sizes = variant_sizes()
+    gap = settings.COMMENTS_IMAGE_REDUCING_GAP
+
+    with storage.open(file_name, "rb") as fh:
+        try:
+            img = Image.open(fh)
+        except (OSError, UnidentifiedImageError):
+            return None
+
+        with img:
+            img_format = (img.format or "").upper()
+            if img_format not in FORMAT_EXTENSIONS:
+                return None
+
+            largest = max(sizes.values())
+            img.draft(img.mode, (int(largest[0] * gap), int(largest[1] * gap)))
+            source = _resizable(img)
+
+            ext = FORMAT_EXTENSIONS[img_format]
+            variants = {}
+            for name, size in sizes.items():
+                source = source.copy()
+                source.thumbnail(size, reducing_gap=gap)
+                variants[name] = {
+                    "width": source.width,
+                    "height": source.height,
+                    "src": _store(storage, scope, _encode(source, img_format), ext),
+                    "webp": _store(storage, scope, _encode(_webp_ready(source), "WEBP"), "webp"),
+                }
+
+    display, thumb = variants.get("display"), variants["thumb"]
+    if display and (display["width"], display["height"]) == (thumb["width"], thumb["height"]):
+        del variants["display"]
+    return variants
+
+
+def variant_urls(attachment: Attachment) -> Dict[str, Optional[str]]:
+    """
+    {"thumb", "display", "srcset", "webp_srcset"} for AttachmentSerializer;
+    all None until the variants exist (pending, not an image, old rows).
+    """
+    variants = attachment.variants or {}
+    if "thumb" not in variants:
+        return {"thumb": None, "display": None, "srcset": None, "webp_srcset": None}
+
+    storage = attachment.file.storage
+    ordered = [variants[name] for name in ("thumb", "display") if name in variants]
+
+    def srcset(key: str) -> str:
+        return ", ".join(f"{storage.url(v[key])} {v['width']}w" for v in ordered)
+
+    return {
+        "thumb": storage.url(variants["thumb"]["src"]),
+        "display": storage.url(ordered[-1]["src"]),
+        "srcset": srcset("src"),
+        "webp_srcset": srcset("webp"),
+    }
+
+
+def _resizable(img: Image.Image) -> Image.Image:
+    # Palette images resize with nearest-neighbour only; CMYK cannot go to WebP
+    if img.mode == "P":
+        return img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        return img.convert("RGB")
+    img.load()
+    return img
+
+
+def _webp_ready(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGB", "RGBA"):
+        return img
+    return img.convert("RGBA" if img.mode == "LA" else "RGB")
+
+
+def _encode(img: Image.Image, img_format: str) -> bytes:
+    buf = io.BytesIO()
+    if img_format == "JPEG":
+        img.convert("RGB" if img.mode in ("RGBA", "LA") else img.mode).save(
+            buf, "JPEG", quality=85, optimize=True, progressive=True
+        )
+    elif img_format == "WEBP":
+        img.save(buf, "WEBP", quality=settings.COMMENTS_IMAGE_WEBP_QUALITY, method=4)
+    else:
+        img.save(buf, img_format, optimize=True)
+    return buf.getvalue()
+
+
+def _store(storage, scope: str, data: bytes, ext: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    # Never reuse an existing file: it may belong to a released blob of the
+    # same bytes and be deleted once that transaction commits
+    return storage.save(f"{VARIANT_DIR}/{scope}/{digest}.{ext}", ContentFile(data))
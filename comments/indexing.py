@@ -0,0 +1,187 @@
+"""
+Queued Elasticsearch indexing.
+
+Writes never call Elasticsearch. Signals add the comment id to a Redis
+sorted set on commit (score = enqueue time in µs) and schedule the
+index_pending_comments Celery task, which drains the set in batches
+through the bulk API:
+
+  - an id saved many times before the task runs is indexed once
+    (set membership = deduplication)
+  - rows that no longer exist are deleted from the index
+  - ids are removed only after Elasticsearch accepted them, and only if
+    they were not re-enqueued meanwhile (see _REMOVE_IF_UNCHANGED)
+
+Lag = age of the oldest pending id, see queue_stats().
+
+While reindex_comments builds a new index, batches are also sent to it
+(the "shadow" index), and their ids are remembered so the command can
+send them once more after its bulk load (a delete processed before the
+load reached that row would otherwise be overwritten by the load).
+"""
+
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "comments:es:pending"
+SCHEDULED_KEY = "comments:es:scheduled"
+SHADOW_INDEX_KEY = "comments:es:shadow_index"
+SHADOW_TOUCHED_KEY = "comments:es:shadow_touched"
+
+# Remove members whose score is still the one we read (not re-enqueued)
+_REMOVE_IF_UNCHANGED = """
+local removed = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+_client = None
+
+
+def get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.COMMENTS_INDEX_QUEUE_URL)
+    return _client
+
+
+def _now_us() -> int:
+    # Microseconds: a re-enqueue right after claim_batch() gets a new score
+    return time.time_ns() // 1000
+
+
+def enqueue(comment_ids: Iterable[int]) -> None:
+    """
+    Queue comments for (re)indexing and make sure a drain task is scheduled.
+    Call on commit: the task must see the committed rows.
+    """
+    now = _now_us()
+    mapping = {str(i): now for i in comment_ids}
+    if not mapping:
+        return
+
+    get_client().zadd(PENDING_KEY, mapping)
+    schedule()
+
+
+def schedule() -> None:
+    """
+    Schedule a drain task unless one is already pending.
+    The flag expires, so a lost task does not stall the queue for good.
+    """
+    delay = settings.COMMENTS_INDEX_DELAY
+    if get_client().set(SCHEDULED_KEY, 1, nx=True, ex=max(delay * 10, 30)):
+        from .tasks import index_pending_comments
+
+        index_pending_comments.apply_async(countdown=delay)
+
+
+def claim_batch(size: int) -> List[Tuple[int, str]]:
+    """
+    Oldest pending ids with their scores (as Redis stores them).
+    """
+    rows = get_client().zrange(PENDING_KEY, 0, size - 1, withscores=True)
+    return [(int(member), _score_str(score)) for member, score in rows]
+
+
+def _score_str(score: float) -> str:
+    # ZSCORE returns integral scores without a decimal part
+    return str(int(score)) if score == int(score) else repr(score)
+
+
+def release(batch: List[Tuple[int, str]]) -> int:
+    """
+    Remove processed ids, except the ones enqueued again since claim_batch().
+    """
+    if not batch:
+        return 0
+    args = [str(value) for pair in batch for value in pair]
+    return get_client().eval(_REMOVE_IF_UNCHANGED, 1, PENDING_KEY, *args)
+
+
+def clear_scheduled() -> None:
+    get_client().delete(SCHEDULED_KEY)
+
+
+def set_shadow_index(name: str) -> None:
+    # Expires in case the reindex process dies without cleaning up
+    get_client().set(SHADOW_INDEX_KEY, name, ex=24 * 3600)
+
+
+def clear_shadow_index() -> None:
+    get_client().delete(SHADOW_INDEX_KEY, SHADOW_TOUCHED_KEY)
+
+
+def pop_shadow_touched(count: int) -> List[int]:
+    """
+    Ids indexed while a shadow index was set (up to ``count``, removed).
+    """
+    return [int(member) for member in get_client().spop(SHADOW_TOUCHED_KEY, count) or []]
+
+
+def queue_stats() -> Dict[str, float]:
+    """
+    {"pending": <ids waiting>, "lag_seconds": <age of the oldest one>}
+    """
+    client = get_client()
+    pending = client.zcard(PENDING_KEY)
+    oldest = client.zrange(PENDING_KEY, 0, 0, withscores=True)
+    lag = (_now_us() - oldest[0][1]) / 1_000_000 if oldest else 0.0
+    return {"pending": pending, "lag_seconds": max(lag, 0.0)}
+
+
+def index_batch(comment_ids: List[int], track_shadow: bool = True) -> List[int]:
+    """
+    Send one bulk request for the given ids: index existing comments,
+    delete missing ones. Returns the ids that failed with a retryable
+    error (they stay queued). Connection errors propagate.
+    """
+    from .documents import CommentDocument
+
+    document = CommentDocument()
+    index_name = document._index._name
+
+    comments = list(document.get_queryset().filter(id__in=comment_ids))
+    found = {c.id for c in comments}
+
+    actions = list(document.get_actions(comments, "index"))
+    actions += [
+        {"_op_type": "delete", "_index": index_name, "_id": comment_id}
+        for comment_id in comment_ids
+        if comment_id not in found
+    ]
+
+    client = get_client()
+    shadow = client.get(SHADOW_INDEX_KEY)
+    if shadow:
+        actions += [{**action, "_index": shadow.decode()} for action in actions]
+        if track_shadow:
+            client.sadd(SHADOW_TOUCHED_KEY, *comment_ids)
+            client.expire(SHADOW_TOUCHED_KEY, 24 * 3600)
+
+    _, errors = document.bulk(actions, raise_on_error=False)
+
+    retry = []
+    for error in errors:
+        (op_type, item), = error.items()
+        status = item.get("status", 0)
+        if op_type == "delete" and status == 404:
+            continue  # never indexed / already gone
+        if status == 429 or status >= 500:
+            retry.append(int(item["_id"]))
+        else:
+            logger.error("Cannot index comment %s: %s", item.get("_id"), item.get("error"))
+
+    if retry:
+        logger.warning("Comments re-queued after bulk errors: %s", retry)
+    return retry
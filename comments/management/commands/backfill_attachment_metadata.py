@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import django
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+# Spawned workers import this module before django.setup(), so models
+# are imported where they are used, not here.
+
+
+def _init_worker():
+    # A fresh interpreter per worker: no DB connections inherited by fork
+    django.setup()
+
+
+def _probe(name: str, checksum: bool):
+    from comments.metadata import probe_stored
+    from comments.models import Attachment
+
+    return probe_stored(Attachment._meta.get_field("file").storage, name, checksum=checksum)
+
+
+class Command(BaseCommand):
+    """
+    Fill width / height / size / content_type / sha256 for attachments
+    stored before these columns existed (comments/metadata.py).
+
+    1) blobs without metadata: headers read in a process pool
+    2) blob-backed attachments: copied from their blob in SQL
+    3) attachments stored before blobs: files read (and hashed) in the pool
+
+    Reading and hashing files is CPU and I/O bound, so it runs in
+    --workers processes; the main process only queries and bulk-updates.
+    Safe to re-run; rows with a content_type are skipped.
+    """
+
+    help = "Backfill attachment metadata columns using a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (default: CPU count).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows probed and updated per batch (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        from comments.metadata import FIELDS
+        from comments.models import Attachment, Blob
+
+        batch_size = options["batch_size"]
+        self.workers = max(1, options["workers"])
+        context = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context, initializer=_init_worker
+        ) as pool:
+            blobs = self._probe_rows(
+                pool,
+                Blob.objects.filter(content_type=""),
+                ("width", "height", "content_type"),
+                batch_size,
+                checksum=False,  # size and sha256 are known
+            )
+            copied = self._copy_from_blobs(batch_size)
+            files = self._probe_rows(
+                pool,
+                Attachment.objects.filter(blob__isnull=True, content_type=""),
+                FIELDS,
+                batch_size,
+                checksum=True,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done. {blobs} blobs probed, {copied} attachments copied from blobs, "
+                f"{files} older attachments probed."
+            )
+        )
+
+    def _probe_rows(self, pool, queryset, fields, batch_size, checksum):
+        model_name = queryset.model._meta.verbose_name_plural
+        total, last_id = 0, 0
+
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).order_by("id")[:batch_size])
+            if not batch:
+                return total
+
+            names = [row.file.name for row in batch]
+            chunksize = max(1, len(names) // (self.workers * 4))
+            for row, metadata in zip(batch, pool.map(_probe, names, repeat(checksum), chunksize=chunksize)):
+                for field in fields:
+                    setattr(row, field, metadata[field])
+            queryset.model.objects.bulk_update(batch, fields)
+
+            total += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Probed {total} {model_name}...")
+
+    def _copy_from_blobs(self, batch_size):
+        from comments.metadata import FIELDS
+        from comments.models import Attachment, Blob
+
+        blob = Blob.objects.filter(id=OuterRef("blob_id"))
+        values = {field: Subquery(blob.values(field)[:1]) for field in FIELDS}
+        pending = Attachment.objects.filter(blob__isnull=False, content_type="")
+        total = 0
+
+        while True:
+            ids = list(pending.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += Attachment.objects.filter(id__in=ids).update(**values)
+            self.stdout.write(f"Copied metadata to {total} attachments...")
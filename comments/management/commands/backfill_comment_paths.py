@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from comments.models import Comment, path_segment
+
+
+class Command(BaseCommand):
+    """
+    Fill thread_root / depth / path for comments created before
+    these columns existed.
+
+    Works top-down in chunks: a comment is processed once its parent
+    has a path, so every pass only touches rows that can be completed.
+    Safe to re-run; already filled rows are skipped.
+    """
+
+    help = "Backfill Comment.thread_root, depth and path in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows updated per transaction (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        total = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Comment.objects.select_related("parent")
+                    .filter(path="")
+                    .filter(Q(parent__isnull=True) | ~Q(parent__path=""))
+                    .order_by("id")[:chunk_size]
+                )
+                if not batch:
+                    break
+
+                for comment in batch:
+                    parent = comment.parent
+                    if parent is None:
+                        comment.thread_root_id = comment.id
+                        comment.depth = 0
+                        comment.path = path_segment(comment.id)
+                    else:
+                        comment.thread_root_id = parent.thread_root_id
+                        comment.depth = parent.depth + 1
+                        comment.path = parent.path + path_segment(comment.id)
+
+                Comment.objects.bulk_update(batch, ["thread_root", "depth", "path"])
+
+            total += len(batch)
+            self.stdout.write(f"Backfilled {total} comments...")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {total} comments backfilled."))
@@ -0,0 +1,192 @@
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncRequestFactory, override_settings
+
+from comments.async_views import (
+    AsyncCommentDetailView,
+    AsyncCommentListView,
+    AsyncCommentSearchView,
+    AsyncCommentSuggestView,
+)
+from comments.models import Comment
+from comments.views import (
+    CommentDetailView,
+    CommentListCreateView,
+    CommentSearchAPIView,
+    CommentSuggestAPIView,
+)
+
+
+class Command(BaseCommand):
+    """
+    Compare the sync DRF read views with the native async ones under the
+    same concurrency, in one process (fixed memory budget).
+
+    Sync views are called the way Django's ASGI handler calls them
+    (sync_to_async, thread-sensitive), async views are awaited directly.
+    Middleware and the network are not part of the measurement.
+
+    Example:
+        python manage.py benchmark_async_reads --requests 2000 --concurrency 100
+        python manage.py benchmark_async_reads --endpoint search --query hello
+        python manage.py benchmark_async_reads --endpoint suggest --query hel
+    """
+
+    help = "Benchmark sync vs async comment read views (throughput, latency, threads, memory)."
+
+    ENDPOINTS = ("list", "detail", "search", "suggest")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoint",
+            choices=self.ENDPOINTS,
+            action="append",
+            help="Endpoint to benchmark (repeatable, default: list and detail).",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=1000,
+            help="Requests per endpoint and variant (default: 1000).",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Requests in flight at the same time (default: 50).",
+        )
+        parser.add_argument(
+            "--query",
+            default="comment",
+            help="Query for the search / suggest endpoints (default: comment).",
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            help="Report peak Python allocations (tracemalloc; slows every variant down).",
+        )
+        parser.add_argument(
+            "--use-cache",
+            action="store_true",
+            help="Keep the response cache on (by default every request hits the database).",
+        )
+
+    def handle(self, *args, **options):
+        endpoints = options["endpoint"] or ["list", "detail"]
+
+        root = Comment.objects.filter(parent__isnull=True).order_by("-id").first()
+        if root is None and "detail" in endpoints:
+            raise CommandError("No comments to read; create some first.")
+
+        overrides = (
+            {} if options["use_cache"] else {"COMMENTS_CACHE_TIMEOUT": 0, "COMMENTS_SEARCH_CACHE_TIMEOUT": 0}
+        )
+
+        self.stdout.write(
+            f"{'endpoint':<8} {'variant':<6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'threads':>8} {'peak MiB':>9}"
+        )
+        with override_settings(**overrides):
+            for endpoint in endpoints:
+                path, kwargs = self.target(endpoint, root, options["query"])
+                sync_view, async_view = self.views(endpoint)
+
+                for variant, view in (("sync", sync_view), ("async", async_view)):
+                    stats = asyncio.run(
+                        self.run(
+                            view,
+                            variant,
+                            path,
+                            kwargs,
+                            options["requests"],
+                            options["concurrency"],
+                            options["trace_memory"],
+                        )
+                    )
+                    peak = f"{stats['peak_mib']:.1f}" if stats["peak_mib"] is not None else "-"
+                    self.stdout.write(
+                        f"{endpoint:<8} {variant:<6} {stats['rps']:>9.1f} {stats['p50']:>8.2f} "
+                        f"{stats['p95']:>8.2f} {stats['p99']:>8.2f} {stats['threads']:>8} {peak:>9}"
+                    )
+
+    def target(self, endpoint: str, root, query: str):
+        if endpoint == "list":
+            return "/api/comments/", {}
+        if endpoint == "detail":
+            return f"/api/comments/{root.id}/", {"pk": root.id}
+        if endpoint == "suggest":
+            return f"/api/comments/search/suggest/?q={query}", {}
+        return f"/api/comments/search/?q={query}", {}
+
+    def views(self, endpoint: str):
+        if endpoint == "list":
+            return CommentListCreateView.as_view(), AsyncCommentListView.as_view()
+        if endpoint == "detail":
+            return CommentDetailView.as_view(), AsyncCommentDetailView.as_view()
+        if endpoint == "suggest":
+            return CommentSuggestAPIView.as_view(), AsyncCommentSuggestView.as_view()
+        return CommentSearchAPIView.as_view(), AsyncCommentSearchView.as_view()
+
+    async def run(
+        self, view, variant: str, path: str, kwargs, total: int, concurrency: int, trace_memory: bool
+    ):
+        factory = AsyncRequestFactory()
+        # Any host the views accept (they build absolute links / cache keys)
+        host = next((h for h in settings.ALLOWED_HOSTS if h != "*" and not h.startswith(".")), "localhost")
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        max_threads = threading.active_count()
+
+        if variant == "sync":
+
+            def call_sync(request):
+                response = view(request, **kwargs)
+                return response.render() if hasattr(response, "render") else response
+
+            call = sync_to_async(call_sync)
+        else:
+
+            async def call(request):
+                return await view(request, **kwargs)
+
+        async def one():
+            nonlocal max_threads
+            async with semaphore:
+                started = time.perf_counter()
+                request = factory.get(path)
+                request.META["HTTP_HOST"] = host
+                response = await call(request)
+                latencies.append((time.perf_counter() - started) * 1000)
+                max_threads = max(max_threads, threading.active_count())
+
+                if response.status_code != 200:
+                    raise CommandError(f"{variant} {path}: HTTP {response.status_code}")
+
+        if trace_memory:
+            tracemalloc.start()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            "rps": total / elapsed,
+            "p50": statistics.median(latencies),
+            "p95": latencies[int(len(latencies) * 0.95) - 1],
+            "p99": latencies[max(int(len(latencies) * 0.99) - 1, 0)],
+            "threads": max_threads,
+            "peak_mib": peak / 2**20 if peak is not None else None,
+        }
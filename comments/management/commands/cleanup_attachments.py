@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from comments.cleanup import (
+    collect_orphaned_attachments,
+    collect_stale_derivatives,
+    collect_stale_upload_sessions,
+)
+
+
+class Command(BaseCommand):
+    """
+    Delete temporary uploads never bound to a comment, idle resumable
+    upload sessions and stale image derivatives (comments/cleanup.py). The cleanup_orphaned_attachments
+    beat task does the same periodically.
+
+    Example:
+        python manage.py cleanup_attachments --dry-run
+        python manage.py cleanup_attachments --ttl-hours 6 --batch-size 1000
+    """
+
+    help = "Delete unbound temporary attachments older than the TTL and report reclaimed bytes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl-hours",
+            type=float,
+            default=None,
+            help="Age after which an unbound upload is deleted (default: COMMENTS_TMP_ATTACHMENT_TTL).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Attachments per transaction (default: COMMENTS_TMP_GC_BATCH_SIZE).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        ttl = options["ttl_hours"]
+        ttl_seconds = settings.COMMENTS_TMP_ATTACHMENT_TTL if ttl is None else int(ttl * 3600)
+
+        stats = collect_orphaned_attachments(
+            ttl_seconds=ttl_seconds,
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+
+        sessions = collect_stale_upload_sessions(dry_run=options["dry_run"])
+        derivatives = collect_stale_derivatives(ttl_seconds=ttl_seconds, dry_run=options["dry_run"])
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {stats['attachments']} attachment(s) older than {ttl_seconds / 3600:g}h "
+                f"in {stats['batches']} batch(es), {filesizeformat(stats['bytes'])} "
+                f"({stats['bytes']} bytes) reclaimed"
+            )
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {sessions['sessions']} upload session(s) idle for "
+                f"{settings.COMMENTS_UPLOAD_SESSION_TTL / 3600:g}h, "
+                f"{filesizeformat(sessions['bytes'])} ({sessions['bytes']} bytes) reclaimed"
+            )
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {derivatives['derivatives']} stale image derivative(s), "
+                f"{filesizeformat(derivatives['bytes'])} ({derivatives['bytes']} bytes) reclaimed"
+            )
+        )
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from comments import indexing
+from comments.tasks import index_pending_comments
+
+
+class Command(BaseCommand):
+    """
+    Show the Elasticsearch indexing queue (comments/indexing.py).
+
+    Example:
+        python manage.py index_queue_status
+        python manage.py index_queue_status --drain
+    """
+
+    help = "Report pending comment ids and indexing lag; optionally drain the queue now."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Run the indexing task in this process until the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.ELASTICSEARCH_ENABLED:
+            raise CommandError("Elasticsearch is disabled (ELASTICSEARCH_ENABLED=0).")
+
+        if options["drain"]:
+            while indexing.queue_stats()["pending"]:
+                index_pending_comments.apply(throw=True)
+
+        stats = indexing.queue_stats()
+        self.stdout.write(f"pending: {stats['pending']}")
+        self.stdout.write(f"lag:     {stats['lag_seconds']:.1f}s")
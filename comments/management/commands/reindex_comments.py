@@ -0,0 +1,187 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import parallel_bulk
+
+from comments import indexing
+
+# Catch-up bulk requests retried after retryable (429 / 5xx) errors
+CATCH_UP_RETRIES = 5
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the comments index without downtime.
+
+    1. create a versioned index (comments_<timestamp>) with refresh off
+       and no replicas
+    2. stream all comments into it (server-side cursor + parallel bulk)
+    3. re-send comments written during the load, restore refresh /
+       replicas, refresh once
+    4. atomically point the "comments" alias at it (a legacy concrete
+       "comments" index is removed in the same request)
+
+    Searches keep hitting the old index until step 4. Writes made during
+    the load reach both indexes: the indexing queue (comments/indexing.py)
+    also sends its batches to the new index while it is being built.
+
+    Example:
+        python manage.py reindex_comments --chunk-size 2000 --threads 4
+    """
+
+    help = "Build a new comments index from the database and swap the alias atomically."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows fetched per database round trip and documents per bulk request (default: 1000).",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Parallel bulk workers (default: 4).",
+        )
+        parser.add_argument(
+            "--keep-old",
+            action="store_true",
+            help="Keep the previous index instead of deleting it after the swap.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.ELASTICSEARCH_ENABLED:
+            raise CommandError("Elasticsearch is disabled (ELASTICSEARCH_ENABLED=0).")
+
+        from comments.documents import CommentDocument
+
+        document = CommentDocument()
+        client = document._get_connection()
+        alias = document._index._name
+        new_name = f"{alias}_{time.strftime('%Y%m%d%H%M%S')}"
+
+        target_settings = document._index.to_dict().get("settings", {})
+        replicas = target_settings.get("number_of_replicas", 1)
+        refresh_interval = target_settings.get("refresh_interval", "1s")
+
+        # 1. New index: same mappings, tuned for bulk loading
+        new_index = document._index.clone(name=new_name)
+        new_index.settings(refresh_interval="-1", number_of_replicas=0)
+        new_index.create()
+        self.stdout.write(f"Created {new_name}")
+
+        indexing.set_shadow_index(new_name)
+        try:
+            indexed, failed, elapsed = self.load(document, new_name, options)
+            if failed:
+                raise CommandError(f"{failed} document(s) failed; {alias} was not switched")
+
+            # 3. Writes that raced with the load (see comments/indexing.py)
+            self.catch_up(alias, options["chunk_size"])
+
+            # Back to serving settings before any search can see it
+            client.indices.put_settings(
+                index=new_name,
+                settings={"refresh_interval": refresh_interval, "number_of_replicas": replicas},
+            )
+            client.indices.refresh(index=new_name)
+
+            # 4. Atomic swap
+            old_indexes = self.swap_alias(client, alias, new_name)
+        except BaseException:
+            indexing.clear_shadow_index()
+            client.indices.delete(index=new_name, ignore_unavailable=True)
+            raise
+
+        indexing.clear_shadow_index()
+
+        rate = indexed / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{alias} -> {new_name}: {indexed} documents in {elapsed:.1f}s ({rate:.0f} docs/s)"
+            )
+        )
+
+        if old_indexes and not options["keep_old"]:
+            client.indices.delete(index=",".join(old_indexes), ignore_unavailable=True)
+            self.stdout.write(f"Deleted {', '.join(old_indexes)}")
+
+    def load(self, document, index_name: str, options):
+        """
+        2. Stream every comment into the new index. Returns (indexed, failed, seconds).
+        """
+        chunk_size = options["chunk_size"]
+        queryset = document.get_queryset().order_by("pk")
+        total = queryset.count()
+
+        def actions():
+            for action in document.get_actions(queryset.iterator(chunk_size=chunk_size), "index"):
+                action["_index"] = index_name
+                yield action
+
+        indexed = failed = 0
+        started = time.monotonic()
+        report_every = max(chunk_size * 10, 1)
+
+        for ok, item in parallel_bulk(
+            document._get_connection(),
+            actions(),
+            thread_count=options["threads"],
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        ):
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Failed: {item}")
+
+            done = indexed + failed
+            if done % report_every == 0:
+                rate = done / (time.monotonic() - started)
+                self.stdout.write(f"  {done}/{total} ({rate:.0f} docs/s)")
+
+        return indexed, failed, time.monotonic() - started
+
+    def catch_up(self, alias: str, chunk_size: int):
+        """
+        3. Re-send the comments written during the load. Retryable failures
+        are retried with backoff; ids that still fail abort the rebuild
+        (the new index would miss them).
+        """
+        retry, attempts = [], 0
+        while True:
+            touched = retry or indexing.pop_shadow_touched(chunk_size)
+            if not touched:
+                return
+
+            retry = indexing.index_batch(touched, track_shadow=False)
+            if not retry:
+                attempts = 0
+                continue
+
+            attempts += 1
+            if attempts > CATCH_UP_RETRIES:
+                raise CommandError(
+                    f"{len(retry)} comment(s) written during the load could not be indexed; "
+                    f"{alias} was not switched"
+                )
+            self.stderr.write(f"Retrying {len(retry)} comment(s) ({attempts}/{CATCH_UP_RETRIES})")
+            time.sleep(min(2**attempts, 30))
+
+    def swap_alias(self, client, alias: str, new_name: str):
+        actions = []
+        old_indexes = []
+
+        if client.indices.exists_alias(name=alias):
+            old_indexes = list(client.indices.get_alias(name=alias).keys())
+            actions += [{"remove": {"index": name, "alias": alias}} for name in old_indexes]
+        elif client.indices.exists(index=alias):
+            # Index created by search_index --rebuild: replace it with the alias
+            actions.append({"remove_index": {"index": alias}})
+
+        actions.append({"add": {"index": new_name, "alias": alias}})
+        client.indices.update_aliases(actions=actions)
+        return old_indexes
@@ -0,0 +1,108 @@
+"""
+Attachment file metadata: width, height, size, MIME type, SHA-256.
+
+Probed once, when a content is first stored (comments.blobs.acquire_blob),
+and copied to every attachment of the blob, so serializers, the resize
+task and clients never open the file for it. Images are only identified
+(PIL reads the header), not decoded. Rows stored before these columns
+existed are filled in by the backfill_attachment_metadata command.
+"""
+
+import hashlib
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+from .uploads import KINDS
+
+CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "text": "text/plain",
+}
+
+UNKNOWN_CONTENT_TYPE = "application/octet-stream"
+
+HASH_BLOCK_BYTES = 64 * 1024
+
+# Columns on Attachment (and Blob) filled from a probe
+FIELDS = ("width", "height", "size", "content_type", "sha256")
+
+
+def content_type_for(file_name: str) -> str:
+    """
+    Uploads are checked against their extension (comments/uploads.py), so
+    the extension gives the MIME type.
+    """
+    kind = KINDS.get(os.path.splitext(file_name)[1].lower())
+    return CONTENT_TYPES.get(kind, UNKNOWN_CONTENT_TYPE)
+
+
+def image_size(fh) -> Tuple[Optional[int], Optional[int]]:
+    """
+    (width, height) from the image header; (None, None) for anything else.
+    Rewinds ``fh``.
+    """
+    try:
+        with Image.open(fh) as img:
+            return img.size
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return None, None
+    finally:
+        fh.seek(0)
+
+
+def probe_upload(uploaded_file, digest: str) -> Dict[str, Any]:
+    """
+    Metadata of an upload whose SHA-256 is already known (computed while
+    it streamed in).
+    """
+    content_type = content_type_for(uploaded_file.name)
+    width = height = None
+    if content_type.startswith("image/"):
+        uploaded_file.seek(0)
+        width, height = image_size(uploaded_file)
+
+    return {
+        "width": width,
+        "height": height,
+        "size": uploaded_file.size,
+        "content_type": content_type,
+        "sha256": digest,
+    }
+
+
+def probe_stored(storage, name: str, checksum: bool = True) -> Dict[str, Any]:
+    """
+    Metadata of a stored file, read once; a missing file gets only its
+    content type (so it is not probed again). Without ``checksum`` only
+    the header is read (size None, sha256 "").
+    """
+    content_type = content_type_for(name)
+    try:
+        fh = storage.open(name, "rb")
+    except OSError:
+        return {"width": None, "height": None, "size": None, "content_type": content_type, "sha256": ""}
+
+    with fh:
+        width = height = None
+        if content_type.startswith("image/"):
+            width, height = image_size(fh)
+
+        size, digest = None, ""
+        if checksum:
+            hasher, size = hashlib.sha256(), 0
+            for block in iter(lambda: fh.read(HASH_BLOCK_BYTES), b""):
+                hasher.update(block)
+                size += len(block)
+            digest = hasher.hexdigest()
+
+    return {
+        "width": width,
+        "height": height,
+        "size": size,
+        "content_type": content_type,
+        "sha256": digest,
+    }
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0007_comment_root_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('comment_id', models.BigIntegerField()),
+                ('thread_root_id', models.BigIntegerField(blank=True, null=True)),
+                ('text', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
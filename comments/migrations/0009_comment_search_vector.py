@@ -0,0 +1,56 @@
+# Generated by Django 6.0 on 2026-10-18 04:20
+
+from django.db import migrations
+
+# PostgreSQL only (see comments/search.py, PostgresSearchBackend).
+# Not a model field: other databases have no tsvector type.
+#
+# 'simple' configuration: comments are written in several languages,
+# so no stemming / stop words for one of them.
+FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE comments_comment
+    ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(text, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(user_name, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(email, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX comment_search_vector_idx ON comments_comment USING GIN (search_vector)",
+    # Fuzzy author lookup (similarity operator %)
+    "CREATE INDEX comment_user_name_trgm_idx ON comments_comment USING GIN (user_name gin_trgm_ops)",
+    "CREATE INDEX comment_email_trgm_idx ON comments_comment USING GIN (email gin_trgm_ops)",
+]
+
+BACKWARD = [
+    "DROP INDEX IF EXISTS comment_email_trgm_idx",
+    "DROP INDEX IF EXISTS comment_user_name_trgm_idx",
+    "DROP INDEX IF EXISTS comment_search_vector_idx",
+    "ALTER TABLE comments_comment DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in FORWARD:
+        schema_editor.execute(sql)
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in BACKWARD:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0008_commentevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
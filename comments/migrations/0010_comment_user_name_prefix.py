@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-18 07:05
+
+from django.db import migrations
+
+# PostgreSQL only (see comments/search.py, PostgresSearchBackend.suggest).
+# Prefix lookups "lower(user_name) LIKE 'ab%'" for the suggest endpoint:
+# text_pattern_ops makes LIKE prefixes usable on a btree regardless of
+# the database collation. Prefixes of words in the text use the existing
+# search_vector GIN index (to_tsquery 'word:*').
+FORWARD = [
+    "CREATE INDEX comment_user_name_prefix_idx ON comments_comment (lower(user_name) text_pattern_ops)",
+]
+
+BACKWARD = [
+    "DROP INDEX IF EXISTS comment_user_name_prefix_idx",
+]
+
+
+def add_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in FORWARD:
+        schema_editor.execute(sql)
+
+
+def remove_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in BACKWARD:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0009_comment_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_prefix_index, remove_prefix_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0010_comment_user_name_prefix'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16),
+        ),
+    ]
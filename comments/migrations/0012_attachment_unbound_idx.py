@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0011_attachment_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(condition=models.Q(('comment__isnull', True)), fields=['uploaded_at'], name='attachment_unbound_idx'),
+        ),
+    ]
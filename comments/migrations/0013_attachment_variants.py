@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0012_attachment_unbound_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
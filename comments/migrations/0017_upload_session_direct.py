@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0016_attachment_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='direct',
+            field=models.BooleanField(default=False),
+        ),
+    ]
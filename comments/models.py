@@ -1,10 +1,30 @@
 import os
 import uuid
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
-from django.db import models
-from PIL import Image
+from django.db import connections, models, router
+
+# Width of one zero-padded id segment in Comment.path
+PATH_STEP_WIDTH = 10
+PATH_MAX_LENGTH = 1000
+# Deepest reply whose path still fits (the root is depth 0)
+MAX_DEPTH = PATH_MAX_LENGTH // PATH_STEP_WIDTH - 1
+
+
+def path_segment(pk: int) -> str:
+    return str(pk).zfill(PATH_STEP_WIDTH)
+
+
+def path_upper_bound(path: str) -> str:
+    """
+    Smallest path that sorts after every descendant of ``path``
+    (the path of the next sibling id). Paths are digits only, so the
+    comparison is the same under any collation.
+    """
+    prefix, last = path[:-PATH_STEP_WIDTH], int(path[-PATH_STEP_WIDTH:])
+    return prefix + path_segment(last + 1)
 
 
 class Comment(models.Model):
@@ -21,12 +41,197 @@ class Comment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized tree position, maintained on create (see save()).
+    # path = zero-padded ids from the root down to this comment, so
+    # "whole subtree in display order" is one range scan on (thread_root, path).
+    thread_root = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,  # covered by comment_thread_path_idx
+        related_name="thread_comments",
+    )
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True, default="", editable=False)
+
     class Meta:
         ordering = ["-created_at"]  # LIFO по умолчанию
+        indexes = [
+            models.Index(fields=["thread_root", "path"], name="comment_thread_path_idx"),
+            # Root listing: one partial index per supported ordering (+ id tiebreaker).
+            # B-tree indexes are scanned backwards for descending orderings.
+            models.Index(
+                fields=["created_at", "id"],
+                name="comment_root_created_idx",
+                condition=models.Q(parent__isnull=True),
+            ),
+            models.Index(
+                fields=["user_name", "id"],
+                name="comment_root_user_name_idx",
+                condition=models.Q(parent__isnull=True),
+            ),
+            models.Index(
+                fields=["email", "id"],
+                name="comment_root_email_idx",
+                condition=models.Q(parent__isnull=True),
+            ),
+            # ?email=... filter with the default newest-first ordering
+            models.Index(
+                fields=["email", "created_at", "id"],
+                name="comment_root_email_created_idx",
+                condition=models.Q(parent__isnull=True),
+            ),
+        ]
+
+    # Fields searched by comments/search.py (and indexed in Elasticsearch)
+    SEARCH_FIELDS = ("user_name", "email", "text", "created_at")
+
+    # Their values as loaded from the database (see search_fields_changed)
+    _stored_search_values = None
 
     def __str__(self) -> str:
         return f"{self.user_name}: {self.text[:30]}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.SEARCH_FIELDS):
+            instance._stored_search_values = instance._search_values()
+        return instance
+
+    def _search_values(self):
+        return tuple(getattr(self, name) for name in self.SEARCH_FIELDS)
+
+    def search_fields_changed(self) -> bool:
+        """
+        Whether a searched field differs from the database (unknown if the
+        instance was not loaded with all of them: changed).
+        """
+        return self._stored_search_values is None or self._search_values() != self._stored_search_values
+
+    def save(self, *args, **kwargs):
+        """
+        Fill thread_root / depth / path for new comments.
+
+        The path needs the new id: on PostgreSQL it is taken from the id
+        sequence first, so the INSERT writes everything; elsewhere the
+        path is set by an UPDATE right after the INSERT.
+        """
+        adding = self._state.adding and not self.path
+        parent = self.parent if self.parent_id else None
+
+        if adding and parent is not None:
+            self.depth = parent.depth + 1
+            # None only if the parent is a reply that was not backfilled yet
+            self.thread_root_id = parent.thread_root_id if parent.parent_id else parent.id
+
+        if adding and self.pk is None:
+            self.pk = self._next_id(kwargs.get("using"))
+            if self.pk is not None:
+                kwargs["force_insert"] = True
+                self._set_path(parent)
+                super().save(*args, **kwargs)
+                self._stored_search_values = self._search_values()
+                return
+
+        super().save(*args, **kwargs)
+        self._stored_search_values = self._search_values()
+
+        if not adding:
+            return
+
+        self._set_path(parent)
+        Comment.objects.filter(pk=self.pk).update(
+            thread_root_id=self.thread_root_id,
+            path=self.path,
+        )
+
+    def _set_path(self, parent):
+        if parent is None:
+            self.thread_root_id = self.pk
+            self.path = path_segment(self.pk)
+        elif parent.path:
+            self.path = parent.path + path_segment(self.pk)
+        # else: parent not backfilled yet -> leave empty for backfill_comment_paths
+
+    @classmethod
+    def _next_id(cls, using=None):
+        """
+        Next value of the id sequence (PostgreSQL); None elsewhere.
+        """
+        connection = connections[using or router.db_for_write(cls)]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [cls._meta.db_table])
+            return cursor.fetchone()[0]
+
+    def get_descendants(self):
+        """
+        All replies below this comment, in display (path) order.
+        """
+        return Comment.objects.filter(
+            thread_root_id=self.thread_root_id,
+            path__gt=self.path,
+            path__lt=path_upper_bound(self.path),
+        ).order_by("path")
+
+
+class CommentEvent(models.Model):
+    """
+    Bounded replay log of WebSocket events.
+
+    The id is the event sequence number sent to clients, so a reconnecting
+    socket can ask for everything after the last sequence it has seen.
+    Old rows are pruned by a beat task (see comments.events.prune_events).
+    """
+
+    kind = models.CharField(max_length=32)
+    # Plain ids, not FKs: events outlive deleted comments
+    comment_id = models.BigIntegerField()
+    thread_root_id = models.BigIntegerField(null=True, blank=True)  # NULL = new root
+    text = models.TextField()  # rendered frame, without "seq"
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"#{self.id} {self.kind} {self.comment_id}"
+
+
+class ProcessingStatus(models.TextChoices):
+    PENDING = "pending", "Pending"  # image waiting for its derivatives
+    READY = "ready", "Ready"
+    FAILED = "failed", "Failed"
+
+
+class Blob(models.Model):
+    """
+    One stored upload per distinct content (comments/blobs.py).
+
+    Attachments with the same bytes share a blob: the file is stored and
+    its image derivatives rendered once. ``refcount`` = attachments
+    pointing at it; the blob and its files go when it drops to zero.
+    """
+
+    Status = ProcessingStatus
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="blobs/", max_length=255)
+    size = models.BigIntegerField()
+    # Probed once when stored (comments/metadata.py)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    refcount = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)
+    # Derivatives, copied to every attachment of the blob
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.sha256[:12]} x{self.refcount}"
+
 
 def attachment_upload_to(instance: "Attachment", filename: str) -> str:
     """
@@ -49,9 +254,14 @@ class Attachment(models.Model):
     Requirements:
     - Image formats: JPG, JPEG, PNG, GIF.
     - Text file format: TXT, size <= 100 KB.
-    - Images larger than 320x240 are proportionally resized down.
+    - Images get proportionally downscaled derivatives (320x240 thumbnail,
+      display size, WebP), rendered outside the request (comments/images.py).
+    - New uploads are stored as content-addressed blobs: ``file`` is the
+      blob's file, ``name`` the uploaded file name.
     """
 
+    Status = ProcessingStatus
+
     comment = models.ForeignKey(
         Comment,
         on_delete=models.CASCADE,
@@ -67,8 +277,38 @@ class Attachment(models.Model):
             )
         ],
     )
+    # NULL for files stored before blobs existed
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,  # released by comments.signals.attachment_deleted
+        related_name="attachments",
+        null=True,
+        blank=True,
+    )
+    name = models.CharField(max_length=255, blank=True, default="")
+    # File metadata, copied from the blob (comments/metadata.py);
+    # content_type "" = not probed yet (backfill_attachment_metadata)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    sha256 = models.CharField(max_length=64, blank=True, default="")
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)
+    # Derivative files by size (see comments.images.build_variants)
+    variants = models.JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            # Garbage collection of abandoned temporary uploads (comments/cleanup.py)
+            models.Index(
+                fields=["uploaded_at"],
+                name="attachment_unbound_idx",
+                condition=models.Q(comment__isnull=True),
+            ),
+        ]
+
+    IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif"}
     MAX_TEXT_SIZE_BYTES = 100 * 1024  # 100 KB
     MAX_IMAGE_WIDTH = 320
     MAX_IMAGE_HEIGHT = 240
@@ -87,34 +327,95 @@ class Attachment(models.Model):
         if ext == ".txt" and self.file.size > self.MAX_TEXT_SIZE_BYTES:
             raise ValidationError("Text file size must be <= 100 KB.")
 
+    # File name as loaded from the database (a new or moved file needs a resize)
+    _stored_file_name = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "file" in field_names:
+            instance._stored_file_name = values[field_names.index("file")]
+        return instance
+
+    @property
+    def is_image(self) -> bool:
+        return bool(self.file) and os.path.splitext(self.file.name)[1].lower() in self.IMAGE_EXTENSIONS
+
     def save(self, *args, **kwargs):
         """
-        Resize image files if they exceed max dimensions.
+        A new upload goes to its blob and takes the blob's status: a file
+        stored before is "ready" at once. Other new or moved images are
+        marked "pending"; comments.signals schedules the resize task on
+        commit, which marks them "ready".
         """
+        if self._state.adding and self.file and not self.file._committed:
+            self._store_blob()
+
+        file_changed = self._state.adding or (
+            self._stored_file_name is not None and self.file.name != self._stored_file_name
+        )
+        if file_changed and self.is_image and self.blob_id is None:
+            self.status = self.Status.PENDING
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "status"}
+
         super().save(*args, **kwargs)
+        self._stored_file_name = self.file.name
 
-        if not self.file:
-            return
+    def _store_blob(self):
+        from .blobs import acquire_blob
+        from .metadata import FIELDS
 
-        ext = os.path.splitext(self.file.name)[1].lower()
-        if ext not in {".jpg", ".jpeg", ".png", ".gif"}:
-            return
+        blob = acquire_blob(self.file.file)
+        self.name = self.name or os.path.basename(self.file.name)[:255]
+        self.blob = blob
+        self.file.name = blob.file.name
+        self.file._committed = True
+        self.status, self.variants = blob.status, blob.variants
+        for field in FIELDS:
+            setattr(self, field, getattr(blob, field))
 
-        file_path = self.file.path
 
-        try:
-            img = Image.open(file_path)
-        except OSError:
-            # Not an image or corrupted file – just skip resizing
-            return
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload of one attachment (comments/chunked.py).
 
-        width, height = img.size
-        max_w, max_h = self.MAX_IMAGE_WIDTH, self.MAX_IMAGE_HEIGHT
+    The bytes received so far are in a spool file (COMMENTS_UPLOAD_SESSION_DIR);
+    ``offset`` is how many of them are written. Completing the session
+    creates a temporary Attachment with the session's ``upload_key``.
 
-        # No need to resize
-        if width <= max_w and height <= max_h:
-            return
+    A ``direct`` session has no spool file: the client posts the file
+    straight to object storage (comments/direct.py).
+
+    Only ``user``, who started the session, can see, write, complete or
+    abort it.
+    """
 
-        img.thumbnail((max_w, max_h))
-        # сохраняем в исходном формате, если возможно
-        img.save(file_path, format=img.format or "PNG")
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # NULL only for sessions started before owners were recorded: nobody
+    # can reach those, the cleanup task deletes them
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+        null=True,
+    )
+    upload_key = models.UUIDField(default=uuid.uuid4, db_index=True)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    direct = models.BooleanField(default=False)
+    # Set on completion; a repeated "complete" returns the same attachment
+    attachment = models.OneToOneField(
+        Attachment,
+        on_delete=models.CASCADE,
+        related_name="upload_session",
+        null=True,
+        blank=True,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.file_name} {self.offset}/{self.size}"
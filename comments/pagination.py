@@ -0,0 +1,302 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CommentKeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over (<ordering field>, id).
+
+    Unlike PageNumberPagination it runs no COUNT(*) and no OFFSET:
+    each page is "rows after the last seen key", which an index on
+    (<field>, id) serves in constant time regardless of depth.
+
+    Works with every entry of the view's ``ordering_fields``; ``id``
+    is always used as a tiebreaker so the order is total.
+
+    Query params:
+      - cursor=<opaque>        position returned in next/previous links
+      - pagination=cursor      start cursor mode from the first page
+      - include_total=1        add "total_estimate" (planner statistics)
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    total_query_param = "include_total"
+    tiebreaker = "id"
+    invalid_cursor_message = "Invalid cursor"
+
+    def is_requested(self, request) -> bool:
+        params = request.query_params
+        return self.cursor_query_param in params or params.get(self.mode_query_param) == "cursor"
+
+    # -------------------------------------------------------------------------
+    # Cursor encoding
+    # -------------------------------------------------------------------------
+    def encode_position(self, position: Dict[str, Any]) -> str:
+        raw = json.dumps(position, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def encode_cursor(self, position: Dict[str, Any]) -> str:
+        encoded = self.encode_position(position)
+        base_url = remove_query_param(self.request.build_absolute_uri(), self.mode_query_param)
+        return replace_query_param(base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request) -> Optional[Dict[str, Any]]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(position, dict) or not {"o", "v", "i"} <= position.keys():
+                raise ValueError
+            position["i"] = int(position["i"])
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position
+
+    # -------------------------------------------------------------------------
+    # Ordering
+    # -------------------------------------------------------------------------
+    def get_ordering(self, request, queryset, view) -> str:
+        ordering = filters.OrderingFilter().get_ordering(request, queryset, view)
+        if not ordering:
+            return "-created_at"
+        return ordering[0]
+
+    # -------------------------------------------------------------------------
+    # Query building (split from evaluation so async views can reuse it)
+    # -------------------------------------------------------------------------
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Return the sliced queryset for the requested page (page_size + 1 rows).
+        """
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.field_name = self.ordering.lstrip("-")
+        self.descending = self.ordering.startswith("-")
+        self.model_field = queryset.model._meta.get_field(self.field_name)
+
+        self.position = self.decode_cursor(request)
+        if self.position is not None and self.position["o"] != self.ordering:
+            raise NotFound(self.invalid_cursor_message)
+        self.reverse = bool(self.position and self.position.get("r"))
+
+        self.base_queryset = queryset
+
+        # Going backwards = flip direction, then reverse the page in memory
+        descending = self.descending != self.reverse
+        prefix = "-" if descending else ""
+        queryset = queryset.order_by(prefix + self.field_name, prefix + self.tiebreaker)
+
+        if self.position is not None:
+            try:
+                value = self.model_field.to_python(self.position["v"])
+            except Exception:
+                raise NotFound(self.invalid_cursor_message)
+
+            op = "lt" if descending else "gt"
+            # The first bound is implied by the second; it is what the index
+            # seeks to. Without it the OR is only a filter and PostgreSQL
+            # walks every row before the cursor.
+            queryset = queryset.filter(
+                Q(**{f"{self.field_name}__{op}e": value}),
+                Q(**{f"{self.field_name}__{op}": value})
+                | Q(**{self.field_name: value, f"{self.tiebreaker}__{op}": self.position["i"]}),
+            )
+
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, rows: List[Any]) -> List[Any]:
+        """
+        Turn the evaluated rows of get_page_queryset() into the page.
+        """
+        has_more = len(rows) > self.page_size
+        page = rows[: self.page_size]
+
+        if self.reverse:
+            page.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        self.page = page
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.get_page_queryset(queryset, request, view))
+        page = self.set_page(rows)
+        self.total_estimate = self.estimate_total() if self.wants_total() else None
+        return page
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        rows = [row async for row in self.get_page_queryset(queryset, request, view)]
+        page = self.set_page(rows)
+        self.total_estimate = (
+            await sync_to_async(self.estimate_total)() if self.wants_total() else None
+        )
+        return page
+
+    # -------------------------------------------------------------------------
+    # Links / totals
+    # -------------------------------------------------------------------------
+    def _position_of(self, obj, reverse: bool) -> Dict[str, Any]:
+        return {
+            "o": self.ordering,
+            "v": self.model_field.value_to_string(obj),
+            "i": getattr(obj, self.tiebreaker),
+            "r": int(reverse),
+        }
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position_of(self.page[-1], reverse=False))
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position_of(self.page[0], reverse=True))
+
+    def wants_total(self) -> bool:
+        value = (self.request.query_params.get(self.total_query_param) or "").lower()
+        return value in {"1", "true", "yes"}
+
+    def estimate_total(self) -> Optional[int]:
+        """
+        Row estimate from the PostgreSQL planner (no COUNT(*)).
+        Returns None on other databases.
+        """
+        queryset = self.base_queryset.order_by()
+        if connections[queryset.db].vendor != "postgresql":
+            return None
+
+        try:
+            plan = json.loads(queryset.explain(format="json"))
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+
+    def get_paginated_response(self, data):
+        payload = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.total_estimate is not None:
+            payload["total_estimate"] = self.total_estimate
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "total_estimate": {"type": "integer", "nullable": True},
+                "results": schema,
+            },
+        }
+
+
+class CommentListPagination(BasePagination):
+    """
+    Page-number pagination by default (what the SPA uses),
+    keyset pagination when the client asks for it (?pagination=cursor or ?cursor=...).
+    """
+
+    def __init__(self):
+        self.page_number = PageNumberPagination()
+        self.keyset = CommentKeysetPagination()
+        self.active = self.page_number
+
+    def select(self, request) -> BasePagination:
+        self.active = self.keyset if self.keyset.is_requested(request) else self.page_number
+        return self.active
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.select(request).paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async paginate_queryset() for comments.async_views.
+        """
+        if self.select(request) is self.keyset:
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        return await self._apaginate_page_number(queryset, request, view)
+
+    async def _apaginate_page_number(self, queryset, request, view=None):
+        # PageNumberPagination.paginate_queryset() with the COUNT and the
+        # page rows fetched through the async ORM
+        pagination = self.page_number
+        pagination.request = request
+
+        page_size = pagination.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = pagination.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+
+        page_number = pagination.get_page_number(request, paginator)
+        try:
+            pagination.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = pagination.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        pagination.page.object_list = [row async for row in pagination.page.object_list]
+        return list(pagination.page)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        params = self.page_number.get_schema_operation_parameters(view)
+        params += [
+            {
+                "name": self.keyset.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Opaque keyset cursor (from next/previous links).",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.keyset.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to 'cursor' to start keyset pagination.",
+                "schema": {"type": "string", "enum": ["page", "cursor"]},
+            },
+            {
+                "name": self.keyset.total_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor mode only: add a planner-based total_estimate.",
+                "schema": {"type": "boolean"},
+            },
+        ]
+        return params
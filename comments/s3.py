@@ -0,0 +1,28 @@
+"""
+Attachment storage in an S3-compatible bucket (django-storages).
+
+Selected in settings when AWS_STORAGE_BUCKET_NAME is set; only imported
+then, so django-storages stays optional.
+
+Blobs (comments/blobs.py) and image derivatives (comments/images.py) are
+content-addressed: a name always means the same bytes, so they are
+written with COMMENTS_IMMUTABLE_CACHE_CONTROL, the header nginx sends for
+the same paths from media/. Other objects (staged direct uploads, files
+stored before blobs) keep the bucket's defaults.
+"""
+
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+
+IMMUTABLE_PREFIXES = ("blobs/", "attachments/v/")
+
+
+class AttachmentS3Storage(S3Storage):
+    def get_object_parameters(self, name):
+        params = super().get_object_parameters(name)
+        # ``name`` is the object key here: strip the storage's location
+        if self.location and name.startswith(f"{self.location}/"):
+            name = name[len(self.location) + 1 :]
+        if name.startswith(IMMUTABLE_PREFIXES):
+            params.setdefault("CacheControl", settings.COMMENTS_IMMUTABLE_CACHE_CONTROL)
+        return params
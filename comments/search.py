@@ -0,0 +1,457 @@
+"""
+Pluggable full-text search for CommentSearchAPIView.
+
+COMMENTS_SEARCH_BACKEND selects the implementation:
+
+  - "auto" (default)  Elasticsearch if ELASTICSEARCH_ENABLED, otherwise
+                      PostgreSQL full-text search on PostgreSQL, otherwise
+                      the plain database fallback
+  - "elasticsearch" / "postgres" / "database"
+  - a dotted path to a SearchBackend subclass
+
+Every backend returns one page with the fields of
+CommentSearchResultSerializer (see SearchBackend). Pages are cached per
+query under a generation counter (comments.cache.bump_search_generation).
+"""
+
+import base64
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import asearch_cache_key, search_cache_key
+from .models import Comment
+from .serializers import CommentSearchResultSerializer, CommentSuggestionSerializer
+
+RESULT_FIELDS = ("id", "user_name", "email", "text", "created_at")
+SUGGEST_FIELDS = ("id", "user_name", "text")
+INVALID_CURSOR = "Invalid cursor"
+
+
+class SearchBackend(ABC):
+    """
+    search() returns one page ordered by relevance:
+
+      {"total": int, "total_relation": "eq" | "gte",
+       "items": [<hit dict>, ...], "after": <sort key of the last item> | None}
+
+    ``after`` is passed back to get the next page (keyset, no offset).
+    Unless ``exact_total`` is set, counting stops at
+    COMMENTS_SEARCH_TRACK_TOTAL_HITS and the relation is "gte".
+
+    suggest() returns up to ``limit`` {"id", "user_name", "text"} dicts
+    matching ``q`` as a prefix (search-as-you-type; no count, no paging).
+    """
+
+    name = ""
+
+    @abstractmethod
+    def search(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        ...
+
+    async def asearch(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        # Backends without an async client run the sync query in a worker
+        return await sync_to_async(self.search)(q, size, after, exact_total)
+
+    @abstractmethod
+    def suggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        ...
+
+    async def asuggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        return await sync_to_async(self.suggest)(q, limit)
+
+    @staticmethod
+    def total_cap(exact_total: bool) -> Optional[int]:
+        return None if exact_total else settings.COMMENTS_SEARCH_TRACK_TOTAL_HITS
+
+
+class ElasticsearchSearchBackend(SearchBackend):
+    """
+    multi_match with fuzziness on the "comments" index (comments/documents.py),
+    paginated with search_after.
+    """
+
+    name = "elasticsearch"
+
+    def query(self, search, q, size, after, exact_total):
+        from .documents import comment_search_query
+
+        cap = self.total_cap(exact_total)
+        return comment_search_query(
+            search, q, size, after=after, track_total_hits=True if cap is None else cap
+        )
+
+    def search(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        from .documents import CommentDocument, search_results
+
+        search = self.query(CommentDocument.search(), q, size, after, exact_total)
+        return search_results(search.execute())
+
+    async def asearch(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        from .documents import async_search, search_results
+
+        search = self.query(async_search(), q, size, after, exact_total)
+        return search_results(await search.execute())
+
+    def suggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        from .documents import CommentDocument, comment_suggest_query, suggest_results
+
+        return suggest_results(comment_suggest_query(CommentDocument.search(), q, limit).execute())
+
+    async def asuggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        from .documents import async_search, comment_suggest_query, suggest_results
+
+        return suggest_results(await comment_suggest_query(async_search(), q, limit).execute())
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Full-text match on the generated search_vector column (GIN index),
+    plus trigram similarity on user_name / email (pg_trgm GIN indexes)
+    for typos in author names. See migration 0009_comment_search_vector.
+
+    Ordered by (score, id); ``after`` = [score, id].
+    """
+
+    name = "postgres"
+
+    def search(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        table = Comment._meta.db_table
+        columns = ", ".join(f"c.{name}" for name in RESULT_FIELDS)
+        # "%" is the pg_trgm similarity operator (escaped for the DB-API)
+        matches = f"""
+            FROM {table} c, websearch_to_tsquery('simple', %s) query
+            WHERE c.search_vector @@ query OR c.user_name %% %s OR c.email %% %s
+        """
+        match_params = [q, q, q]
+
+        hits = f"""
+            SELECT {columns},
+                   (ts_rank(c.search_vector, query)
+                    + greatest(similarity(c.user_name, %s), similarity(c.email, %s)))::real AS score
+            {matches}
+        """
+        params = [q, q] + match_params
+
+        seek = ""
+        if after is not None:
+            try:
+                score, last_id = float(after[0]), int(after[1])
+            except (TypeError, ValueError, IndexError):
+                raise NotFound(INVALID_CURSOR)
+            # ::real: compare with the exact float4 value the score had
+            seek = "WHERE (hits.score, hits.id) < (%s::real, %s)"
+            params += [score, last_id]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM ({hits}) hits {seek}
+                ORDER BY hits.score DESC, hits.id DESC
+                LIMIT %s
+                """,
+                params + [size],
+            )
+            rows = cursor.fetchall()
+
+            cap = self.total_cap(exact_total)
+            if cap is None:
+                cursor.execute(f"SELECT COUNT(*) {matches}", match_params)
+            else:
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM (SELECT 1 {matches} LIMIT %s) bounded",
+                    match_params + [cap + 1],
+                )
+            total = cursor.fetchone()[0]
+
+        items = [dict(zip(RESULT_FIELDS, row)) for row in rows]
+        return {
+            **_bounded(total, cap),
+            "items": items,
+            "after": [rows[-1][-1], rows[-1][0]] if rows else None,
+        }
+
+    def suggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Prefix tsquery ("hel wor" -> 'hel' & 'wor':*) on the search_vector
+        GIN index, or an author name starting with q (lower(user_name)
+        text_pattern_ops index, migration 0010_comment_user_name_prefix).
+        """
+        words = re.findall(r"\w+", q.lower())
+        if not words:
+            return []
+        tsquery = " & ".join(f"'{word}'" for word in words) + ":*"
+        name_prefix = re.sub(r"([\\%_])", r"\\\1", q.lower()) + "%"
+
+        table = Comment._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, user_name, text FROM {table}
+                WHERE search_vector @@ to_tsquery('simple', %s) OR lower(user_name) LIKE %s
+                ORDER BY id DESC
+                LIMIT %s
+                """,
+                [tsquery, name_prefix, limit],
+            )
+            return [dict(zip(SUGGEST_FIELDS, row)) for row in cursor.fetchall()]
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Case-insensitive substring match, newest first; for SQLite and small
+    instances. ``after`` = [id].
+    """
+
+    name = "database"
+
+    def get_queryset(self, q: str):
+        return Comment.objects.filter(
+            Q(text__icontains=q) | Q(user_name__icontains=q) | Q(email__icontains=q)
+        ).order_by("-id")
+
+    def get_page(self, queryset, size: int, after):
+        if after is not None:
+            try:
+                queryset = queryset.filter(id__lt=int(after[0]))
+            except (TypeError, ValueError, IndexError):
+                raise NotFound(INVALID_CURSOR)
+        return queryset.values(*RESULT_FIELDS)[:size]
+
+    def search(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        queryset = self.get_queryset(q)
+        items = list(self.get_page(queryset, size, after))
+
+        cap = self.total_cap(exact_total)
+        total = queryset.count() if cap is None else queryset[: cap + 1].count()
+        return self.result(items, total, cap)
+
+    async def asearch(self, q: str, size: int, after=None, exact_total: bool = False) -> Dict[str, Any]:
+        queryset = self.get_queryset(q)
+        items = [row async for row in self.get_page(queryset, size, after)]
+
+        cap = self.total_cap(exact_total)
+        total = await (queryset.acount() if cap is None else queryset[: cap + 1].acount())
+        return self.result(items, total, cap)
+
+    def get_suggest_queryset(self, q: str, limit: int):
+        # Author names by prefix; text by substring (it may start with markup)
+        return (
+            Comment.objects.filter(Q(user_name__istartswith=q) | Q(text__icontains=q))
+            .order_by("-id")
+            .values(*SUGGEST_FIELDS)[:limit]
+        )
+
+    def suggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        return list(self.get_suggest_queryset(q, limit))
+
+    async def asuggest(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        return [row async for row in self.get_suggest_queryset(q, limit)]
+
+    @staticmethod
+    def result(items: List[Dict[str, Any]], total: int, cap: Optional[int]) -> Dict[str, Any]:
+        return {
+            **_bounded(total, cap),
+            "items": items,
+            "after": [items[-1]["id"]] if items else None,
+        }
+
+
+def _bounded(total: int, cap: Optional[int]) -> Dict[str, Any]:
+    if cap is not None and total > cap:
+        return {"total": cap, "total_relation": "gte"}
+    return {"total": total, "total_relation": "eq"}
+
+
+BACKENDS = {
+    "elasticsearch": ElasticsearchSearchBackend,
+    "postgres": PostgresSearchBackend,
+    "database": DatabaseSearchBackend,
+}
+
+
+def get_search_backend() -> SearchBackend:
+    name = getattr(settings, "COMMENTS_SEARCH_BACKEND", "auto")
+
+    if name == "auto":
+        if getattr(settings, "ELASTICSEARCH_ENABLED", False):
+            name = "elasticsearch"
+        elif connection.vendor == "postgresql":
+            name = "postgres"
+        else:
+            name = "database"
+
+    backend_class = BACKENDS.get(name) or import_string(name)
+    return backend_class()
+
+
+# -----------------------------------------------------------------------------
+# Request handling (shared by the sync and async search views)
+# -----------------------------------------------------------------------------
+def encode_cursor(backend: SearchBackend, after: List[Any]) -> str:
+    raw = json.dumps({"b": backend.name, "a": after}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(backend: SearchBackend, encoded: str) -> List[Any]:
+    try:
+        padded = encoded + "=" * (-len(encoded) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if position["b"] != backend.name or not isinstance(position["a"], list):
+            raise ValueError
+    except (TypeError, ValueError, KeyError):
+        raise NotFound(INVALID_CURSOR)
+    return position["a"]
+
+
+def parse_search_params(backend: SearchBackend, query_params) -> Dict[str, Any]:
+    """
+    ?q=...               required
+    ?cursor=<opaque>     next page (from the "next" link)
+    ?page_size=N         1..COMMENTS_SEARCH_MAX_PAGE_SIZE
+    ?exact_total=1       count every match instead of stopping at the cap
+    """
+    q = (query_params.get("q") or "").strip()
+    if not q:
+        raise ParseError("Query param 'q' is required.")
+
+    size = settings.COMMENTS_SEARCH_PAGE_SIZE
+    raw_size = query_params.get("page_size")
+    if raw_size:
+        try:
+            size = int(raw_size)
+        except ValueError:
+            raise ParseError("'page_size' must be an integer.")
+        size = max(1, min(size, settings.COMMENTS_SEARCH_MAX_PAGE_SIZE))
+
+    cursor = query_params.get("cursor")
+    return {
+        "q": q,
+        "size": size,
+        "after": decode_cursor(backend, cursor) if cursor else None,
+        "exact_total": (query_params.get("exact_total") or "").lower() in {"1", "true", "yes"},
+    }
+
+
+def _cache_params(backend: SearchBackend, params: Dict[str, Any]) -> Dict[str, Any]:
+    # Queries differing only in case / surrounding spaces share an entry
+    return {**params, "q": params["q"].lower(), "after": repr(params["after"]), "backend": backend.name}
+
+
+def _page_data(results: Dict[str, Any]) -> Dict[str, Any]:
+    return {**results, "items": CommentSearchResultSerializer(results["items"], many=True).data}
+
+
+def cached_search(backend: SearchBackend, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One result page, cached for COMMENTS_SEARCH_CACHE_TIMEOUT seconds under
+    the search generation (bumped when comments change, see cache.py).
+    """
+    key = search_cache_key(_cache_params(backend, params))
+    data = cache.get(key)
+    if data is None:
+        data = _page_data(backend.search(**params))
+        cache.set(key, data, timeout=settings.COMMENTS_SEARCH_CACHE_TIMEOUT)
+    return data
+
+
+async def acached_search(backend: SearchBackend, params: Dict[str, Any]) -> Dict[str, Any]:
+    key = await asearch_cache_key(_cache_params(backend, params))
+    data = await cache.aget(key)
+    if data is None:
+        data = _page_data(await backend.asearch(**params))
+        await cache.aset(key, data, timeout=settings.COMMENTS_SEARCH_CACHE_TIMEOUT)
+    return data
+
+
+def search_payload(request, backend: SearchBackend, params: Dict[str, Any], data: Dict[str, Any]):
+    """
+    Response body: {"total", "total_relation", "next", "items"}.
+    """
+    next_link = None
+    if data["after"] is not None and len(data["items"]) == params["size"]:
+        next_link = replace_query_param(
+            request.build_absolute_uri(), "cursor", encode_cursor(backend, data["after"])
+        )
+
+    return {
+        "total": data["total"],
+        "total_relation": data["total_relation"],
+        "next": next_link,
+        "items": data["items"],
+    }
+
+
+# -----------------------------------------------------------------------------
+# Suggestions (search-as-you-type)
+# -----------------------------------------------------------------------------
+def parse_suggest_params(query_params) -> Dict[str, Any]:
+    """
+    ?q=...        prefix typed so far (shorter than COMMENTS_SUGGEST_MIN_CHARS:
+                  empty result, not an error, so clients need no special case)
+    ?limit=N      1..COMMENTS_SUGGEST_MAX_LIMIT
+    """
+    limit = settings.COMMENTS_SUGGEST_LIMIT
+    raw_limit = query_params.get("limit")
+    if raw_limit:
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            raise ParseError("'limit' must be an integer.")
+        limit = max(1, min(limit, settings.COMMENTS_SUGGEST_MAX_LIMIT))
+
+    return {"q": (query_params.get("q") or "").strip(), "limit": limit}
+
+
+def _suggest_cache_params(backend: SearchBackend, params: Dict[str, Any]) -> Dict[str, Any]:
+    return {"suggest": params["q"].lower(), "limit": params["limit"], "backend": backend.name}
+
+
+def _suggest_data(items: List[Dict[str, Any]]) -> List[Any]:
+    return CommentSuggestionSerializer(items, many=True).data
+
+
+def cached_suggest(backend: SearchBackend, params: Dict[str, Any]) -> List[Any]:
+    """
+    Suggestions for one prefix; cached like search pages (every keystroke
+    of every visitor typing the same prefix hits the cache).
+    """
+    if len(params["q"]) < settings.COMMENTS_SUGGEST_MIN_CHARS:
+        return []
+
+    key = search_cache_key(_suggest_cache_params(backend, params))
+    data = cache.get(key)
+    if data is None:
+        data = _suggest_data(backend.suggest(params["q"], params["limit"]))
+        cache.set(key, data, timeout=settings.COMMENTS_SEARCH_CACHE_TIMEOUT)
+    return data
+
+
+async def acached_suggest(backend: SearchBackend, params: Dict[str, Any]) -> List[Any]:
+    if len(params["q"]) < settings.COMMENTS_SUGGEST_MIN_CHARS:
+        return []
+
+    key = await asearch_cache_key(_suggest_cache_params(backend, params))
+    data = await cache.aget(key)
+    if data is None:
+        data = _suggest_data(await backend.asuggest(params["q"], params["limit"]))
+        await cache.aset(key, data, timeout=settings.COMMENTS_SEARCH_CACHE_TIMEOUT)
+    return data
+
+
+def suggest_payload(params: Dict[str, Any], data: List[Any]) -> Dict[str, Any]:
+    """
+    Response body: {"q", "suggestions"}. "q" echoes the query, so a client
+    firing one request per keystroke can drop responses for older input.
+    """
+    return {"q": params["q"], "suggestions": data}
@@ -1,22 +1,53 @@
+import logging
 import os
 import re
 from typing import Optional
 
 from captcha.models import CaptchaStore
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.db import transaction
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 from rest_framework import serializers
 
-from .models import Attachment, Comment
+from .chunked import create_session
+from .direct import presigned_post
+from .images import variant_urls
+from .models import MAX_DEPTH, Attachment, Comment, UploadSession
+from .storage import move_file, remove_empty_dir
+from .tasks import resize_attachment_image
+
+logger = logging.getLogger(__name__)
 
 
 class AttachmentSerializer(serializers.ModelSerializer):
-    # Keep field name "file" for frontend compatibility
+    # Keep field name "file" for frontend compatibility (the original upload)
     file = serializers.SerializerMethodField()
+    # Image derivatives (comments/images.py); null until processed.
+    # Not model attributes: to_representation fills them in
+    thumb = serializers.CharField(read_only=True, allow_null=True)
+    display = serializers.CharField(read_only=True, allow_null=True)
+    srcset = serializers.CharField(read_only=True, allow_null=True)
+    webp_srcset = serializers.CharField(read_only=True, allow_null=True)
 
     class Meta:
         model = Attachment
-        fields = ("id", "file", "uploaded_at")
+        fields = (
+            "id",
+            "file",
+            "name",
+            "status",
+            "width",
+            "height",
+            "size",
+            "content_type",
+            "sha256",
+            "thumb",
+            "display",
+            "srcset",
+            "webp_srcset",
+            "uploaded_at",
+        )
 
     def get_file(self, obj) -> Optional[str]:
         """
@@ -30,13 +61,31 @@ class AttachmentSerializer(serializers.ModelSerializer):
         except Exception:
             return None
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # One variant_urls() call per attachment, not one per field
+        data.update(variant_urls(instance))
+        return data
+
 
 class AttachmentUploadSerializer(serializers.ModelSerializer):
     file = serializers.SerializerMethodField()
 
     class Meta:
         model = Attachment
-        fields = ("id", "file", "upload_key", "uploaded_at")
+        fields = (
+            "id",
+            "file",
+            "name",
+            "status",
+            "width",
+            "height",
+            "size",
+            "content_type",
+            "sha256",
+            "upload_key",
+            "uploaded_at",
+        )
 
     def get_file(self, obj) -> Optional[str]:
         if not obj.file:
@@ -54,6 +103,60 @@ class AttachmentCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Resumable upload session (comments/chunked.py). ``upload_key`` is
+    optional on create: pass the key of earlier uploads to bind them all
+    to one comment.
+    """
+
+    upload_key = serializers.UUIDField(required=False)
+    size = serializers.IntegerField(min_value=1)
+    # Largest chunk the server accepts per PUT
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ("id", "upload_key", "file_name", "size", "offset", "chunk_size", "created_at")
+        read_only_fields = ("id", "offset", "created_at")
+
+    def get_chunk_size(self, obj) -> int:
+        return settings.COMMENTS_UPLOAD_CHUNK_BYTES
+
+    def create(self, validated_data):
+        return create_session(self.context["request"].user, **validated_data)
+
+
+class DirectUploadSerializer(UploadSessionSerializer):
+    """
+    Direct upload to object storage (comments/direct.py): the session plus
+    the presigned POST to send the file with.
+    """
+
+    chunk_size = None
+    post = serializers.SerializerMethodField()
+
+    class Meta(UploadSessionSerializer.Meta):
+        fields = ("id", "upload_key", "file_name", "size", "post", "created_at")
+
+    def get_post(self, obj) -> dict:
+        return presigned_post(obj)
+
+    def create(self, validated_data):
+        return create_session(self.context["request"].user, direct=True, **validated_data)
+
+
+def _children_of(obj: Comment):
+    """
+    Children pre-assembled by comments.tree.load_threads, if available.
+    Falls back to a query for objects that were not loaded as a tree.
+    """
+    children = getattr(obj, "thread_children", None)
+    if children is not None:
+        return children
+    return obj.children.all().order_by("created_at")
+
+
 class CommentChildSerializer(serializers.ModelSerializer):
     attachments = AttachmentSerializer(many=True, read_only=True)
     children = serializers.SerializerMethodField()
@@ -72,9 +175,15 @@ class CommentChildSerializer(serializers.ModelSerializer):
             "children",
         )
 
+    def validate_parent(self, parent):
+        if parent is not None and parent.depth >= MAX_DEPTH:
+            raise serializers.ValidationError(f"Replies can be nested at most {MAX_DEPTH} levels deep.")
+        return parent
+
     def get_children(self, obj):
-        qs = obj.children.all().order_by("created_at")
-        return CommentChildSerializer(qs, many=True, context=self.context).data
+        return CommentChildSerializer(
+            _children_of(obj), many=True, context=self.context
+        ).data
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -105,9 +214,15 @@ class CommentSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ("id", "created_at", "attachments", "children")
 
+    def validate_parent(self, parent):
+        if parent is not None and parent.depth >= MAX_DEPTH:
+            raise serializers.ValidationError(f"Replies can be nested at most {MAX_DEPTH} levels deep.")
+        return parent
+
     def get_children(self, obj):
-        qs = obj.children.all().order_by("created_at")
-        return CommentChildSerializer(qs, many=True, context=self.context).data
+        return CommentChildSerializer(
+            _children_of(obj), many=True, context=self.context
+        ).data
 
     def validate_text(self, value: str) -> str:
         if value is None:
@@ -199,7 +314,8 @@ class CommentCreateSerializer(CommentSerializer):
     1) Two-step upload (JWT):
        - POST /api/comments/upload/ (multipart, returns {id, upload_key})
        - POST /api/comments/ with {attachment_ids: [...], upload_key: "..."} to bind
-       This needs MOVING files from tmp to comment folder (fixed below).
+       Blob-backed files stay where they are; older uploads are moved
+       from tmp to the comment folder (see _bind_attachments).
 
     2) Single-step create with files:
        - POST /api/comments/ as multipart with files[] + fields (optional)
@@ -264,19 +380,60 @@ class CommentCreateSerializer(CommentSerializer):
                     {"attachment_ids": ["Some attachments are invalid or already used"]}
                 )
 
-            for att in attachments:
-                # bind
-                att.comment = comment
+            self._bind_attachments(comment, attachments)
 
-                # move file by re-saving it (upload_to will now resolve to attachments/<comment_id>/...)
-                old_name = att.file.name
-                data = att.file.read()
-                filename = os.path.basename(old_name)
+        return comment
 
-                att.file.save(filename, ContentFile(data), save=False)
-                att.save()
+    @classmethod
+    def _bind_attachments(cls, comment, attachments):
+        """
+        Attach temporary uploads to the comment and update all rows at once.
+        Blob files (comments/blobs.py) do not depend on the comment; files
+        stored before blobs are moved from attachments/tmp/<upload_key>/ to
+        attachments/<comment_id>/ with a storage-level move (comments.storage).
+
+        The files are moved only once the comment is committed: until then
+        the rows keep their tmp names, so a rollback (for any reason, here
+        or later in the request) leaves rows and files as they were.
+        """
+        for att in attachments:
+            att.comment = comment
+        Attachment.objects.bulk_update(attachments, ["comment"])
 
-        return comment
+        legacy = [att for att in attachments if not att.blob_id]
+        if legacy:
+            transaction.on_commit(lambda: cls._move_bound_files(legacy), robust=True)
+
+    @staticmethod
+    def _move_bound_files(attachments):
+        """
+        On commit of the comment: move each file to the comment's folder,
+        then point its row at the new name. A file that cannot be moved
+        stays where its row says it is.
+        """
+        pending = []
+        for att in attachments:
+            storage, old_name = att.file.storage, att.file.name
+            # upload_to now resolves to attachments/<comment_id>/...
+            new_name = att.file.field.generate_filename(att, os.path.basename(old_name))
+            try:
+                new_name = move_file(storage, old_name, new_name)
+            except Exception:
+                logger.exception("Cannot move attachment %s to %s", att.id, new_name)
+                continue
+
+            if not Attachment.objects.filter(id=att.id, file=old_name).update(file=new_name):
+                # Deleted meanwhile: nothing refers to the moved file
+                storage.delete(new_name)
+                continue
+            remove_empty_dir(storage, old_name)
+            if att.status == Attachment.Status.PENDING:
+                pending.append(att.id)
+
+        # Not resized yet: the running task (if any) saw the old name and
+        # gives up, so schedule one for the new name
+        for attachment_id in pending:
+            resize_attachment_image.delay(attachment_id)
 
 
 class CommentSearchResultSerializer(serializers.Serializer):
@@ -285,3 +442,16 @@ class CommentSearchResultSerializer(serializers.Serializer):
     email = serializers.CharField(allow_null=True, required=False)
     text = serializers.CharField(allow_null=True, required=False)
     created_at = serializers.DateTimeField(allow_null=True, required=False)
+
+
+class CommentSuggestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    user_name = serializers.CharField(allow_null=True, required=False)
+    # Plain-text snippet: comments may contain the allowed HTML tags
+    text = serializers.SerializerMethodField()
+
+    def get_text(self, obj) -> Optional[str]:
+        text = obj.get("text")
+        if text is None:
+            return None
+        return Truncator(strip_tags(text)).chars(settings.COMMENTS_SUGGEST_TEXT_LENGTH)
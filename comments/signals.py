@@ -0,0 +1,113 @@
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import indexing
+from .blobs import release_blob
+from .cache import bump_search_generation, bump_thread, thread_root_id_of
+from .images import delete_variants
+from .models import Attachment, Comment
+from .tasks import resize_attachment_image
+
+logger = logging.getLogger(__name__)
+
+
+def _search_changed(comment_id: int) -> None:
+    """
+    The comment's searchable content was added, changed or removed.
+
+    With Elasticsearch it is queued for indexing, and the indexing task
+    invalidates cached search pages once the index has it; otherwise they
+    are invalidated after commit.
+    """
+    if settings.ELASTICSEARCH_ENABLED:
+        _queue_index(comment_id)
+    else:
+        transaction.on_commit(bump_search_generation)
+
+
+def _queue_index(comment_id: int) -> None:
+    """
+    Queue the comment for Elasticsearch (comments.indexing) after commit.
+    A Redis outage must not fail the write; the reindex command catches up.
+    """
+
+    def enqueue():
+        try:
+            indexing.enqueue([comment_id])
+        except redis.RedisError:
+            logger.exception("Cannot queue comment %s for indexing", comment_id)
+
+    transaction.on_commit(enqueue)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance: Comment, created: bool, **kwargs):
+    # Saves that leave the searched fields alone keep cached search pages
+    if created or instance.search_fields_changed():
+        _search_changed(instance.id)
+
+
+def _bump_thread_of(comment: Comment) -> None:
+    """
+    Invalidate cached responses with the comment's thread after commit;
+    list pages too when it is a root (list order and filters).
+    """
+    root_id = thread_root_id_of(comment)
+    is_root = comment.parent_id is None
+    transaction.on_commit(lambda: bump_thread(root_id, roots_changed=is_root))
+
+
+@receiver(post_save, sender=Comment)
+def comment_changed(sender, instance: Comment, **kwargs):
+    # Created or edited (e.g. in the admin)
+    _bump_thread_of(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance: Comment, **kwargs):
+    _bump_thread_of(instance)
+    _search_changed(instance.id)
+
+
+@receiver(post_save, sender=Attachment)
+def attachment_saved(sender, instance: Attachment, **kwargs):
+    """
+    Covers single-step uploads, uploads to an existing comment
+    and binding of temporary (two-step) uploads.
+
+    Images marked "pending" by Attachment.save are resized by a Celery
+    task after commit (the task must see the committed row and file).
+    """
+    if instance.status == Attachment.Status.PENDING:
+        attachment_id = instance.id
+        # robust: a broker outage must not fail the upload (it stays pending)
+        transaction.on_commit(lambda: resize_attachment_image.delay(attachment_id), robust=True)
+
+    if instance.comment_id:
+        _bump_thread_of(instance.comment)
+
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance: Attachment, **kwargs):
+    """
+    Drop the attachment's reference to its blob; the last one deletes the
+    blob and its files (comments.blobs.release_blob). An attachment without
+    a blob owns its derivatives: they are deleted after commit. Also
+    invalidates the thread of the comment, if it still exists
+    (comment_deleted bumps otherwise).
+    """
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    elif instance.variants:
+        storage, variants = instance.file.storage, instance.variants
+        transaction.on_commit(lambda: delete_variants(storage, variants))
+
+    if instance.comment_id:
+        comment = Comment.objects.filter(pk=instance.comment_id).only("parent_id", "thread_root_id").first()
+        if comment is not None:
+            _bump_thread_of(comment)
@@ -0,0 +1,93 @@
+"""
+Moving stored files without re-uploading them.
+
+Binding a temporary (two-step) upload to its comment changes its path
+from attachments/tmp/<upload_key>/ to attachments/<comment_id>/. The
+bytes do not change, so move_file() renames instead of copying:
+
+  - FileSystemStorage: os.replace (same filesystem, O(1))
+  - S3-compatible storages (django-storages): server-side copy + delete,
+    the data never passes through Django
+  - a storage with its own move(old_name, new_name) method: that
+  - anything else: streamed copy (chunks, never the whole file in memory)
+    + delete
+"""
+
+import os
+
+from django.core.files.storage import FileSystemStorage, Storage
+
+
+def move_file(storage: Storage, old_name: str, new_name: str) -> str:
+    """
+    Move ``old_name`` to ``new_name`` (or the next available name) and
+    return the name the file ends up under.
+    """
+    new_name = storage.get_available_name(new_name)
+
+    custom_move = getattr(storage, "move", None)
+    if callable(custom_move):
+        return custom_move(old_name, new_name)
+    if isinstance(storage, FileSystemStorage):
+        return _move_local(storage, old_name, new_name)
+    if is_s3_storage(storage):
+        return _move_s3(storage, old_name, new_name)
+    return _move_by_copy(storage, old_name, new_name)
+
+
+def is_s3_storage(storage: Storage) -> bool:
+    # django-storages S3Storage (AWS S3, MinIO, ...)
+    return hasattr(storage, "bucket") and hasattr(storage, "_normalize_name")
+
+
+def remove_empty_dir(storage: Storage, name: str) -> None:
+    """
+    Drop the directory of ``name`` if nothing is left in it (local storage;
+    object stores have no directories).
+    """
+    if not isinstance(storage, FileSystemStorage):
+        return
+    try:
+        os.rmdir(os.path.dirname(storage.path(name)))
+    except OSError:
+        pass  # not empty / already gone
+
+
+def _move_local(storage: FileSystemStorage, old_name: str, new_name: str) -> str:
+    new_path = storage.path(new_name)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(storage.path(old_name), new_path)
+    return new_name
+
+
+def _move_s3(storage, old_name: str, new_name: str) -> str:
+    # django-storages S3Storage: keys include the storage "location" prefix
+    old_key = storage._normalize_name(old_name)
+    new_key = storage._normalize_name(new_name)
+
+    client = storage.bucket.meta.client
+    extra_args = storage.get_object_parameters(new_key)
+    if extra_args:
+        # Headers of the new name (e.g. Cache-Control, comments/s3.py) instead
+        # of the source's; the content type is kept
+        head = client.head_object(Bucket=storage.bucket.name, Key=old_key)
+        extra_args.setdefault("ContentType", head["ContentType"])
+        extra_args["MetadataDirective"] = "REPLACE"
+
+    # Managed copy: multipart server-side copy for large objects
+    client.copy(
+        {"Bucket": storage.bucket.name, "Key": old_key},
+        storage.bucket.name,
+        new_key,
+        ExtraArgs=extra_args or None,
+    )
+    storage.delete(old_name)
+    return new_name
+
+
+def _move_by_copy(storage: Storage, old_name: str, new_name: str) -> str:
+    with storage.open(old_name, "rb") as source:
+        # save() reads File objects chunk by chunk
+        new_name = storage.save(new_name, source)
+    storage.delete(old_name)
+    return new_name
@@ -1,46 +1,176 @@
 from __future__ import annotations
 
-from pathlib import Path
+import logging
 
 from celery import shared_task
 from django.conf import settings
 
-from PIL import Image
+from . import indexing
+from .cache import bump_search_generation, bump_thread, thread_root_id_of
+from .cleanup import collect_orphaned_attachments, collect_stale_derivatives, collect_stale_upload_sessions
+from .images import build_variants, variant_scope
+from .models import Attachment, Blob
 
-from .models import Attachment
+logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=5)
-def resize_attachment_image(self, attachment_id: int, max_width: int = 320, max_height: int = 240) -> None:
-    attachment = Attachment.objects.filter(id=attachment_id).first()
-    if not attachment or not attachment.file:
+@shared_task(bind=True, max_retries=3, default_retry_delay=5, acks_late=True)
+def resize_attachment_image(self, attachment_id: int) -> None:
+    """
+    Render the derivatives of a "pending" image attachment
+    (comments/images.py), mark it "ready" and tell the sockets of its
+    thread (comments.events.publish_attachment_ready).
+
+    Scheduled on commit by comments.signals.attachment_saved. If the file
+    was moved meanwhile (temporary upload bound to a comment), this run is
+    stale: the bind scheduled another one.
+
+    Blob-backed images are rendered once per blob (comments/blobs.py):
+    the result goes to every pending attachment of the blob, and a task
+    finding the blob already processed just copies it.
+    """
+    attachment = Attachment.objects.select_related("blob").filter(id=attachment_id).first()
+    if not attachment or not attachment.file or attachment.status != Attachment.Status.PENDING:
+        return
+
+    blob = attachment.blob
+    if blob is not None and blob.status != Blob.Status.PENDING:
+        _finish_attachment(attachment, attachment.file.name, blob.status, blob.variants)
         return
 
-    file_path = Path(settings.MEDIA_ROOT) / attachment.file.name
-    if not file_path.exists():
+    file_name = attachment.file.name
+    storage = attachment.file.storage
+    if not storage.exists(file_name):
         return
 
     try:
-        with Image.open(file_path) as img:
-            img_format = (img.format or "").upper()
+        variants = build_variants(storage, file_name, variant_scope(attachment))
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            _finish_processing(attachment, Attachment.Status.FAILED)
+        raise self.retry(exc=exc)
+
+    if variants is None:
+        # Not an image or corrupted file
+        _finish_processing(attachment, Attachment.Status.FAILED)
+    else:
+        _finish_processing(attachment, Attachment.Status.READY, variants)
+
+
+def _finish_processing(attachment: Attachment, status: str, variants=None) -> None:
+    blob = attachment.blob
+    if blob is None:
+        _finish_attachment(attachment, attachment.file.name, status, variants)
+        return
+
+    Blob.objects.filter(id=blob.id).update(status=status, variants=variants or {})
+    waiting = Attachment.objects.filter(blob=blob, status=Attachment.Status.PENDING).select_related(
+        "comment"
+    )
+    for other in waiting:
+        _finish_attachment(other, other.file.name, status, variants)
+
+
+def _finish_attachment(attachment: Attachment, file_name: str, status: str, variants=None) -> None:
+    updated = Attachment.objects.filter(
+        id=attachment.id, file=file_name, status=Attachment.Status.PENDING
+    ).update(status=status, variants=variants or {})
+    if not updated or not attachment.comment_id:
+        return
 
-            # Only handle supported image formats
-            if img_format not in {"JPEG", "JPG", "PNG", "GIF"}:
-                return
+    from .events import publish_attachment_ready
 
-            # Pillow uses "JPEG" format string
-            if img_format == "JPG":
-                img_format = "JPEG"
+    attachment.status = status
+    attachment.variants = variants or {}
+    comment = attachment.comment
+    bump_thread(thread_root_id_of(comment), roots_changed=comment.parent_id is None)
+    publish_attachment_ready(attachment)
 
-            # Resize proportionally (in-place)
-            img.thumbnail((max_width, max_height))
 
-            save_kwargs = {}
-            if img_format == "JPEG":
-                save_kwargs["quality"] = 85
-                save_kwargs["optimize"] = True
+@shared_task(bind=True, max_retries=10, acks_late=True)
+def index_pending_comments(self) -> None:
+    """
+    Drain the Elasticsearch indexing queue (comments.indexing) in bulk batches.
 
-            img.save(file_path, format=img_format, **save_kwargs)
+    Elasticsearch errors retry with exponential backoff; ids stay queued
+    until a bulk request accepted them.
+    """
+    if not settings.ELASTICSEARCH_ENABLED:
+        return
+
+    batch_size = settings.COMMENTS_INDEX_BATCH_SIZE
+
+    try:
+        # Bounded run; the rest is picked up by the rescheduled task
+        for _ in range(settings.COMMENTS_INDEX_MAX_BATCHES):
+            batch = indexing.claim_batch(batch_size)
+            if not batch:
+                break
 
+            retry = set(indexing.index_batch([comment_id for comment_id, _ in batch]))
+            indexing.release([pair for pair in batch if pair[0] not in retry])
+            # Cached search pages may predate these documents
+            bump_search_generation()
+            if retry:
+                raise RuntimeError(f"{len(retry)} comment(s) rejected by Elasticsearch")
     except Exception as exc:
-        raise self.retry(exc=exc)
+        raise self.retry(exc=exc, countdown=min(2 ** self.request.retries, 60))
+
+    stats = indexing.queue_stats()
+    logger.info(
+        "Comment index queue: %s pending, lag %.1fs", stats["pending"], stats["lag_seconds"]
+    )
+
+    # Let the next enqueue() schedule a run; continue now if work is left
+    indexing.clear_scheduled()
+    if stats["pending"]:
+        indexing.schedule()
+
+
+@shared_task(acks_late=True)
+def cleanup_orphaned_attachments() -> dict:
+    """
+    Periodic (CELERY_BEAT_SCHEDULE): delete temporary uploads never bound
+    to a comment within COMMENTS_TMP_ATTACHMENT_TTL, idle resumable upload
+    sessions and stale image derivatives (comments/cleanup.py).
+    A bounded number of batches per run; the next run continues.
+    """
+    stats = collect_orphaned_attachments(max_batches=settings.COMMENTS_TMP_GC_MAX_BATCHES)
+    if stats["attachments"]:
+        logger.info(
+            "Deleted %s orphaned attachment(s), %s bytes reclaimed",
+            stats["attachments"],
+            stats["bytes"],
+        )
+
+    sessions = collect_stale_upload_sessions()
+    if sessions["sessions"]:
+        logger.info(
+            "Deleted %s stale upload session(s), %s bytes reclaimed",
+            sessions["sessions"],
+            sessions["bytes"],
+        )
+    stats["sessions"] = sessions["sessions"]
+    stats["bytes"] += sessions["bytes"]
+
+    derivatives = collect_stale_derivatives()
+    if derivatives["derivatives"]:
+        logger.info(
+            "Deleted %s stale derivative(s), %s bytes reclaimed",
+            derivatives["derivatives"],
+            derivatives["bytes"],
+        )
+    stats["derivatives"] = derivatives["derivatives"]
+    stats["bytes"] += derivatives["bytes"]
+    return stats
+
+
+@shared_task(acks_late=True)
+def prune_comment_events() -> int:
+    """
+    Periodic (CELERY_BEAT_SCHEDULE): trim the WebSocket replay log to
+    COMMENTS_EVENT_LOG_SIZE events (comments.events.prune_events).
+    """
+    from .events import prune_events
+
+    return prune_events()
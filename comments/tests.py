@@ -1,3 +1,1381 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework.throttling import AnonRateThrottle
+
+from .async_views import (
+    AsyncCommentDetailView,
+    AsyncCommentListView,
+    AsyncCommentSearchView,
+    AsyncCommentSuggestView,
+)
+from .blobs import acquire_blob, release_blob
+from .cache import _version_timeout
+from .cleanup import collect_orphaned_attachments
+from .consumers import RESYNC_CLOSE_CODE, CommentsConsumer
+from .events import prune_events, publish_attachment_ready, publish_comment_created
+from .images import variant_names
+from .metadata import FIELDS as METADATA_FIELDS
+from .models import MAX_DEPTH, Attachment, Blob, Comment, CommentEvent, UploadSession
+from .search import DatabaseSearchBackend, get_search_backend
+from .serializers import AttachmentSerializer, CommentCreateSerializer, CommentSerializer
+from .tasks import resize_attachment_image
+from .tree import load_threads
+from .uploads import UploadBodyLimitMiddleware
+from .views import CommentDetailView, CommentListCreateView, CommentSearchAPIView, CommentSuggestAPIView
+
+try:
+    import boto3
+    import storages  # noqa: F401
+    from moto.server import ThreadedMotoServer
+except ImportError:  # optional: S3 is only used with AWS_STORAGE_BUCKET_NAME
+    ThreadedMotoServer = None
+
+PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d4944415478da63f8cfc0f01f0005000201a2e0e8e40000000049454e44ae426082"
+)
+
+
+def create_thread(depth: int, replies_per_level: int = 1, **fields) -> Comment:
+    """
+    A root comment with ``depth`` levels of replies below it.
+    """
+    root = Comment.objects.create(user_name="root", email="root@example.com", text="root", **fields)
+    level = [root]
+    for _ in range(depth):
+        level = [
+            Comment.objects.create(user_name="reply", email="reply@example.com", text="reply", parent=parent)
+            for parent in level
+            for _ in range(replies_per_level)
+        ]
+    return root
+
+
+def flatten(comments):
+    for comment in comments:
+        yield comment
+        yield from flatten(comment.thread_children)
+
+
+class MediaTestCase(TestCase):
+    """
+    Files and upload sessions go to a throwaway directory; API calls as an
+    authenticated user (no CAPTCHA).
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = self.settings(
+            MEDIA_ROOT=self.media_root,
+            COMMENTS_UPLOAD_SESSION_DIR=os.path.join(self.media_root, "sessions"),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user("tester", "tester@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_comment(self, **data):
+        data.setdefault("user_name", "tester")
+        data.setdefault("email", "tester@example.com")
+        data.setdefault("text", "Hello")
+        return self.client.post("/api/comments/", data, format="multipart" if "files" in data else "json")
+
+    def upload(self, name: str, content: bytes, **data):
+        """
+        Two-step upload (POST /api/comments/upload/).
+        """
+        data["file"] = SimpleUploadedFile(name, content)
+        return self.client.post("/api/comments/upload/", data, format="multipart")
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), self.media_root)
+            for path, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+
+class ThreadLoadingTests(TestCase):
+    def test_query_count_does_not_depend_on_tree_size(self):
+        small = [create_thread(depth=1)]
+        with CaptureQueriesContext(connection) as small_queries:
+            load_threads(Comment.objects.filter(id__in=[c.id for c in small]))
+
+        large = [create_thread(depth=6, replies_per_level=2) for _ in range(3)]
+        with CaptureQueriesContext(connection) as large_queries:
+            loaded = load_threads(Comment.objects.filter(id__in=[c.id for c in large]).order_by("id"))
+
+        self.assertEqual(len(large_queries), len(small_queries))
+        self.assertEqual(len(list(flatten(loaded))), 3 * (2**7 - 1))
+
+    def test_children_are_linked_in_creation_order(self):
+        root = create_thread(depth=2, replies_per_level=2)
+        (loaded,) = load_threads([Comment.objects.get(id=root.id)])
+
+        for comment in flatten([loaded]):
+            expected = list(Comment.objects.filter(parent=comment).order_by("created_at", "id"))
+            self.assertEqual(comment.thread_children, expected)
+
+    def test_rows_without_path_are_loaded_too(self):
+        root = create_thread(depth=3)
+        Comment.objects.update(path="", depth=0, thread_root=None)
+
+        (loaded,) = load_threads([Comment.objects.get(id=root.id)])
+        self.assertEqual(len(list(flatten([loaded]))), 4)
+
+
+class CommentPathTests(MediaTestCase):
+    def test_new_comments_get_thread_root_depth_and_path(self):
+        root = create_thread(depth=2)
+        reply = Comment.objects.get(depth=1)
+        leaf = Comment.objects.get(depth=2)
+
+        self.assertEqual(root.thread_root_id, root.id)
+        self.assertEqual(leaf.thread_root_id, root.id)
+        self.assertEqual(leaf.path, f"{root.id:010d}{reply.id:010d}{leaf.id:010d}")
+
+    def test_backfill_restores_the_columns(self):
+        create_thread(depth=3, replies_per_level=2)
+        create_thread(depth=1)
+        expected = list(Comment.objects.order_by("id").values_list("id", "thread_root_id", "depth", "path"))
+        Comment.objects.update(path="", depth=0, thread_root=None)
+
+        call_command("backfill_comment_paths", chunk_size=3, stdout=io.StringIO())
+
+        backfilled = list(Comment.objects.order_by("id").values_list("id", "thread_root_id", "depth", "path"))
+        self.assertEqual(backfilled, expected)
+
+    def test_replies_deeper_than_the_path_allows_are_refused(self):
+        root = create_thread(depth=1)
+        deepest = Comment.objects.get(parent=root)
+        Comment.objects.filter(id=deepest.id).update(depth=MAX_DEPTH)
+
+        response = self.post_comment(parent=deepest.id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("parent", response.json())
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.roots = [
+            Comment.objects.create(user_name=f"user{i % 4}", email="a@example.com", text=f"root {i}")
+            for i in range(30)
+        ]
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url, HTTP_HOST="localhost")
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [comment["id"] for comment in body["results"]]
+            url = body["next"]
+        return ids
+
+    def test_pages_cover_every_root_once(self):
+        ids = self.walk("/api/comments/?pagination=cursor")
+        newest_first = sorted(self.roots, key=lambda c: (c.created_at, c.id), reverse=True)
+        self.assertEqual(ids, [c.id for c in newest_first])
+
+    def test_ties_are_broken_by_id(self):
+        ids = self.walk("/api/comments/?pagination=cursor&ordering=user_name")
+        self.assertEqual(ids, [c.id for c in sorted(self.roots, key=lambda c: (c.user_name, c.id))])
+
+    def test_new_roots_do_not_shift_later_pages(self):
+        response = self.client.get("/api/comments/?pagination=cursor", HTTP_HOST="localhost").json()
+        seen = [comment["id"] for comment in response["results"]]
+
+        Comment.objects.create(user_name="late", email="a@example.com", text="late")
+        seen += self.walk(response["next"].replace("http://localhost", ""))
+
+        self.assertEqual(sorted(seen), sorted(c.id for c in self.roots))
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get("/api/comments/?cursor=garbage", HTTP_HOST="localhost")
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.root = create_thread(depth=1)
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_HOST="localhost", **headers)
+
+    def test_new_reply_invalidates_list_and_detail(self):
+        url = f"/api/comments/{self.root.id}/"
+        list_etag, detail_etag = self.get("/api/comments/")["ETag"], self.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(user_name="new", email="a@example.com", text="new", parent=self.root)
+
+        response = self.get("/api/comments/", HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("new", [c["user_name"] for c in response.json()["results"][0]["children"]])
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=detail_etag).status_code, 200)
+
+    def test_edit_invalidates_detail(self):
+        url = f"/api/comments/{self.root.id}/"
+        self.assertEqual(self.get(url).json()["text"], "root")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.root.text = "edited"
+            self.root.save()
+
+        self.assertEqual(self.get(url).json()["text"], "edited")
+
+    def test_attachment_delete_invalidates_thread(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment = Attachment.objects.create(
+                comment=self.root, file=SimpleUploadedFile("note.txt", b"hello\n"), name="note.txt"
+            )
+        url = f"/api/comments/{self.root.id}/"
+        self.assertEqual(len(self.get(url).json()["attachments"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment.delete()
+
+        self.assertEqual(self.get(url).json()["attachments"], [])
+
+    def test_thread_keys_expire(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(user_name="new", email="a@example.com", text="new", parent=self.root)
+        self.get(f"/api/comments/{self.root.id}/")
+        keys = [f"comments:v:thread:{self.root.id}", f"comments:t:thread:{self.root.id}"]
+        self.assertEqual(len(cache.get_many(keys)), 2)
+
+        later = time.time() + _version_timeout() + 1
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            self.assertEqual(cache.get_many(keys), {})
+
+
+class ConditionalRequestTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.root = create_thread(depth=1)
+
+    def test_unchanged_list_is_304(self):
+        first = self.client.get("/api/comments/", HTTP_HOST="localhost")
+        self.assertEqual(first.status_code, 200)
+
+        again = self.client.get("/api/comments/", HTTP_HOST="localhost", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+
+    def test_unchanged_detail_is_304_by_date_too(self):
+        url = f"/api/comments/{self.root.id}/"
+        first = self.client.get(url, HTTP_HOST="localhost")
+
+        again = self.client.get(url, HTTP_HOST="localhost", HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(again.status_code, 304)
+
+
+class SocketTestCase(TestCase):
+    """
+    WebSocket tests on the in-memory channel layer; test bodies are
+    coroutines run with ``self.run_async``.
+    """
+
+    def run_async(self, coroutine_function):
+        return async_to_sync(coroutine_function)()
+
+    async def open_socket(self, **subscribe):
+        communicator = WebsocketCommunicator(CommentsConsumer.as_asgi(), "/ws/comments/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        if subscribe:
+            await communicator.send_json_to({"action": "subscribe", **subscribe})
+            ack = await communicator.receive_json_from(timeout=2)
+            self.assertEqual(ack["type"], "subscriptions")
+        return communicator
+
+    async def publish(self, parent=None, text="hi"):
+        def create():
+            comment = Comment.objects.create(user_name="a", email="a@example.com", text=text, parent=parent)
+            publish_comment_created(comment)
+            return comment
+
+        return await sync_to_async(create)()
+
+
+class CommentFrameTests(SocketTestCase):
+    def test_frame_is_rendered_once_for_every_socket(self):
+        async def run():
+            sockets = [await self.open_socket() for _ in range(3)]
+            with mock.patch("comments.events.CommentSerializer", wraps=CommentSerializer) as serializer:
+                comment = await self.publish(text="once")
+
+            frames = [await socket.receive_from(timeout=2) for socket in sockets]
+            for socket in sockets:
+                await socket.disconnect()
+            return serializer.call_count, comment, frames
+
+        calls, comment, frames = self.run_async(run)
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(len(set(frames)), 1)
+        self.assertIn('"payload"', frames[0])
+        self.assertIn(f'"id": {comment.id}', frames[0])
+
+    @override_settings(COMMENTS_WS_MAX_FRAME_BYTES=64)
+    def test_large_frame_becomes_id_only(self):
+        async def run():
+            socket = await self.open_socket()
+            comment = await self.publish(text="x" * 1000)
+            frame = await socket.receive_json_from(timeout=2)
+            await socket.disconnect()
+            return comment, frame
+
+        comment, frame = self.run_async(run)
+        self.assertEqual(
+            frame,
+            {"seq": frame["seq"], "type": "comment_created", "comment_id": comment.id, "parent": None},
+        )
+
+
+class SubscriptionTests(SocketTestCase):
+    def setUp(self):
+        self.first = Comment.objects.create(user_name="a", email="a@example.com", text="first")
+        self.second = Comment.objects.create(user_name="a", email="a@example.com", text="second")
+
+    def test_subscribe_and_unsubscribe(self):
+        async def run():
+            socket = await self.open_socket()
+            acks = []
+            for message in (
+                {"action": "subscribe", "threads": [self.first.id, self.second.id], "roots": False},
+                {"action": "unsubscribe", "threads": [self.first.id]},
+                {"action": "subscribe", "threads": [self.first.id], "replace": True},
+                {"action": "subscribe", "threads": ["x"]},
+            ):
+                await socket.send_json_to(message)
+                acks.append(await socket.receive_json_from(timeout=2))
+            await socket.disconnect()
+            return acks
+
+        subscribed, unsubscribed, replaced, invalid = self.run_async(run)
+
+        self.assertEqual(subscribed["threads"], [self.first.id, self.second.id])
+        self.assertFalse(subscribed["roots"])
+        self.assertEqual(unsubscribed["threads"], [self.second.id])
+        self.assertEqual(replaced["threads"], [self.first.id])
+        self.assertEqual(invalid["type"], "error")
+
+    def test_replies_reach_only_sockets_of_their_thread(self):
+        async def run():
+            first = await self.open_socket(threads=[self.first.id], roots=False)
+            second = await self.open_socket(threads=[self.second.id], roots=False)
+            roots = await self.open_socket()
+
+            reply = await self.publish(parent=self.first)
+            received = await first.receive_json_from(timeout=2)
+            nothing = [await socket.receive_nothing(0.2) for socket in (second, roots)]
+
+            root = await self.publish()
+            new_root = await roots.receive_json_from(timeout=2)
+            nothing += [await socket.receive_nothing(0.2) for socket in (first, second)]
+
+            for socket in (first, second, roots):
+                await socket.disconnect()
+            return reply, received, root, new_root, nothing
+
+        reply, received, root, new_root, nothing = self.run_async(run)
+
+        self.assertEqual(received["payload"]["id"], reply.id)
+        self.assertEqual(new_root["payload"]["id"], root.id)
+        self.assertEqual(nothing, [True] * 4)
+
+
+class OutboundFlowTests(SocketTestCase):
+    @override_settings(COMMENTS_WS_COALESCE_MS=200)
+    def test_burst_is_sent_as_one_batch(self):
+        async def run():
+            socket = await self.open_socket()
+            comments = [await self.publish(text=str(i)) for i in range(3)]
+            frame = await socket.receive_json_from(timeout=2)
+            nothing = await socket.receive_nothing(0.3)
+            await socket.disconnect()
+            return comments, frame, nothing
+
+        comments, frame, nothing = self.run_async(run)
+
+        self.assertEqual(frame["type"], "comments_batch")
+        self.assertEqual([event["payload"]["id"] for event in frame["events"]], [c.id for c in comments])
+        self.assertTrue(nothing)
+
+    @override_settings(COMMENTS_WS_COALESCE_MS=200, COMMENTS_WS_MAX_PENDING=2)
+    def test_burst_over_the_limit_is_resync(self):
+        async def run():
+            socket = await self.open_socket()
+            for i in range(3):
+                await self.publish(text=str(i))
+            frame = await socket.receive_json_from(timeout=2)
+            nothing = await socket.receive_nothing(0.3)
+            await socket.disconnect()
+            return frame, nothing
+
+        frame, nothing = self.run_async(run)
+        self.assertEqual(frame, {"type": "resync"})
+        self.assertTrue(nothing)
+
+    @override_settings(COMMENTS_WS_COALESCE_MS=0, COMMENTS_WS_MAX_UNACKED=2)
+    def test_client_that_stops_acking_is_closed(self):
+        async def run():
+            socket = await self.open_socket()
+            await socket.send_json_to({"action": "ack", "seq": 0})
+
+            frames = []
+            for i in range(2):
+                await self.publish(text=str(i))
+                frames.append(await socket.receive_json_from(timeout=2))
+            await self.publish(text="too far behind")
+            closed = await socket.receive_output(timeout=2)
+            await socket.wait()
+            return frames, closed
+
+        frames, closed = self.run_async(run)
+        self.assertEqual([frame["payload"]["text"] for frame in frames], ["0", "1"])
+        self.assertEqual(closed, {"type": "websocket.close", "code": RESYNC_CLOSE_CODE})
+
+    @override_settings(COMMENTS_WS_COALESCE_MS=0, COMMENTS_WS_MAX_UNACKED=2)
+    def test_client_that_keeps_up_stays_connected(self):
+        async def run():
+            socket = await self.open_socket()
+            await socket.send_json_to({"action": "ack", "seq": 0})
+
+            texts = []
+            for i in range(5):
+                await self.publish(text=str(i))
+                frame = await socket.receive_json_from(timeout=2)
+                texts.append(frame["payload"]["text"])
+                await socket.send_json_to({"action": "ack", "seq": frame["seq"]})
+            await socket.disconnect()
+            return texts
+
+        self.assertEqual(self.run_async(run), ["0", "1", "2", "3", "4"])
+
+    @override_settings(COMMENTS_WS_COALESCE_MS=0, COMMENTS_WS_MAX_LAG_SECONDS=30)
+    def test_client_with_an_old_unacked_frame_is_closed(self):
+        async def run():
+            socket = await self.open_socket()
+            await socket.send_json_to({"action": "ack", "seq": 0})
+
+            with mock.patch("comments.consumers.time") as clock:
+                clock.monotonic.return_value = 1000.0
+                await self.publish(text="sent")
+                await socket.receive_json_from(timeout=2)
+
+                clock.monotonic.return_value = 1031.0
+                await self.publish(text="too late")
+                closed = await socket.receive_output(timeout=2)
+            await socket.wait()
+            return closed
+
+        self.assertEqual(self.run_async(run), {"type": "websocket.close", "code": RESYNC_CLOSE_CODE})
+
+    @override_settings(COMMENTS_WS_COALESCE_MS=0, COMMENTS_WS_MAX_UNACKED=1)
+    def test_clients_that_never_ack_are_not_tracked(self):
+        async def run():
+            socket = await self.open_socket()
+            texts = []
+            for i in range(3):
+                await self.publish(text=str(i))
+                texts.append((await socket.receive_json_from(timeout=2))["payload"]["text"])
+            await socket.disconnect()
+            return texts
+
+        self.assertEqual(self.run_async(run), ["0", "1", "2"])
+
+
+class EventReplayTests(TestCase):
+    def setUp(self):
+        self.events = []
+        for text in ("one", "two", "three"):
+            comment = Comment.objects.create(user_name="a", email="a@example.com", text=text)
+            publish_comment_created(comment)
+        self.seqs = list(CommentEvent.objects.order_by("id").values_list("id", flat=True))
+
+    def subscribe(self, message, frames):
+        async def run():
+            communicator = WebsocketCommunicator(CommentsConsumer.as_asgi(), "/ws/comments/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to(message)
+            received = [await communicator.receive_json_from(timeout=2) for _ in range(frames)]
+            self.assertTrue(await communicator.receive_nothing(0.2))
+            await communicator.disconnect()
+            return received
+
+        return async_to_sync(run)()
+
+    def test_seqs_are_event_ids_in_order(self):
+        self.assertEqual(self.seqs, sorted(self.seqs))
+        self.assertEqual(len(self.seqs), 3)
+
+    def test_reconnect_replays_missed_events(self):
+        ack, replayed = self.subscribe({"action": "subscribe", "last_seq": self.seqs[0]}, frames=2)
+
+        self.assertEqual(ack["seq"], self.seqs[-1])
+        events = replayed["events"] if replayed["type"] == "comments_batch" else [replayed]
+        self.assertEqual([event["seq"] for event in events], self.seqs[1:])
+
+    def test_up_to_date_client_gets_nothing(self):
+        (ack,) = self.subscribe({"action": "subscribe", "last_seq": self.seqs[-1]}, frames=1)
+        self.assertEqual(ack, {"type": "subscriptions", "threads": [], "roots": True, "seq": self.seqs[-1]})
+
+    @override_settings(COMMENTS_EVENT_LOG_SIZE=1)
+    def test_gap_older_than_the_log_is_resync(self):
+        self.assertEqual(prune_events(), 2)
+
+        ack, resync = self.subscribe({"action": "subscribe", "last_seq": self.seqs[0]}, frames=2)
+        self.assertEqual(resync, {"type": "resync"})
+
+    @override_settings(COMMENTS_EVENT_REPLAY_LIMIT=1)
+    def test_gap_longer_than_the_replay_limit_is_resync(self):
+        ack, resync = self.subscribe({"action": "subscribe", "last_seq": 0}, frames=2)
+        self.assertEqual(resync, {"type": "resync"})
+
+
+class OncePerMinuteThrottle(AnonRateThrottle):
+    rate = "1/min"
+
+
+class AsyncViewParityTests(MediaTestCase):
+    """
+    The async read views (COMMENTS_ASYNC_VIEWS) answer like the sync DRF
+    views, errors, authentication and throttling included.
+    """
+
+    headers = ("Content-Type", "WWW-Authenticate", "Retry-After")
+    # Built from version counters, which restart when the cache is cleared
+    validators = ("ETag", "Last-Modified")
+
+    list_views = (CommentListCreateView.as_view(), AsyncCommentListView.as_view())
+    detail_views = (CommentDetailView.as_view(), AsyncCommentDetailView.as_view())
+    search_views = (CommentSearchAPIView.as_view(), AsyncCommentSearchView.as_view())
+    suggest_views = (CommentSuggestAPIView.as_view(), AsyncCommentSuggestView.as_view())
+
+    def setUp(self):
+        super().setUp()
+        self.root = create_thread(depth=2)
+        create_thread(depth=1)
+
+    def call(self, view, url, kwargs, headers):
+        request = RequestFactory().get(url, HTTP_HOST="localhost", **headers)
+        if view.view_class.view_is_async:
+            response = async_to_sync(view)(request, **kwargs)
+        else:
+            response = view(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def assertSameResponses(self, views, url, requests=1, kwargs=None, **headers):
+        """
+        Send ``requests`` identical requests to each view (cache cleared
+        before each view) and compare the last responses.
+        """
+        answers = []
+        for view in views:
+            cache.clear()
+            for _ in range(requests):
+                response = self.call(view, url, kwargs or {}, headers)
+            answers.append(
+                (
+                    response.status_code,
+                    json.loads(response.content),
+                    {name: response.get(name) for name in self.headers},
+                    [name for name in self.validators if response.has_header(name)],
+                )
+            )
+
+        self.assertEqual(answers[0], answers[1])
+        return answers[0]
+
+    def test_list(self):
+        for url, status in (
+            ("/api/comments/", 200),
+            ("/api/comments/?pagination=cursor&ordering=user_name&page_size=1", 200),
+            ("/api/comments/?page=99", 404),
+            ("/api/comments/?cursor=garbage", 404),
+            ("/api/comments/?created_after=yesterday", 400),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.assertSameResponses(self.list_views, url)[0], status)
+
+    def test_detail(self):
+        for pk, status in ((self.root.id, 200), (10**9, 404)):
+            with self.subTest(pk=pk):
+                response = self.assertSameResponses(
+                    self.detail_views, f"/api/comments/{pk}/", kwargs={"pk": pk}
+                )
+                self.assertEqual(response[0], status)
+
+    def test_search_and_suggest(self):
+        for views, url, status in (
+            (self.search_views, "/api/comments/search/?q=reply", 200),
+            (self.search_views, "/api/comments/search/", 400),
+            (self.suggest_views, "/api/comments/search/suggest/?q=roo", 200),
+            (self.suggest_views, "/api/comments/search/suggest/?limit=x", 400),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.assertSameResponses(views, url)[0], status)
+
+    def test_invalid_token_is_401(self):
+        status, body, headers, validators = self.assertSameResponses(
+            self.list_views, "/api/comments/", HTTP_AUTHORIZATION="Bearer not-a-token"
+        )
+        self.assertEqual(status, 401)
+        self.assertIsNotNone(headers["WWW-Authenticate"])
+
+    def test_throttles_apply(self):
+        with mock.patch.object(CommentDetailView, "throttle_classes", [OncePerMinuteThrottle]):
+            status, body, headers, validators = self.assertSameResponses(
+                self.detail_views, f"/api/comments/{self.root.id}/", requests=2, kwargs={"pk": self.root.id}
+            )
+        self.assertEqual(status, 429)
+        self.assertIsNotNone(headers["Retry-After"])
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def search(self, url):
+        return self.client.get(url, HTTP_HOST="localhost")
+
+    def comment(self, text, user_name="writer", email="writer@example.com"):
+        return Comment.objects.create(user_name=user_name, email=email, text=text)
+
+
+class SearchBackendTests(SearchTestCase):
+    def test_sqlite_uses_the_database_backend(self):
+        self.assertIsInstance(get_search_backend(), DatabaseSearchBackend)
+
+    def test_text_author_and_email_match_case_insensitively(self):
+        by_text = self.comment("Hello World")
+        by_name = self.comment("nothing", user_name="WorldWalker")
+        by_email = self.comment("nothing", email="world@example.com")
+        self.comment("unrelated")
+
+        items = self.search("/api/comments/search/?q=world").json()["items"]
+        self.assertEqual([item["id"] for item in items], [by_email.id, by_name.id, by_text.id])
+        self.assertEqual(set(items[0]), {"id", "user_name", "email", "text", "created_at"})
+
+    def test_missing_query_is_400(self):
+        for url in ("/api/comments/search/", "/api/comments/search/?q=%20"):
+            with self.subTest(url=url):
+                response = self.search(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"detail": "Query param 'q' is required."})
+
+
+class SearchPaginationTests(SearchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.matches = [self.comment(f"needle {i}") for i in range(5)]
+        self.comment("haystack")
+
+    def test_next_cursor_walks_every_match_once(self):
+        ids, url, pages = [], "/api/comments/search/?q=needle&page_size=2", 0
+        while url:
+            body = self.search(url).json()
+            ids += [item["id"] for item in body["items"]]
+            url, pages = body["next"], pages + 1
+
+        self.assertEqual(ids, [c.id for c in reversed(self.matches)])
+        self.assertEqual(pages, 3)
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.search("/api/comments/search/?q=needle&cursor=garbage").status_code, 404)
+
+    @override_settings(COMMENTS_SEARCH_TRACK_TOTAL_HITS=3)
+    def test_total_is_bounded_unless_exact(self):
+        bounded = self.search("/api/comments/search/?q=needle&page_size=1").json()
+        self.assertEqual((bounded["total"], bounded["total_relation"]), (3, "gte"))
+
+        exact = self.search("/api/comments/search/?q=needle&page_size=1&exact_total=1").json()
+        self.assertEqual((exact["total"], exact["total_relation"]), (5, "eq"))
+
+        few = self.search("/api/comments/search/?q=needle%204").json()
+        self.assertEqual((few["total"], few["total_relation"]), (1, "eq"))
+
+    def test_new_comment_invalidates_cached_pages(self):
+        url = "/api/comments/search/?q=needle"
+        self.assertEqual(self.search(url).json()["total"], 5)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.comment("needle 5")
+        # Served from the cache until the generation is bumped on commit
+        self.assertEqual(self.search(url).json()["total"], 5)
+        self.assertEqual(self.search("/api/comments/search/?q=%20NEEDLE").json()["total"], 5)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.search(url).json()["total"], 6)
+
+
+@override_settings(COMMENTS_SUGGEST_MIN_CHARS=2, COMMENTS_SUGGEST_LIMIT=3, COMMENTS_SUGGEST_MAX_LIMIT=4)
+class SuggestTests(SearchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.comments = [self.comment(f"<b>topic</b> {i}", user_name=f"Tobias{i}") for i in range(6)]
+
+    def suggest(self, query):
+        response = self.search(f"/api/comments/search/suggest/?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_prefix_below_the_minimum_is_empty(self):
+        self.assertEqual(self.suggest("q=t"), {"q": "t", "suggestions": []})
+
+    def test_newest_matches_first_as_plain_text(self):
+        body = self.suggest("q=top")
+        self.assertEqual(body["q"], "top")
+        self.assertEqual([s["id"] for s in body["suggestions"]], [c.id for c in self.comments[:-4:-1]])
+        self.assertEqual(
+            body["suggestions"][0], {"id": self.comments[-1].id, "user_name": "Tobias5", "text": "topic 5"}
+        )
+
+    def test_author_prefix_matches(self):
+        self.comment("unrelated", user_name="Tom")
+        self.assertEqual([s["user_name"] for s in self.suggest("q=tom")["suggestions"]], ["Tom"])
+
+    def test_limit_is_capped(self):
+        self.assertEqual(len(self.suggest("q=top&limit=1")["suggestions"]), 1)
+        self.assertEqual(len(self.suggest("q=top&limit=100")["suggestions"]), 4)
+        self.assertEqual(self.search("/api/comments/search/suggest/?q=top&limit=x").status_code, 400)
+
+
+class AttachmentReadyEventTests(SocketTestCase):
+    def setUp(self):
+        self.root = Comment.objects.create(user_name="a", email="a@example.com", text="root")
+        self.attachment = Attachment.objects.create(
+            comment=self.root, file="attachments/dot.png", name="dot.png", status=Attachment.Status.READY
+        )
+
+    def test_root_attachment_goes_to_its_thread(self):
+        async def run():
+            thread = await self.open_socket(threads=[self.root.id], roots=False)
+            roots = await self.open_socket()
+
+            await sync_to_async(publish_attachment_ready)(self.attachment)
+            frame = await thread.receive_json_from(timeout=2)
+            nothing = await roots.receive_nothing(0.2)
+
+            for socket in (thread, roots):
+                await socket.disconnect()
+            return frame, nothing
+
+        frame, nothing = self.run_async(run)
+        self.assertEqual((frame["type"], frame["payload"]["id"]), ("attachment_ready", self.attachment.id))
+        self.assertTrue(nothing)
+
+    def test_replay_sends_it_to_thread_subscribers(self):
+        last_seq = CommentEvent.objects.count()
+        publish_attachment_ready(self.attachment)
+        self.assertEqual(CommentEvent.objects.get().thread_root_id, self.root.id)
+
+        async def run():
+            thread = await self.open_socket(threads=[self.root.id], roots=False, last_seq=last_seq)
+            roots = await self.open_socket(roots=True, last_seq=last_seq)
+            frame = await thread.receive_json_from(timeout=2)
+            nothing = await roots.receive_nothing(0.2)
+
+            for socket in (thread, roots):
+                await socket.disconnect()
+            return frame, nothing
+
+        frame, nothing = self.run_async(run)
+        self.assertEqual(frame["type"], "attachment_ready")
+        self.assertTrue(nothing)
+
+
+def image_bytes(size, image_format="JPEG") -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buf, image_format)
+    return buf.getvalue()
+
+
+class ImageDerivativeTests(MediaTestCase):
+    def attach(self, name, content):
+        return Attachment.objects.create(file=SimpleUploadedFile(name, content), name=name)
+
+    def resize(self, attachment):
+        result = resize_attachment_image.apply(args=[attachment.id])
+        attachment.refresh_from_db()
+        return result
+
+    def test_image_goes_from_pending_to_ready(self):
+        attachment = self.attach("photo.jpg", image_bytes((2000, 1500)))
+        self.assertEqual(attachment.status, Attachment.Status.PENDING)
+
+        self.assertTrue(self.resize(attachment).successful())
+
+        self.assertEqual(attachment.status, Attachment.Status.READY)
+        sizes = {name: (v["width"], v["height"]) for name, v in attachment.variants.items()}
+        self.assertEqual(sizes, {"thumb": (320, 240), "display": (1280, 960)})
+        self.assertEqual(attachment.blob.status, Attachment.Status.READY)
+
+        data = AttachmentSerializer(attachment).data
+        thumb, display = attachment.variants["thumb"], attachment.variants["display"]
+        self.assertEqual(data["status"], "ready")
+        self.assertEqual(data["thumb"], f"/media/{thumb['src']}")
+        self.assertEqual(data["display"], f"/media/{display['src']}")
+        self.assertEqual(data["srcset"], f"/media/{thumb['src']} 320w, /media/{display['src']} 1280w")
+        self.assertEqual(data["webp_srcset"], f"/media/{thumb['webp']} 320w, /media/{display['webp']} 1280w")
+        for variant in (thumb, display):
+            with default_storage.open(variant["webp"]) as fh, Image.open(fh) as webp:
+                self.assertEqual((webp.format, webp.size), ("WEBP", (variant["width"], variant["height"])))
+
+    def test_small_image_has_no_separate_display_size(self):
+        attachment = self.attach("icon.png", image_bytes((200, 100), "PNG"))
+        self.resize(attachment)
+
+        self.assertEqual(list(attachment.variants), ["thumb"])
+        thumb = attachment.variants["thumb"]
+        self.assertEqual((thumb["width"], thumb["height"]), (200, 100))
+        data = AttachmentSerializer(attachment).data
+        self.assertEqual(data["display"], data["thumb"])
+
+    def test_corrupt_image_fails(self):
+        attachment = self.attach("broken.png", PNG_1X1[:16] + b"\x00" * 64)
+
+        self.assertTrue(self.resize(attachment).successful())
+
+        self.assertEqual(attachment.status, Attachment.Status.FAILED)
+        self.assertEqual(AttachmentSerializer(attachment).data["srcset"], None)
+
+    def test_reupload_keeps_its_derivatives_when_the_old_blob_goes(self):
+        content = image_bytes((2000, 1500))
+        old = self.attach("photo.jpg", content)
+        self.resize(old)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            old.delete()
+        new = self.attach("again.jpg", content)
+        self.assertNotEqual(new.blob_id, old.blob_id)
+        self.resize(new)
+        for callback in callbacks:  # the old blob's deletion commits only now
+            callback()
+
+        self.assertTrue(set(variant_names(new.variants)).isdisjoint(variant_names(old.variants)))
+        for name in variant_names(new.variants):
+            self.assertTrue(default_storage.exists(name), name)
+        for name in variant_names(old.variants):
+            self.assertFalse(default_storage.exists(name), name)
+
+    def test_other_files_are_not_resized(self):
+        attachment = self.attach("notes.txt", b"hello\n")
+        self.assertEqual(attachment.status, Attachment.Status.READY)
+
+        with mock.patch("comments.tasks.build_variants") as build_variants:
+            self.resize(attachment)
+
+        build_variants.assert_not_called()
+        self.assertEqual((attachment.status, attachment.variants), (Attachment.Status.READY, {}))
+
+
+class BindAttachmentTests(MediaTestCase):
+    """
+    Two-step uploads stored before blobs: moved to the comment's folder
+    once the comment is committed.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.key = uuid.uuid4()
+        name = default_storage.save(f"attachments/tmp/{self.key}/notes.txt", ContentFile(b"notes\n"))
+        self.attachment = Attachment.objects.create(file=name, name="notes.txt", upload_key=self.key)
+        self.tmp_name = name
+
+    def test_file_moves_when_the_comment_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_comment(attachment_ids=[self.attachment.id], upload_key=str(self.key))
+        self.assertEqual(response.status_code, 201)
+
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.comment_id, response.json()["id"])
+        self.assertEqual(self.attachment.file.name, self.tmp_name)
+        self.assertTrue(default_storage.exists(self.tmp_name))
+
+        for callback in callbacks:
+            callback()
+
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.file.name, f"attachments/{response.json()['id']}/notes.txt")
+        self.assertTrue(default_storage.exists(self.attachment.file.name))
+        self.assertFalse(default_storage.exists(self.tmp_name))
+
+    def test_rollback_leaves_rows_and_files_alone(self):
+        serializer = CommentCreateSerializer(
+            data={"text": "Hello", "attachment_ids": [self.attachment.id], "upload_key": str(self.key)},
+            context={"request": SimpleNamespace(user=self.user)},
+        )
+        serializer.is_valid(raise_exception=True)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                serializer.save()
+                raise RuntimeError("the request fails after the comment was created")
+
+        self.assertEqual(callbacks, [])
+        self.attachment.refresh_from_db()
+        self.assertEqual((self.attachment.comment_id, self.attachment.file.name), (None, self.tmp_name))
+        self.assertTrue(default_storage.exists(self.tmp_name))
+
+
+class SingleStepUploadTests(MediaTestCase):
+    def test_files_are_checked_while_streaming(self):
+        evil = SimpleUploadedFile("evil.png", b"<html><script>alert(1)</script></html>")
+        response = self.post_comment(files=[evil])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("files", response.json())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_files_are_stored_with_their_digest(self):
+        response = self.post_comment(files=[SimpleUploadedFile("dot.png", PNG_1X1)])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        attachment = Attachment.objects.get()
+        self.assertEqual(attachment.sha256, hashlib.sha256(PNG_1X1).hexdigest())
+
+
+class StreamingUploadCheckTests(MediaTestCase):
+    def assertRefused(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()["file"][0])
+        self.assertFalse(Attachment.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_disguised_file_is_refused(self):
+        self.assertRefused(self.upload("photo.jpg", b"MZ\x90\x00" + b"\x00" * 100), "does not match")
+
+    def test_unknown_extension_is_refused(self):
+        self.assertRefused(self.upload("run.exe", b"MZ\x90\x00"), "File extension 'exe' is not allowed")
+
+    @override_settings(COMMENTS_UPLOAD_MAX_IMAGE_BYTES=1024)
+    def test_oversized_image_is_refused(self):
+        self.assertRefused(self.upload("big.png", PNG_1X1 + b"\x00" * 2048), "File size must be")
+
+    def test_text_must_be_utf8(self):
+        self.assertRefused(self.upload("note.txt", "caf\xe9".encode("latin-1")), "UTF-8")
+
+    def test_accepted_upload_has_its_digest(self):
+        response = self.upload("note.txt", b"hello\n")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["sha256"], hashlib.sha256(b"hello\n").hexdigest())
+
+
+@override_settings(COMMENTS_UPLOAD_MAX_REQUEST_BYTES=10, COMMENTS_UPLOAD_CHUNK_BYTES=4)
+class UploadBodyLimitTests(TestCase):
+    """
+    UploadBodyLimitMiddleware in front of an app that reads the whole body,
+    as Django's ASGIHandler does before any view runs.
+    """
+
+    def setUp(self):
+        self.received = None
+
+    async def app(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.received = "disconnect"
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        self.received = body
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    def request(self, path, *chunks, content_length=None):
+        headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+        scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+
+        async def run():
+            communicator = ApplicationCommunicator(UploadBodyLimitMiddleware(self.app), scope)
+            for i, chunk in enumerate(chunks):
+                await communicator.send_input(
+                    {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                )
+            start = await communicator.receive_output(1)
+            body = await communicator.receive_output(1)
+            await communicator.wait(1)
+            return start["status"], body["body"]
+
+        return async_to_sync(run)()
+
+    def test_declared_length_over_the_limit_is_refused_unread(self):
+        status, body = self.request("/api/comments/upload/", b"x" * 11, content_length=11)
+
+        self.assertEqual(status, 413)
+        self.assertEqual(json.loads(body), {"detail": "Upload exceeds 10\xa0bytes."})
+        self.assertIsNone(self.received)
+
+    def test_body_is_cut_off_when_it_passes_the_limit(self):
+        status, _ = self.request("/api/comments/", b"x" * 6, b"x" * 6)
+
+        self.assertEqual(status, 413)
+        self.assertEqual(self.received, "disconnect")
+
+    def test_body_within_the_limit_passes(self):
+        for path in ("/api/comments/", "/api/comments/upload/", "/api/comments/7/upload/"):
+            self.assertEqual(self.request(path, b"x" * 5, b"x" * 5, content_length=10), (200, b"ok"))
+
+    def test_chunks_have_their_own_limit(self):
+        status, _ = self.request(f"/api/comments/upload/sessions/{uuid.uuid4()}/", b"x" * 5)
+
+        self.assertEqual(status, 413)
+
+    def test_other_routes_are_not_limited(self):
+        self.assertEqual(self.request("/api/token/", b"x" * 20, content_length=20), (200, b"ok"))
+
+
+class BlobTests(MediaTestCase):
+    def test_same_bytes_are_stored_once(self):
+        first = self.upload("a.txt", b"same bytes\n").json()
+        second = self.upload("b.txt", b"same bytes\n").json()
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(first["file"], second["file"])
+        blob_files = [name for name in self.stored_files() if name.startswith("blobs/")]
+        self.assertEqual(blob_files, [blob.file.name])
+
+    def test_last_reference_deletes_blob_and_file(self):
+        ids = [self.upload(name, b"same bytes\n").json()["id"] for name in ("a.txt", "b.txt")]
+        blob = Blob.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attachment.objects.get(id=ids[0]).delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attachment.objects.get(id=ids[1]).delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_upload_racing_a_release_gets_its_own_file(self):
+        old = acquire_blob(SimpleUploadedFile("a.txt", b"same bytes\n"))
+        with self.captureOnCommitCallbacks() as pending:
+            release_blob(old.id)
+
+        # Same bytes again before the release's file deletion ran
+        new = acquire_blob(SimpleUploadedFile("b.txt", b"same bytes\n"))
+        for callback in pending:
+            callback()
+
+        self.assertNotEqual(new.file.name, old.file.name)
+        self.assertTrue(default_storage.exists(new.file.name))
+        self.assertFalse(default_storage.exists(old.file.name))
+
+
+class OrphanCollectionTests(MediaTestCase):
+    def test_only_expired_unbound_uploads_are_collected(self):
+        expired = self.upload("old.txt", b"old\n").json()
+        fresh = self.upload("new.txt", b"new\n").json()
+        bound = self.upload("bound.txt", b"bound\n").json()
+        self.post_comment(attachment_ids=[bound["id"]], upload_key=bound["upload_key"])
+        Attachment.objects.exclude(id=fresh["id"]).update(uploaded_at=timezone.now() - timedelta(days=2))
+        expired_file = Attachment.objects.get(id=expired["id"]).file.name
+
+        self.assertEqual(collect_orphaned_attachments(ttl_seconds=3600, dry_run=True)["attachments"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = collect_orphaned_attachments(ttl_seconds=3600, batch_size=1)
+
+        self.assertEqual(stats, {"attachments": 1, "bytes": 4, "batches": 1})
+        self.assertEqual(
+            set(Attachment.objects.values_list("id", flat=True)), {fresh["id"], bound["id"]}
+        )
+        self.assertFalse(default_storage.exists(expired_file))
+
+
+class ChunkedUploadTests(MediaTestCase):
+    content = b"0123456789" * 10
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post(
+            "/api/comments/upload/sessions/",
+            {"file_name": "notes.txt", "size": len(self.content)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.url = f"/api/comments/upload/sessions/{response.json()['id']}/"
+
+    def put(self, start, end):
+        return self.client.put(
+            self.url,
+            self.content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}",
+        )
+
+    def test_chunks_continue_at_the_offset(self):
+        self.assertEqual(self.put(0, 40).json(), {"offset": 40})
+        self.assertEqual(self.client.get(self.url).json()["offset"], 40)
+        self.assertEqual(self.put(40, 100).json(), {"offset": 100})
+
+        response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 201, response.content)
+        attachment = Attachment.objects.get(id=response.json()["id"])
+        self.assertEqual(attachment.file.read(), self.content)
+
+        again = self.client.post(f"{self.url}complete/")
+        self.assertEqual((again.status_code, again.json()["id"]), (200, attachment.id))
+
+    def test_chunk_not_at_the_offset_is_409(self):
+        self.put(0, 40)
+
+        for start, end in ((0, 40), (60, 100)):
+            response = self.put(start, end)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()["offset"], 40)
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        self.put(0, 40)
+
+        response = self.client.post(f"{self.url}complete/")
+        self.assertEqual((response.status_code, response.json()["offset"]), (409, 40))
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_abort_removes_the_session(self):
+        self.put(0, 40)
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+@unittest.skipIf(ThreadedMotoServer is None, "needs boto3, django-storages and moto")
+class DirectUploadTests(MediaTestCase):
+    """
+    Direct uploads against an in-process S3 server (moto) standing in for
+    MinIO.
+    """
+
+    bucket = "comments"
+
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        cls.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        endpoint = f"http://{host}:{port}"
+        credentials = {"aws_access_key_id": "test", "aws_secret_access_key": "test"}
+        boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", **credentials).create_bucket(
+            Bucket=cls.bucket
+        )
+
+        cls.s3_override = override_settings(
+            STORAGES={
+                "default": {"BACKEND": "comments.s3.AttachmentS3Storage"},
+                "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+            },
+            AWS_STORAGE_BUCKET_NAME=cls.bucket,
+            AWS_S3_ENDPOINT_URL=endpoint,
+            AWS_ACCESS_KEY_ID="test",
+            AWS_SECRET_ACCESS_KEY="test",
+            AWS_S3_REGION_NAME="us-east-1",
+            AWS_S3_ADDRESSING_STYLE="path",
+            AWS_QUERYSTRING_AUTH=False,
+            AWS_S3_FILE_OVERWRITE=False,
+        )
+        cls.s3_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.s3_override.disable()
+        cls.server.stop()
+
+    def start(self, name, content):
+        response = self.client.post(
+            "/api/comments/upload/direct/", {"file_name": name, "size": len(content)}, format="json"
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def send(self, post, name, content):
+        # What the browser does: a multipart POST straight to the bucket
+        body = encode_multipart(BOUNDARY, {**post["fields"], "file": SimpleUploadedFile(name, content)})
+        request = urllib.request.Request(post["url"], data=body, headers={"Content-Type": MULTIPART_CONTENT})
+        with urllib.request.urlopen(request) as response:
+            return response.status
+
+    def head(self, name):
+        return default_storage.bucket.meta.client.head_object(Bucket=self.bucket, Key=name)
+
+    def test_upload_goes_to_the_bucket_and_becomes_a_blob(self):
+        session = self.start("notes.txt", b"hello bucket\n")
+        self.assertEqual(self.send(session["post"], "notes.txt", b"hello bucket\n"), 204)
+
+        response = self.client.post(f"/api/comments/upload/sessions/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 201, response.content)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(b"hello bucket\n").hexdigest())
+        self.assertEqual(self.head(blob.file.name)["CacheControl"], "public, max-age=31536000, immutable")
+        self.assertFalse(default_storage.exists(f"incoming/{session['id']}/notes.txt"))
+
+    def test_completion_checks_the_uploaded_bytes(self):
+        session = self.start("photo.png", b"x" * len(PNG_1X1))
+        self.send(session["post"], "photo.png", b"x" * len(PNG_1X1))
+
+        response = self.client.post(f"/api/comments/upload/sessions/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Blob.objects.exists())
+
+    def test_not_uploaded_yet_is_409(self):
+        session = self.start("notes.txt", b"hello\n")
+
+        response = self.client.post(f"/api/comments/upload/sessions/{session['id']}/complete/")
+        self.assertEqual((response.status_code, response.json()["offset"]), (409, 0))
+
+    def test_staged_object_is_not_cached_as_immutable(self):
+        name = default_storage.save("incoming/x/notes.txt", ContentFile(b"hello\n"))
+        self.assertNotIn("CacheControl", self.head(name))
+
+
+class DirectUploadDisabledTests(MediaTestCase):
+    def test_without_a_bucket_direct_uploads_are_404(self):
+        response = self.client.post(
+            "/api/comments/upload/direct/", {"file_name": "a.txt", "size": 3}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class UploadSessionOwnershipTests(MediaTestCase):
+    def test_only_the_owner_can_use_a_session(self):
+        response = self.client.post(
+            "/api/comments/upload/sessions/", {"file_name": "dot.png", "size": len(PNG_1X1)}, format="json"
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        url = f"/api/comments/upload/sessions/{response.json()['id']}/"
+        self.assertEqual(UploadSession.objects.get().user, self.user)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("other", "other@example.com", "pw"))
+        chunk = {
+            "content_type": "application/octet-stream",
+            "HTTP_CONTENT_RANGE": f"bytes 0-{len(PNG_1X1) - 1}/{len(PNG_1X1)}",
+        }
+        self.assertEqual(other.get(url).status_code, 404)
+        self.assertEqual(other.put(url, PNG_1X1, **chunk).status_code, 404)
+        self.assertEqual(other.post(f"{url}complete/").status_code, 404)
+        self.assertEqual(other.delete(url).status_code, 404)
+
+        response = self.client.put(url, PNG_1X1, **chunk)
+        self.assertEqual(response.json(), {"offset": len(PNG_1X1)})
+        self.assertEqual(self.client.post(f"{url}complete/").status_code, 201)
+
+
+class AttachmentMetadataTests(MediaTestCase):
+    def backfill(self):
+        out = io.StringIO()
+        # Threads instead of spawned processes: the workers see the test's MEDIA_ROOT
+        with mock.patch(
+            "comments.management.commands.backfill_attachment_metadata.ProcessPoolExecutor",
+            lambda max_workers, mp_context, initializer: ThreadPoolExecutor(max_workers),
+        ):
+            call_command("backfill_attachment_metadata", workers=2, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def metadata(self):
+        return {
+            "attachments": list(Attachment.objects.order_by("id").values_list(*METADATA_FIELDS)),
+            "blobs": list(Blob.objects.order_by("id").values_list(*METADATA_FIELDS)),
+        }
+
+    def test_upload_records_metadata(self):
+        content = image_bytes((40, 30), "PNG")
+        data = self.upload("photo.png", content).json()
+
+        expected = {
+            "width": 40,
+            "height": 30,
+            "size": len(content),
+            "content_type": "image/png",
+            "sha256": hashlib.sha256(content).hexdigest(),
+        }
+        self.assertEqual({field: data[field] for field in METADATA_FIELDS}, expected)
+        attachment = Attachment.objects.get(id=data["id"])
+        self.assertEqual({field: getattr(attachment, field) for field in METADATA_FIELDS}, expected)
+
+        data = self.upload("notes.txt", b"notes\n").json()
+        self.assertEqual(
+            [data[field] for field in METADATA_FIELDS],
+            [None, None, 6, "text/plain", hashlib.sha256(b"notes\n").hexdigest()],
+        )
+
+    def test_backfill_fills_missing_metadata_once(self):
+        image = image_bytes((40, 30), "PNG")
+        self.upload("photo.png", image)
+        self.upload("notes.txt", b"notes\n")
+        name = default_storage.save("attachments/1/old.png", ContentFile(image))
+        Attachment.objects.create(file=name, name="old.png")
+        missing = default_storage.save("attachments/1/gone.txt", ContentFile(b"gone\n"))
+        Attachment.objects.create(file=missing, name="gone.txt")
+        default_storage.delete(missing)
+
+        complete = self.metadata()
+        blank = {"width": None, "height": None, "size": None, "content_type": "", "sha256": ""}
+        Attachment.objects.update(**blank)
+        Blob.objects.update(width=None, height=None, content_type="")
+
+        output = self.backfill()
+
+        self.assertIn("2 blobs probed, 2 attachments copied from blobs, 2 older attachments probed", output)
+        complete["attachments"][2] = (40, 30, len(image), "image/png", hashlib.sha256(image).hexdigest())
+        complete["attachments"][3] = (None, None, None, "text/plain", "")
+        self.assertEqual(self.metadata(), complete)
+
+        output = self.backfill()
+
+        self.assertIn("0 blobs probed, 0 attachments copied from blobs, 0 older attachments probed", output)
+        self.assertEqual(self.metadata(), complete)
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from typing import Iterable, List
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q, aprefetch_related_objects, prefetch_related_objects
+
+from .models import Comment, path_upper_bound
+
+
+def _descendants_by_path(nodes: List[Comment]):
+    """
+    Queryset of every descendant of the given comments (ONE query),
+    as index range scans on (thread_root, path).
+    """
+    root_ids = [n.id for n in nodes if n.parent_id is None]
+    condition = Q(thread_root_id__in=root_ids, depth__gt=0) if root_ids else Q()
+
+    for node in nodes:
+        if node.parent_id is not None:
+            condition |= Q(
+                thread_root_id=node.thread_root_id,
+                path__gt=node.path,
+                path__lt=path_upper_bound(node.path),
+            )
+
+    return Comment.objects.filter(condition).order_by("path")
+
+
+def _fetch_descendants_by_path(nodes: List[Comment]) -> List[Comment]:
+    if not nodes:
+        return []
+    return list(_descendants_by_path(nodes))
+
+
+def _fetch_descendants_by_cte(node_ids: List[int]) -> List[Comment]:
+    """
+    Return every descendant of the given comments in ONE query.
+
+    Uses a recursive CTE (supported by both PostgreSQL and SQLite).
+    Only needed for comments whose path was not backfilled yet
+    (see the backfill_comment_paths command).
+    """
+    if not node_ids:
+        return []
+
+    table = Comment._meta.db_table
+    placeholders = ", ".join(["%s"] * len(node_ids))
+    sql = f"""
+        WITH RECURSIVE tree AS (
+            SELECT c.* FROM {table} c WHERE c.parent_id IN ({placeholders})
+            UNION ALL
+            SELECT c.* FROM {table} c JOIN tree t ON c.parent_id = t.id
+        )
+        SELECT * FROM tree
+    """
+    return list(Comment.objects.raw(sql, node_ids))
+
+
+def _link_children(everything: List[Comment], descendants: List[Comment]) -> None:
+    children_index = defaultdict(list)
+    for comment in descendants:
+        children_index[comment.parent_id].append(comment)
+
+    for comment in everything:
+        children = children_index.get(comment.id, [])
+        children.sort(key=lambda c: (c.created_at, c.id))
+        comment.thread_children = children
+
+
+def load_threads(nodes: Iterable[Comment]) -> List[Comment]:
+    """
+    Load the full reply tree (any depth) under each of the given comments.
+
+    Query cost is constant: one query for all descendants and one for
+    all attachments. Every loaded comment gets a ``thread_children`` list
+    (ordered by ``created_at``), which serializers use instead of hitting
+    ``obj.children`` again.
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return nodes
+
+    descendants = _fetch_descendants_by_path([n for n in nodes if n.path])
+    descendants += _fetch_descendants_by_cte([n.id for n in nodes if not n.path])
+    everything = nodes + descendants
+
+    prefetch_related_objects(everything, "attachments")
+    _link_children(everything, descendants)
+    return nodes
+
+
+async def aload_threads(nodes: Iterable[Comment]) -> List[Comment]:
+    """
+    Async load_threads(), same queries, for the async read views.
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return nodes
+
+    with_path = [n for n in nodes if n.path]
+    descendants = [c async for c in _descendants_by_path(with_path)] if with_path else []
+
+    # Raw querysets have no async iteration; only rows that were not backfilled get here
+    without_path = [n.id for n in nodes if not n.path]
+    if without_path:
+        descendants += await sync_to_async(_fetch_descendants_by_cte)(without_path)
+
+    everything = nodes + descendants
+
+    await aprefetch_related_objects(everything, "attachments")
+    _link_children(everything, descendants)
+    return nodes
+
@@ -0,0 +1,240 @@
+"""
+Streaming checks for attachment uploads.
+
+AttachmentUploadHandler runs first in the upload handler chain of the
+attachment endpoints and looks at every chunk as the multipart parser
+reads it:
+
+  - unknown extensions are rejected before any file data is read
+  - the first bytes must match the extension (JPEG / PNG / GIF magic
+    numbers, UTF-8 without NUL bytes for .txt), so a renamed executable
+    is not stored as "photo.jpg"
+  - per-type size limits (Attachment.MAX_TEXT_SIZE_BYTES for text,
+    COMMENTS_UPLOAD_MAX_IMAGE_BYTES for images) are enforced on the bytes
+    received so far
+  - the SHA-256 of each file is computed on the way and set as
+    ``uploaded_file.sha256`` (content-addressed storage, comments/blobs.py)
+
+A violation raises a DRF ValidationError from inside the parser: the rest
+of the body is not parsed, no file is stored, and the view answers 400
+with {"<field>": ["..."]}.
+
+Installed by AttachmentMultiPartParser on the views that accept files.
+
+These checks only see a body Django has already received: under ASGI
+(daphne), ASGIHandler reads the whole body into a SpooledTemporaryFile
+(memory, then disk) before any view runs. Its size is bounded earlier,
+by nginx (client_max_body_size of the upload locations) and by
+UploadBodyLimitMiddleware (core/asgi.py), which refuses a body over
+COMMENTS_UPLOAD_MAX_REQUEST_BYTES (a chunk over COMMENTS_UPLOAD_CHUNK_BYTES)
+with 413 before the handler reads it.
+"""
+
+import codecs
+import hashlib
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+
+from .models import Attachment
+
+# Extension -> content type checked by the handler
+KINDS = {
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".png": "png",
+    ".gif": "gif",
+    ".txt": "text",
+}
+
+SIGNATURES = {
+    "jpeg": (b"\xff\xd8\xff",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "gif": (b"GIF87a", b"GIF89a"),
+}
+
+# Bytes needed to recognize any of the signatures
+SNIFF_BYTES = 8
+
+# Multipart uploads: comment with files[], two-step upload, upload to a comment
+UPLOAD_ROUTES = re.compile(r"^/api/comments/(?:upload/|\d+/upload/)?$")
+# One chunk of a resumable upload (comments/chunked.py)
+CHUNK_ROUTE = re.compile(r"^/api/comments/upload/sessions/[^/]+/$")
+
+
+def size_limit(kind: str) -> int:
+    if kind == "text":
+        return Attachment.MAX_TEXT_SIZE_BYTES
+    return settings.COMMENTS_UPLOAD_MAX_IMAGE_BYTES
+
+
+def signature_matches(kind: str, head: bytes) -> bool:
+    signatures = SIGNATURES.get(kind)
+    return not signatures or head.startswith(signatures)
+
+
+def body_limit(path: str):
+    """
+    Largest request body accepted on ``path``; None for routes that take
+    no uploads.
+    """
+    if CHUNK_ROUTE.match(path):
+        return settings.COMMENTS_UPLOAD_CHUNK_BYTES
+    if UPLOAD_ROUTES.match(path):
+        return settings.COMMENTS_UPLOAD_MAX_REQUEST_BYTES
+    return None
+
+
+class UploadBodyLimitMiddleware:
+    """
+    ASGI middleware: refuses an upload body over body_limit() with 413
+    before the Django handler reads (and spools) it.
+
+    A Content-Length over the limit is answered at once; a body without
+    one is counted as it arrives and cut off when it passes the limit:
+    the application then sees a disconnect, and whatever it would send
+    is dropped.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = body_limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            return await self.reject(send, limit)
+
+        received = 0
+        rejected = False
+
+        async def receive_within_limit():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    await self.reject(send, limit)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def send_unless_rejected(message):
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, receive_within_limit, send_unless_rejected)
+
+    @staticmethod
+    async def reject(send, limit: int):
+        body = json.dumps({"detail": f"Upload exceeds {filesizeformat(limit)}."}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": 413, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class AttachmentUploadHandler(FileUploadHandler):
+    """
+    Validates uploads while they stream in; passes the data on unchanged
+    to the next handler (memory / temporary file).
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        # Field name -> digests of its files, in upload order
+        self.digests = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Whole request over the limit: refuse before parsing the body (also
+        # checked earlier under ASGI, by UploadBodyLimitMiddleware)
+        if content_length and content_length > settings.COMMENTS_UPLOAD_MAX_REQUEST_BYTES:
+            raise ValidationError(
+                {"detail": f"Upload exceeds {filesizeformat(settings.COMMENTS_UPLOAD_MAX_REQUEST_BYTES)}."}
+            )
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+
+        ext = os.path.splitext(file_name)[1].lower()
+        self.kind = KINDS.get(ext)
+        if self.kind is None:
+            allowed = ", ".join(sorted({e.lstrip(".") for e in KINDS}))
+            self.reject(f"File extension '{ext.lstrip('.')}' is not allowed. Allowed extensions are: {allowed}.")
+
+        self.limit = size_limit(self.kind)
+        self.received = 0
+        self.head = b""
+        self.sniffed = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")() if self.kind == "text" else None
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            self.reject(f"File size must be <= {filesizeformat(self.limit)}.")
+
+        if not self.sniffed:
+            self.head += raw_data[:SNIFF_BYTES]
+            if len(self.head) >= SNIFF_BYTES:
+                self.check_signature()
+
+        if self.decoder is not None:
+            self.check_text(raw_data)
+
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.sniffed:
+            self.check_signature()
+        if self.decoder is not None:
+            self.check_text(b"", final=True)
+
+        self.digests.setdefault(self.field_name, []).append(self.hasher.hexdigest())
+        # The next handler builds the uploaded file object
+        return None
+
+    def check_signature(self):
+        self.sniffed = True
+        if not signature_matches(self.kind, self.head):
+            self.reject("File content does not match its extension.")
+
+    def check_text(self, data: bytes, final: bool = False):
+        try:
+            self.decoder.decode(data, final)
+        except UnicodeDecodeError:
+            self.reject("Text files must be UTF-8 encoded.")
+        if b"\x00" in data:
+            self.reject("Text files must not contain binary data.")
+
+    def reject(self, message: str):
+        raise ValidationError({self.field_name: [message]})
+
+
+class AttachmentMultiPartParser(MultiPartParser):
+    """
+    MultiPartParser with AttachmentUploadHandler first in the chain; sets
+    ``sha256`` on every parsed file.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]
+        handler = AttachmentUploadHandler(request._request)
+        request.upload_handlers.insert(0, handler)
+
+        result = super().parse(stream, media_type, parser_context)
+
+        # Files of one field are parsed (and hashed) in order
+        for field_name, digests in handler.digests.items():
+            for uploaded_file, digest in zip(result.files.getlist(field_name), digests):
+                uploaded_file.sha256 = digest
+        return result
@@ -1,5 +1,12 @@
+from django.conf import settings
 from django.urls import path
 
+from .async_views import (
+    AsyncCommentDetailView,
+    AsyncCommentListView,
+    AsyncCommentSearchView,
+    AsyncCommentSuggestView,
+)
 from .views import (
     AttachmentTempUploadView,
     AdminCommentDeleteView,
@@ -8,21 +15,47 @@ from .views import (
     CommentDetailView,
     CommentListCreateView,
     CommentSearchAPIView,
+    CommentSuggestAPIView,
+    DirectUploadCreateView,
+    UploadSessionCompleteView,
+    UploadSessionCreateView,
+    UploadSessionView,
 )
 
+# Public read endpoints: native async views or the sync DRF views
+if settings.COMMENTS_ASYNC_VIEWS:
+    list_view = AsyncCommentListView.as_view()
+    detail_view = AsyncCommentDetailView.as_view()
+    search_view = AsyncCommentSearchView.as_view()
+    suggest_view = AsyncCommentSuggestView.as_view()
+else:
+    list_view = CommentListCreateView.as_view()
+    detail_view = CommentDetailView.as_view()
+    search_view = CommentSearchAPIView.as_view()
+    suggest_view = CommentSuggestAPIView.as_view()
+
 urlpatterns = [
-    path("", CommentListCreateView.as_view(), name="comment-list-create"),
+    path("", list_view, name="comment-list-create"),
 
     # service endpoints
     path("captcha/", CaptchaAPIView.as_view(), name="captcha"),
-    path("search/", CommentSearchAPIView.as_view(), name="comment-search"),
+    path("search/", search_view, name="comment-search"),
+    path("search/suggest/", suggest_view, name="comment-suggest"),
 
     # admin endpoints
     path("admin/comments/<int:pk>/", AdminCommentDeleteView.as_view(), name="admin-comment-delete"),
 
     # comment detail endpoints
     path("upload/", AttachmentTempUploadView.as_view(), name="attachment-temp-upload"),
-
-    path("<int:pk>/", CommentDetailView.as_view(), name="comment-detail"),
+    path("upload/sessions/", UploadSessionCreateView.as_view(), name="upload-session-create"),
+    path("upload/direct/", DirectUploadCreateView.as_view(), name="direct-upload-create"),
+    path("upload/sessions/<uuid:session_id>/", UploadSessionView.as_view(), name="upload-session"),
+    path(
+        "upload/sessions/<uuid:session_id>/complete/",
+        UploadSessionCompleteView.as_view(),
+        name="upload-session-complete",
+    ),
+
+    path("<int:pk>/", detail_view, name="comment-detail"),
     path("<int:pk>/upload/", AttachmentUploadView.as_view(), name="comment-upload"),
 ]
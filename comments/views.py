@@ -1,24 +1,61 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from captcha.helpers import captcha_image_url
 from captcha.models import CaptchaStore
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.shortcuts import get_object_or_404
 
 from rest_framework import filters, generics, parsers, status
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .documents import CommentDocument
-from .models import Attachment, Comment
+from .cache import (
+    Validators,
+    conditional_response,
+    detail_cache_key,
+    get_cached,
+    is_cacheable,
+    list_cache_key,
+    set_cached,
+    thread_root_id_of,
+    thread_versions,
+)
+from .chunked import (
+    OffsetMismatch,
+    abort_session,
+    complete_session,
+    parse_content_range,
+    write_chunk,
+)
+from .direct import direct_uploads_enabled
+from .events import publish_comment_created
+from .filters import CommentFilterBackend
+from .models import Attachment, Comment, UploadSession
+from .pagination import CommentListPagination
 from .permissions import IsStaffOrSuperuser
+from .search import (
+    cached_search,
+    cached_suggest,
+    get_search_backend,
+    parse_search_params,
+    parse_suggest_params,
+    search_payload,
+    suggest_payload,
+)
 from .serializers import (
     AttachmentCreateSerializer,
     AttachmentSerializer,
     AttachmentUploadSerializer,
     CommentCreateSerializer,
     CommentSearchResultSerializer,
+    CommentSuggestionSerializer,
     CommentSerializer,
+    DirectUploadSerializer,
+    UploadSessionSerializer,
 )
+from .tree import load_threads
+from .uploads import AttachmentMultiPartParser
 
 
 class CommentListCreateView(generics.ListCreateAPIView):
@@ -30,12 +67,13 @@ class CommentListCreateView(generics.ListCreateAPIView):
     """
 
     permission_classes = [AllowAny]
-    filter_backends = [filters.OrderingFilter]
+    filter_backends = [CommentFilterBackend, filters.OrderingFilter]
     ordering_fields = ["user_name", "email", "created_at"]
     ordering = ["-created_at"]
+    pagination_class = CommentListPagination
 
     # IMPORTANT: allow multipart for single-step files[] upload
-    parser_classes = [parsers.JSONParser, parsers.MultiPartParser, parsers.FormParser]
+    parser_classes = [parsers.JSONParser, AttachmentMultiPartParser, parsers.FormParser]
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -43,17 +81,41 @@ class CommentListCreateView(generics.ListCreateAPIView):
         return CommentSerializer
 
     def get_queryset(self):
-        return (
-            Comment.objects.filter(parent__isnull=True)
-            .select_related("parent")
-            .prefetch_related(
-                "attachments",
-                "children",
-                "children__attachments",
-                "children__children",
-                "children__children__attachments",
-            )
-        )
+        # Replies and attachments are loaded per page by load_threads()
+        return Comment.objects.filter(parent__isnull=True)
+
+    def list(self, request, *args, **kwargs):
+        cache_key = list_cache_key(request)
+        entry = get_cached(cache_key)
+        if entry is not None:
+            validators = Validators(cache_key, entry["threads"])
+            not_modified = conditional_response(request, validators)
+            return not_modified or validators.apply(Response(entry["data"]))
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        roots = list(page if page is not None else queryset)
+
+        # Versions are read before the replies are loaded (see comments/cache.py)
+        threads = thread_versions(thread_root_id_of(r) for r in roots)
+
+        validators = Validators(cache_key, threads)
+        not_modified = conditional_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        load_threads(roots)
+
+        serializer = self.get_serializer(roots, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+
+        if is_cacheable(roots):
+            set_cached(cache_key, threads, response.data)
+        return validators.apply(response)
 
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
@@ -62,12 +124,7 @@ class CommentListCreateView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         comment = serializer.save()
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "comments",
-            {"type": "comment_created", "comment_id": comment.id},
-        )
+        transaction.on_commit(lambda: publish_comment_created(comment))
 
 
 class CommentDetailView(generics.RetrieveAPIView):
@@ -75,16 +132,38 @@ class CommentDetailView(generics.RetrieveAPIView):
     GET: public
     """
 
-    queryset = Comment.objects.all().prefetch_related(
-        "attachments",
-        "children",
-        "children__attachments",
-        "children__children",
-        "children__children__attachments",
-    )
+    queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [AllowAny]
 
+    def retrieve(self, request, *args, **kwargs):
+        cache_key = detail_cache_key(request, kwargs[self.lookup_field])
+        entry = get_cached(cache_key)
+        if entry is not None:
+            validators = Validators(cache_key, entry["threads"])
+            not_modified = conditional_response(request, validators)
+            return not_modified or validators.apply(Response(entry["data"]))
+
+        comment = self.get_object()
+
+        # Comments that were not backfilled have no reliable thread version
+        if not is_cacheable([comment]):
+            load_threads([comment])
+            return Response(self.get_serializer(comment).data)
+
+        threads = thread_versions([thread_root_id_of(comment)])
+
+        validators = Validators(cache_key, threads)
+        not_modified = conditional_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        load_threads([comment])
+
+        data = self.get_serializer(comment).data
+        set_cached(cache_key, threads, data)
+        return validators.apply(Response(data))
+
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
         ctx["request"] = self.request
@@ -109,12 +188,12 @@ class CaptchaAPIView(APIView):
 class AttachmentTempUploadView(generics.CreateAPIView):
     """
     Upload attachments WITHOUT comment id (JWT only).
-    POST /api/comments/upload/
+    POST /api/comments/upload/  (file, optional upload_key of earlier uploads)
     Response: { id, file, upload_key, uploaded_at }
     """
 
     serializer_class = AttachmentUploadSerializer
-    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+    parser_classes = [AttachmentMultiPartParser, parsers.FormParser]
     permission_classes = [IsAuthenticated]
 
     def create(self, request, *args, **kwargs):
@@ -122,11 +201,109 @@ class AttachmentTempUploadView(generics.CreateAPIView):
         if not f:
             return Response({"file": ["This field is required."]}, status=status.HTTP_400_BAD_REQUEST)
 
-        instance = Attachment.objects.create(file=f)
+        instance = Attachment(file=f)
+        if request.data.get("upload_key"):
+            instance.upload_key = request.data["upload_key"]
+        try:
+            instance.full_clean()
+        except DjangoValidationError as exc:
+            return Response(exc.message_dict, status=status.HTTP_400_BAD_REQUEST)
+        instance.save()
+
         data = AttachmentUploadSerializer(instance, context={"request": request}).data
         return Response(data, status=status.HTTP_201_CREATED)
 
 
+def _offset_conflict(exc: OffsetMismatch) -> Response:
+    return Response(
+        {"detail": "Upload is not at this offset.", "offset": exc.offset},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+class UploadSessionCreateView(generics.CreateAPIView):
+    """
+    Start a resumable chunked upload (JWT only), see comments/chunked.py.
+    POST /api/comments/upload/sessions/  {file_name, size, upload_key?}
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+
+class DirectUploadCreateView(generics.CreateAPIView):
+    """
+    Start a direct upload to object storage (JWT only), see comments/direct.py.
+    POST /api/comments/upload/direct/  {file_name, size, upload_key?}
+    Response: the session + "post" {url, fields, expires_in}; finish with
+    POST /api/comments/upload/sessions/<id>/complete/.
+    404 when attachments are not stored in object storage.
+    """
+
+    serializer_class = DirectUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        if not direct_uploads_enabled():
+            raise NotFound("Direct uploads are not enabled.")
+        return super().create(request, *args, **kwargs)
+
+
+class UploadSessionView(APIView):
+    """
+    GET    /api/comments/upload/sessions/<id>/  state, "offset" = where to resume
+    PUT    /api/comments/upload/sessions/<id>/  one chunk: raw body + Content-Range
+    DELETE /api/comments/upload/sessions/<id>/  abort
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+        start, end = parse_content_range(request.headers.get("Content-Range"), session)
+        if int(request.META.get("CONTENT_LENGTH") or 0) != end - start:
+            raise ParseError("Content-Length does not match Content-Range.")
+
+        try:
+            # The body is streamed to the spool file, never parsed
+            offset = write_chunk(session, start, end, request.stream)
+        except OffsetMismatch as exc:
+            return _offset_conflict(exc)
+        return Response({"offset": offset})
+
+    def delete(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+        abort_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionCompleteView(APIView):
+    """
+    POST /api/comments/upload/sessions/<id>/complete/
+    Response: the temporary attachment, as POST /api/comments/upload/
+    (201; 200 when the session was completed before).
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        try:
+            attachment, created = complete_session(session_id, request.user)
+        except UploadSession.DoesNotExist:
+            raise NotFound()
+        except OffsetMismatch as exc:
+            return _offset_conflict(exc)
+        except DjangoValidationError as exc:
+            return Response(exc.message_dict, status=status.HTTP_400_BAD_REQUEST)
+
+        data = AttachmentUploadSerializer(attachment, context={"request": request}).data
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
 class AttachmentUploadView(generics.CreateAPIView):
     """
     Upload attachments ONLY with JWT and attach to existing comment by pk.
@@ -134,7 +311,7 @@ class AttachmentUploadView(generics.CreateAPIView):
     """
 
     serializer_class = AttachmentCreateSerializer
-    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+    parser_classes = [AttachmentMultiPartParser, parsers.FormParser]
     permission_classes = [IsAuthenticated]
 
     def create(self, request, *args, **kwargs):
@@ -160,53 +337,45 @@ class AttachmentUploadView(generics.CreateAPIView):
 
 class CommentSearchAPIView(APIView):
     """
-    GET /api/comments/search/?q=...
-    Public endpoint.
+    GET /api/comments/search/?q=...[&page_size=N][&cursor=...][&exact_total=1]
+    Public endpoint. Backend: COMMENTS_SEARCH_BACKEND (see comments/search.py).
+
+    Cursor-paginated ("next" link, no offsets); "total" is counted up to
+    COMMENTS_SEARCH_TRACK_TOTAL_HITS unless exact_total is set
+    ("total_relation": "eq" or "gte").
     """
 
     serializer_class = CommentSearchResultSerializer
     permission_classes = [AllowAny]
 
     def get(self, request, *args, **kwargs):
-        q = (request.query_params.get("q") or "").strip()
-        if not q:
-            return Response(
-                {"detail": "Query param 'q' is required."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        search = (
-            CommentDocument.search()
-            .query(
-                "multi_match",
-                query=q,
-                fields=["text", "user_name", "email"],
-                fuzziness="AUTO",
-            )
-            .extra(track_total_hits=True)[:50]
-        )
+        backend = get_search_backend()
+        params = parse_search_params(backend, request.query_params)
 
-        res = search.execute()
+        data = cached_search(backend, params)
 
-        items = [
-            {
-                "id": int(hit.id),
-                "user_name": getattr(hit, "user_name", None),
-                "email": getattr(hit, "email", None),
-                "text": getattr(hit, "text", None),
-                "created_at": getattr(hit, "created_at", None),
-            }
-            for hit in res
-        ]
+        return Response(search_payload(request, backend, params, data), status=status.HTTP_200_OK)
 
-        data = self.serializer_class(items, many=True).data
-        total = getattr(res.hits, "total", None)
-        total_value = getattr(total, "value", len(items)) if total else len(items)
 
-        return Response(
-            {"total": total_value, "items": data},
-            status=status.HTTP_200_OK,
-        )
+class CommentSuggestAPIView(APIView):
+    """
+    GET /api/comments/search/suggest/?q=<prefix>[&limit=N]
+    Public endpoint for search-as-you-type: prefix match only (no fuzzy
+    multi_match), no count, cached per prefix.
+
+    Response: {"q": <echoed query>, "suggestions": [{"id", "user_name", "text"}]}
+    """
+
+    serializer_class = CommentSuggestionSerializer
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        backend = get_search_backend()
+        params = parse_suggest_params(request.query_params)
+
+        data = cached_suggest(backend, params)
+
+        return Response(suggest_payload(params, data), status=status.HTTP_200_OK)
 
 
 class AdminCommentDeleteView(generics.DestroyAPIView):
@@ -12,11 +12,13 @@ os.environ.setdefault(
 django_asgi_app = get_asgi_application()
 
 import comments.routing  # noqa: E402
+from comments.uploads import UploadBodyLimitMiddleware  # noqa: E402
 
 
 application = ProtocolTypeRouter(
     {
-        "http": django_asgi_app,
+        # Upload bodies over their limit are refused before Django reads them
+        "http": UploadBodyLimitMiddleware(django_asgi_app),
         "websocket": AuthMiddlewareStack(
             URLRouter(comments.routing.websocket_urlpatterns)
         ),
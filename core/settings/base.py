@@ -171,6 +171,64 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Attachment uploads are checked while streaming (comments/uploads.py).
+# Whole request: keep in line with nginx client_max_body_size
+COMMENTS_UPLOAD_MAX_REQUEST_BYTES = env_int("COMMENTS_UPLOAD_MAX_REQUEST_BYTES", str(25 * 1024 * 1024))
+COMMENTS_UPLOAD_MAX_IMAGE_BYTES = env_int("COMMENTS_UPLOAD_MAX_IMAGE_BYTES", str(10 * 1024 * 1024))
+
+# Attachments in an S3-compatible bucket instead of MEDIA_ROOT (django-storages),
+# e.g. MinIO from the "s3" compose profile. Also enables direct uploads with
+# presigned POST (comments/direct.py).
+AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME", "")
+if AWS_STORAGE_BUCKET_NAME:
+    STORAGES = {
+        "default": {"BACKEND": "comments.s3.AttachmentS3Storage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+    AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL") or None
+    AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID") or None
+    AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY") or None
+    AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME", "us-east-1")
+    AWS_S3_ADDRESSING_STYLE = os.getenv("AWS_S3_ADDRESSING_STYLE", "path")
+    AWS_S3_SIGNATURE_VERSION = "s3v4"
+    # Plain (cacheable) object URLs; the bucket allows anonymous reads
+    AWS_QUERYSTRING_AUTH = False
+    AWS_S3_CUSTOM_DOMAIN = os.getenv("AWS_S3_CUSTOM_DOMAIN") or None
+    AWS_S3_URL_PROTOCOL = os.getenv("AWS_S3_URL_PROTOCOL", "https:")
+    # Never overwrite on name collision, like FileSystemStorage
+    AWS_S3_FILE_OVERWRITE = False
+
+# Cache-Control of content-addressed objects in the bucket (comments/s3.py);
+# nginx sends the same for media/blobs/ and media/attachments/v/
+COMMENTS_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Presigned POST lifetime (seconds), and the bucket endpoint as browsers reach it
+# when AWS_S3_ENDPOINT_URL is a Docker-internal host
+COMMENTS_DIRECT_UPLOAD_EXPIRES = env_int("COMMENTS_DIRECT_UPLOAD_EXPIRES", "900")
+COMMENTS_S3_PUBLIC_ENDPOINT_URL = os.getenv("COMMENTS_S3_PUBLIC_ENDPOINT_URL", "")
+
+# Resumable chunked uploads (comments/chunked.py): spool directory for the
+# partial files (must be shared by all backend replicas), largest PUT body,
+# and idle time (seconds) after which an unfinished session is deleted
+COMMENTS_UPLOAD_SESSION_DIR = os.getenv("COMMENTS_UPLOAD_SESSION_DIR", str(BASE_DIR / "upload_sessions"))
+COMMENTS_UPLOAD_CHUNK_BYTES = env_int("COMMENTS_UPLOAD_CHUNK_BYTES", str(5 * 1024 * 1024))
+COMMENTS_UPLOAD_SESSION_TTL = env_int("COMMENTS_UPLOAD_SESSION_TTL", str(24 * 3600))
+
+# Unbound temporary uploads older than this (seconds) are deleted
+COMMENTS_TMP_ATTACHMENT_TTL = env_int("COMMENTS_TMP_ATTACHMENT_TTL", str(24 * 3600))
+COMMENTS_TMP_GC_BATCH_SIZE = env_int("COMMENTS_TMP_GC_BATCH_SIZE", "500")
+# Batches per beat run
+COMMENTS_TMP_GC_MAX_BATCHES = env_int("COMMENTS_TMP_GC_MAX_BATCHES", "20")
+
+# Image derivatives rendered by a Celery task (comments/images.py):
+# 320x240 thumbnail + display size for the lightbox, each also as WebP
+COMMENTS_IMAGE_DISPLAY_WIDTH = env_int("COMMENTS_IMAGE_DISPLAY_WIDTH", "1280")
+COMMENTS_IMAGE_DISPLAY_HEIGHT = env_int("COMMENTS_IMAGE_DISPLAY_HEIGHT", "960")
+COMMENTS_IMAGE_WEBP_QUALITY = env_int("COMMENTS_IMAGE_WEBP_QUALITY", "80")
+# JPEGs are decoded at 1/2..1/8 scale down to this multiple of the target size
+# (lower = faster, 1.0 = fastest / lowest quality)
+COMMENTS_IMAGE_REDUCING_GAP = float(os.getenv("COMMENTS_IMAGE_REDUCING_GAP", "2.0"))
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
@@ -235,6 +293,37 @@ CSRF_TRUSTED_ORIGINS = env_list(
 )
 
 
+# -----------------------------------------------------------------------------
+# Redis
+# -----------------------------------------------------------------------------
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = env_int("REDIS_PORT", "6379")
+
+
+# -----------------------------------------------------------------------------
+# Cache (versioned comment responses, see comments/cache.py)
+# -----------------------------------------------------------------------------
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis").lower()
+
+if CACHE_BACKEND == "locmem":
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv(
+                "CACHE_REDIS_URL",
+                f"redis://{REDIS_HOST}:{REDIS_PORT}/2",
+            ),
+        }
+    }
+
+COMMENTS_CACHE_TIMEOUT = env_int("COMMENTS_CACHE_TIMEOUT", "300")
+
+# Serve list/detail/search GETs with the native async views (comments/async_views.py)
+COMMENTS_ASYNC_VIEWS = env_bool("COMMENTS_ASYNC_VIEWS", "1")
+
+
 # -----------------------------------------------------------------------------
 # Channels (WebSockets)
 # -----------------------------------------------------------------------------
@@ -247,14 +336,28 @@ else:
         "default": {
             "BACKEND": "channels_redis.core.RedisChannelLayer",
             "CONFIG": {
-                "hosts": [(
-                    os.getenv("REDIS_HOST", "redis"),
-                    env_int("REDIS_PORT", "6379"),
-                )],
+                "hosts": [(REDIS_HOST, REDIS_PORT)],
             },
         }
     }
 
+# Larger comment_created frames fall back to an id-only event
+COMMENTS_WS_MAX_FRAME_BYTES = env_int("COMMENTS_WS_MAX_FRAME_BYTES", "65536")
+# Thread subscriptions allowed per socket
+COMMENTS_WS_MAX_SUBSCRIPTIONS = env_int("COMMENTS_WS_MAX_SUBSCRIPTIONS", "200")
+# Events within this window are sent as one comments_batch frame (0 = off)
+COMMENTS_WS_COALESCE_MS = env_int("COMMENTS_WS_COALESCE_MS", "50")
+# Events queued per socket before one frame goes out; beyond that it is told to resync
+COMMENTS_WS_MAX_PENDING = env_int("COMMENTS_WS_MAX_PENDING", "500")
+# Sockets that ack seqs are closed (code 4000, resync) with this many frames
+# unacked, or the oldest unacked frame older than COMMENTS_WS_MAX_LAG_SECONDS
+COMMENTS_WS_MAX_UNACKED = env_int("COMMENTS_WS_MAX_UNACKED", "50")
+COMMENTS_WS_MAX_LAG_SECONDS = env_int("COMMENTS_WS_MAX_LAG_SECONDS", "30")
+# Events kept in the replay log for reconnecting sockets
+COMMENTS_EVENT_LOG_SIZE = env_int("COMMENTS_EVENT_LOG_SIZE", "10000")
+# Missed events replayed on resume; longer gaps get a resync
+COMMENTS_EVENT_REPLAY_LIMIT = env_int("COMMENTS_EVENT_REPLAY_LIMIT", "1000")
+
 
 # -----------------------------------------------------------------------------
 # Celery
@@ -274,6 +377,24 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = os.getenv("CELERY_TIMEZONE", TIME_ZONE)
 
+CELERY_BEAT_SCHEDULE = {
+    # Safety net for the indexing queue (normally drained by tasks scheduled on write)
+    "comments-index-queue": {
+        "task": "comments.tasks.index_pending_comments",
+        "schedule": 60.0,
+    },
+    # Temporary uploads never bound to a comment (comments/cleanup.py)
+    "comments-cleanup-attachments": {
+        "task": "comments.tasks.cleanup_orphaned_attachments",
+        "schedule": 3600.0,
+    },
+    # WebSocket replay log (comments/events.py)
+    "comments-prune-events": {
+        "task": "comments.tasks.prune_comment_events",
+        "schedule": 300.0,
+    },
+}
+
 
 # -----------------------------------------------------------------------------
 # Elasticsearch (optional)
@@ -281,7 +402,38 @@ CELERY_TIMEZONE = os.getenv("CELERY_TIMEZONE", TIME_ZONE)
 if ELASTICSEARCH_ENABLED:
     ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST", "http://elasticsearch:9200")
     ELASTICSEARCH_DSL = {"default": {"hosts": ELASTICSEARCH_HOST}}
-    ELASTICSEARCH_DSL_AUTOSYNC = env_bool("ELASTICSEARCH_DSL_AUTOSYNC", "1")
+    # Off: comments are indexed by a Celery task (comments/indexing.py), not in the request
+    ELASTICSEARCH_DSL_AUTOSYNC = env_bool("ELASTICSEARCH_DSL_AUTOSYNC", "0")
+
+# Queued indexing: Redis sorted set of pending ids, drained in bulk batches
+COMMENTS_INDEX_QUEUE_URL = os.getenv(
+    "COMMENTS_INDEX_QUEUE_URL",
+    f"redis://{REDIS_HOST}:{REDIS_PORT}/3",
+)
+# Seconds to wait before draining, so bursts go out in one bulk request
+COMMENTS_INDEX_DELAY = env_int("COMMENTS_INDEX_DELAY", "1")
+COMMENTS_INDEX_BATCH_SIZE = env_int("COMMENTS_INDEX_BATCH_SIZE", "500")
+# Batches per task run before it hands over to a fresh task
+COMMENTS_INDEX_MAX_BATCHES = env_int("COMMENTS_INDEX_MAX_BATCHES", "20")
+
+# auto | elasticsearch | postgres | database | dotted path (see comments/search.py).
+# "auto" picks Elasticsearch when enabled, else PostgreSQL full-text search.
+COMMENTS_SEARCH_BACKEND = os.getenv("COMMENTS_SEARCH_BACKEND", "auto")
+
+# Search pages: cursor pagination, totals counted up to TRACK_TOTAL_HITS
+# ("gte" beyond it, ?exact_total=1 for the exact number)
+COMMENTS_SEARCH_PAGE_SIZE = env_int("COMMENTS_SEARCH_PAGE_SIZE", "20")
+COMMENTS_SEARCH_MAX_PAGE_SIZE = env_int("COMMENTS_SEARCH_MAX_PAGE_SIZE", "50")
+COMMENTS_SEARCH_TRACK_TOTAL_HITS = env_int("COMMENTS_SEARCH_TRACK_TOTAL_HITS", "1000")
+# Seconds a result page stays cached (also dropped on every comment change)
+COMMENTS_SEARCH_CACHE_TIMEOUT = env_int("COMMENTS_SEARCH_CACHE_TIMEOUT", "30")
+
+# Search-as-you-type (/api/comments/search/suggest/), cached like search pages
+COMMENTS_SUGGEST_MIN_CHARS = env_int("COMMENTS_SUGGEST_MIN_CHARS", "2")
+COMMENTS_SUGGEST_LIMIT = env_int("COMMENTS_SUGGEST_LIMIT", "8")
+COMMENTS_SUGGEST_MAX_LIMIT = env_int("COMMENTS_SUGGEST_MAX_LIMIT", "20")
+# Characters of comment text shown per suggestion
+COMMENTS_SUGGEST_TEXT_LENGTH = env_int("COMMENTS_SUGGEST_TEXT_LENGTH", "120")
 
 
 # -----------------------------------------------------------------------------
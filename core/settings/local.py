@@ -12,6 +12,14 @@ SECURE_SSL_REDIRECT = False
 SESSION_COOKIE_SECURE = False
 CSRF_COOKIE_SECURE = False
 
+# -----------------------------------------------------------------------------
+# Cache (local)
+# -----------------------------------------------------------------------------
+# In-process cache unless CACHE_BACKEND=redis is set explicitly
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem").lower()
+if CACHE_BACKEND == "locmem":
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 # -----------------------------------------------------------------------------
 # Elasticsearch (local)
 # -----------------------------------------------------------------------------
@@ -22,7 +30,8 @@ CSRF_COOKIE_SECURE = False
 #   ELASTICSEARCH_REQUIRED=1|0
 #
 ELASTICSEARCH_ENABLED = env_bool("ELASTICSEARCH_ENABLED", "1")
-ELASTICSEARCH_DSL_AUTOSYNC = env_bool("ELASTICSEARCH_DSL_AUTOSYNC", "1")
+# Indexing goes through the Celery queue (comments/indexing.py) unless forced on
+ELASTICSEARCH_DSL_AUTOSYNC = env_bool("ELASTICSEARCH_DSL_AUTOSYNC", "0")
 ELASTICSEARCH_REQUIRED = env_bool("ELASTICSEARCH_REQUIRED", "0")
 
 ELASTICSEARCH_HOST = os.getenv(
@@ -1,5 +1,5 @@
 // frontend/src/api/comments.js
-import { apiGet, apiPostJson, apiPostForm, apiDelete } from "./index";
+import { apiGet, apiPostJson, apiPostForm, apiPutRaw, apiDelete } from "./index";
 
 function getAccessToken() {
   const t = localStorage.getItem("access");
@@ -59,17 +59,114 @@ export function createCommentWithFiles(formData) {
   return apiPostForm("/api/comments/", formData);
 }
 
+// Files above this size use the resumable chunked upload
+const CHUNKED_UPLOAD_THRESHOLD = 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+/**
+ * Resumable upload: POST /api/comments/upload/sessions/, PUT chunks with
+ * Content-Range, POST .../complete/. A failed chunk is retried from the
+ * offset the server reports, so a dropped connection re-sends one chunk.
+ */
+export async function uploadFileChunked(file, uploadKey = null) {
+  const session = await apiPostJson("/api/comments/upload/sessions/", {
+    file_name: file.name,
+    size: file.size,
+    ...(uploadKey ? { upload_key: uploadKey } : {}),
+  });
+  const url = `/api/comments/upload/sessions/${session.id}/`;
+
+  let offset = session.offset;
+  let failures = 0;
+  while (offset < file.size) {
+    const end = Math.min(offset + session.chunk_size, file.size);
+    try {
+      const res = await apiPutRaw(url, file.slice(offset, end), {
+        headers: { "Content-Range": `bytes ${offset}-${end - 1}/${file.size}` },
+      });
+      offset = res.offset;
+      failures = 0;
+    } catch (e) {
+      // 409: the server has a different offset (e.g. an earlier try arrived)
+      if (e.status === 409 && e.payload?.offset != null) {
+        offset = e.payload.offset;
+        continue;
+      }
+      if (e.status && e.status < 500) throw e;
+      if (++failures > CHUNK_RETRIES) throw e;
+      await sleep(Math.min(1000 * 2 ** failures, 15000));
+      offset = (await apiGet(url)).offset;
+    }
+  }
+
+  return apiPostJson(`${url}complete/`, {});
+}
+
+// Unknown until the first try; false once the backend answers 404
+let directUploads = true;
+
+/**
+ * Direct upload to object storage: POST /api/comments/upload/direct/ for a
+ * presigned POST, send the file to the bucket (no JWT), POST .../complete/.
+ * Throws with status 404 when the backend stores files locally.
+ */
+export async function uploadFileDirect(file, uploadKey = null) {
+  const session = await apiPostJson("/api/comments/upload/direct/", {
+    file_name: file.name,
+    size: file.size,
+    ...(uploadKey ? { upload_key: uploadKey } : {}),
+  });
+
+  const fd = new FormData();
+  Object.entries(session.post.fields).forEach(([name, value]) => fd.append(name, value));
+  // S3 ignores form fields after the file
+  fd.append("file", file);
+  const res = await fetch(session.post.url, { method: "POST", body: fd });
+  if (!res.ok) {
+    const err = new Error(`HTTP ${res.status}`);
+    err.status = res.status;
+    err.payload = await res.text().catch(() => "");
+    throw err;
+  }
+
+  return apiPostJson(`/api/comments/upload/sessions/${session.id}/complete/`, {});
+}
+
 /**
  * Variant C: upload files first, then create comment with attachment_ids + upload_key.
  * Endpoint must exist on backend: POST /api/comments/upload/
+ * All files share the upload_key of the first one.
  */
 export async function uploadFiles(files) {
   const uploaded = [];
+  let uploadKey = null;
 
   for (const file of files || []) {
-    const fd = new FormData();
-    fd.append("file", file);
-    const one = await apiPostForm("/api/comments/upload/", fd);
+    let one = null;
+    if (directUploads) {
+      try {
+        one = await uploadFileDirect(file, uploadKey);
+      } catch (e) {
+        if (e.status !== 404) throw e;
+        directUploads = false;
+      }
+    }
+
+    if (one) {
+      // sent straight to object storage
+    } else if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      one = await uploadFileChunked(file, uploadKey);
+    } else {
+      const fd = new FormData();
+      fd.append("file", file);
+      if (uploadKey) fd.append("upload_key", uploadKey);
+      one = await apiPostForm("/api/comments/upload/", fd);
+    }
+    uploadKey = uploadKey || one.upload_key;
     uploaded.push(one);
   }
 
@@ -140,6 +140,29 @@ export async function apiPostForm(path, formData, opts = {}) {
   if (!res.ok) throw makeError(res, payload.data ?? payload.text);
   return payload.data ?? payload.text;
 }
+/**
+ * PUT a raw body (Blob / ArrayBuffer), e.g. one chunk of a resumable upload.
+ */
+export async function apiPutRaw(path, body, opts = {}) {
+  const res = await request(
+    path,
+    {
+      method: "PUT",
+      body,
+      ...opts,
+      headers: {
+        "Content-Type": "application/octet-stream",
+        ...(opts.headers || {}),
+      },
+    },
+    { withAuth: true, retryOn401: false }
+  );
+
+  const payload = await readPayload(res);
+  if (!res.ok) throw makeError(res, payload.data ?? payload.text);
+  return payload.data ?? payload.text;
+}
+
 export async function apiDelete(path, opts = {}) {
   const res = await request(
     path,
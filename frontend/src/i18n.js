@@ -94,6 +94,7 @@ const messages = {
       deleteTitle: "Delete comment",
       deleteConfirm: "Delete this comment?",
       deleteFailed: "Failed to delete comment",
+      imageProcessing: "Processing image...",
     },
     common: {
       loading: "Loading...",
@@ -191,6 +192,7 @@ const messages = {
       deleteTitle: "Удалить комментарий",
       deleteConfirm: "Удалить этот комментарий?",
       deleteFailed: "Не удалось удалить комментарий",
+      imageProcessing: "Обработка изображения...",
     },
     common: {
       loading: "Загрузка...",
@@ -286,6 +288,7 @@ const messages = {
       deleteTitle: "Видалити коментар",
       deleteConfirm: "Видалити цей коментар?",
       deleteFailed: "Не вдалося видалити коментар",
+      imageProcessing: "Обробка зображення...",
     },
     common: {
       loading: "Завантаження...",
@@ -381,6 +384,7 @@ const messages = {
       deleteTitle: "Kommentar löschen",
       deleteConfirm: "Diesen Kommentar löschen?",
       deleteFailed: "Kommentar konnte nicht gelöscht werden",
+      imageProcessing: "Bild wird verarbeitet...",
     },
     common: {
       loading: "Lädt...",